@@ -0,0 +1,86 @@
+"""
+AI流式分析压测
+
+在本地模拟AI服务上并发运行AIAnalyzer流式分析，统计首个内容片段延迟、总耗时和事件数，
+用于在不消耗真实API额度的情况下评估并发、限流和流式合并的效果。
+
+用法: python -m benchmarks.bench_ai_stream [--requests 50] [--concurrency 10] [--ttft 0.3] [--tps 100]
+"""
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from services.ai_analyzer import AIAnalyzer
+from services.ai_result_cache import AIResultCache
+from services.technical_indicator import TechnicalIndicator
+from tests.mock_llm_server import MockLLMServer
+from tests.test_indicator_executor import _make_bars
+
+
+def percentile(values, q):
+    """计算分位数"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def run_one(analyzer, df, index):
+    """运行一次流式分析，返回(首片段延迟, 总耗时, 事件数, 是否成功)"""
+    started = time.perf_counter()
+    first = None
+    events = 0
+    ok = False
+    async for event in analyzer.get_ai_analysis(df, f"{600000 + index}", 'A', stream=True):
+        events += 1
+        data = json.loads(event)
+        if first is None and 'ai_analysis_chunk' in data:
+            first = time.perf_counter() - started
+        ok = data.get('status') == 'completed'
+    return first or 0.0, time.perf_counter() - started, events, ok
+
+
+async def run(args, server):
+    analyzer = AIAnalyzer(custom_api_url=server.url, custom_api_key='bench', custom_api_model='mock')
+    analyzer.result_cache = AIResultCache(ttl=0)
+    df = TechnicalIndicator().calculate_indicators(_make_bars(1))
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(index):
+        async with semaphore:
+            return await run_one(analyzer, df, index)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(bounded(i) for i in range(args.requests)))
+    return results, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI流式分析压测")
+    parser.add_argument("--requests", type=int, default=50, help="请求总数")
+    parser.add_argument("--concurrency", type=int, default=10, help="客户端并发数")
+    parser.add_argument("--ttft", type=float, default=0.3, help="模拟服务首字延迟（秒）")
+    parser.add_argument("--tps", type=float, default=100, help="模拟服务每秒输出token数")
+    parser.add_argument("--output-tokens", type=int, default=300, help="每次输出的token数")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="模拟服务每个事件的token数")
+    args = parser.parse_args()
+
+    server = MockLLMServer(ttft=args.ttft, tokens_per_second=args.tps, output_tokens=args.output_tokens,
+                           chunk_tokens=args.chunk_tokens).start()
+    try:
+        results, elapsed = asyncio.run(run(args, server))
+    finally:
+        server.stop()
+
+    ttfts = [r[0] for r in results if r[3]]
+    totals = [r[1] for r in results if r[3]]
+    failed = sum(1 for r in results if not r[3])
+    print(f"请求: {args.requests}, 并发: {args.concurrency}, 失败: {failed}, 总耗时: {elapsed:.2f}s, "
+          f"吞吐: {args.requests / elapsed:.1f} 次/秒")
+    if ttfts:
+        print(f"首片段延迟: p50={percentile(ttfts, 0.5) * 1000:.0f}ms p95={percentile(ttfts, 0.95) * 1000:.0f}ms")
+        print(f"单次耗时:   p50={percentile(totals, 0.5):.2f}s p95={percentile(totals, 0.95):.2f}s")
+        print(f"平均事件数: {statistics.mean(r[2] for r in results):.1f}")
+
+
+if __name__ == "__main__":
+    main()
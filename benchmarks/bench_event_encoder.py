@@ -0,0 +1,104 @@
+"""
+流式事件编码微基准
+
+对比原有的json.dumps（先把numpy标量转换为float、再拼接换行并编码为字节）与
+utils.event_encoder在典型扫描输出（评分事件、AI分析片段和完成事件）上的吞吐。
+
+用法: python -m benchmarks.bench_event_encoder [股票数] [每只股票的分析片段数]
+"""
+import sys
+import json
+import time
+import numpy as np
+from utils import event_encoder
+from utils.event_encoder import encode_event
+
+
+def build_events(stocks: int, chunks: int, seed: int = 0):
+    """生成一次批量扫描的合成事件，数值字段为numpy标量，与指标DataFrame中取出的值一致"""
+    rng = np.random.default_rng(seed)
+    events = [{"stream_type": "batch", "stock_codes": [f"{600000 + i}" for i in range(stocks)], "market_type": "A"}]
+    for i in range(stocks):
+        code = f"{600000 + i}"
+        events.append({
+            "stock_code": code,
+            "score": int(rng.integers(0, 100)),
+            "recommendation": "买入",
+            "price": np.float64(rng.uniform(5, 200)),
+            "price_change_value": np.float64(rng.normal()),
+            "price_change": np.float64(rng.normal(0, 2)),
+            "change_percent": np.float64(rng.normal(0, 2)),
+            "rsi": np.float64(rng.uniform(0, 100)),
+            "ma_trend": "UP",
+            "macd_signal": "BUY",
+            "volume_status": "NORMAL",
+            "bar_date": "2024-06-28",
+            "status": "waiting",
+        })
+        for j in range(chunks):
+            events.append({"stock_code": code, "ai_analysis_chunk": f"第{j}段分析：股价站上MA20，量能温和放大。\n",
+                           "status": "analyzing"})
+        events.append({"stock_code": code, "status": "completed", "score": int(rng.integers(0, 100)),
+                       "recommendation": "持有", "queue_wait": 0.012,
+                       "telemetry": {"status": "completed", "ttft": 0.41, "duration": 3.2, "output_chars": 800,
+                                     "output_tokens": 400, "tokens_per_second": 142.5}})
+    events.append({"scan_completed": True, "total_scanned": stocks, "total_matched": stocks, "timed_out": []})
+    return events
+
+
+def _plain(value):
+    """原有实现中手工把numpy标量转换为Python类型"""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def legacy_encode(events):
+    """原有实现：转换数值后json.dumps，再拼接换行并由服务器编码为UTF-8"""
+    return [(json.dumps({key: _plain(value) for key, value in event.items()}) + '\n').encode('utf-8')
+            for event in events]
+
+
+def encoder_encode(events):
+    """统一编码器：直接输出以换行结尾的字节"""
+    return [encode_event(event) for event in events]
+
+
+def bench(func, events, repeat: int = 5):
+    """取多次运行的最短耗时"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(events)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    stocks = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    chunks = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    events = build_events(stocks, chunks)
+
+    print(f"事件数: {len(events)}, 编码器后端: {event_encoder.BACKEND}")
+    candidates = [("json.dumps", legacy_encode), (f"encoder[{event_encoder.BACKEND}]", encoder_encode)]
+    if event_encoder.BACKEND != 'json':
+        # 同时测量未安装orjson时的回退路径
+        def fallback_encode(items):
+            event_encoder.BACKEND = 'json'
+            try:
+                return encoder_encode(items)
+            finally:
+                event_encoder.BACKEND = 'orjson'
+        candidates.append(("encoder[json]", fallback_encode))
+
+    baseline = None
+    for name, func in candidates:
+        elapsed, lines = bench(func, events)
+        baseline = baseline or elapsed
+        size = sum(map(len, lines))
+        print(f"{name:16s} {elapsed * 1000:8.1f} ms  {len(events) / elapsed:10.0f} 事件/秒  "
+              f"{size / 1024:8.0f} KB  相对: {baseline / elapsed:4.1f}x")
+
+
+if __name__ == '__main__':
+    main()
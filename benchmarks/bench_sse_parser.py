@@ -0,0 +1,104 @@
+"""
+SSE流解析微基准
+
+对比原有逐块split并用字符串累加内容的方式与增量SSEParser，
+在长合成流（可指定事件数和分块大小）上的耗时。
+
+用法: python -m benchmarks.bench_sse_parser [事件数] [分块大小]
+"""
+import sys
+import json
+import time
+import random
+from utils.sse_parser import SSEParser, parse_stream_payload
+
+
+def build_stream(events: int, chunk_size: int, seed: int = 0):
+    """生成OpenAI兼容格式的合成流并按近似chunk_size随机切块"""
+    rng = random.Random(seed)
+    text = ''.join(
+        "data: " + json.dumps({"choices": [{"delta": {"content": f"分析内容{i}，"}, "finish_reason": None}]}) + "\n\n"
+        for i in range(events)
+    ) + "data: [DONE]\n\n"
+    chunks, pos = [], 0
+    while pos < len(text):
+        size = rng.randint(max(1, chunk_size // 2), chunk_size * 2)
+        chunks.append(text[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def legacy_parse(chunks):
+    """原有实现：逐块split，字符串累加内容，跨块事件会被丢弃"""
+    buffer = ""
+    for chunk in chunks:
+        for line in chunk.strip().split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("data: "):
+                line = line[6:]
+            if line == "[DONE]":
+                continue
+            if "error" in line.lower():
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # 被截断的片段可能恰好是合法JSON（如数组），原实现会因此抛出异常中断分析
+            if not isinstance(data, dict):
+                continue
+            content = data.get("choices", [{}])[0].get("delta", {}).get("content", "")
+            if content:
+                buffer += content
+    return buffer
+
+
+def incremental_parse(chunks):
+    """增量解析：跨块保留未完成的行，内容收集到列表"""
+    parser = SSEParser()
+    collected = []
+
+    def handle(payloads):
+        for payload in payloads:
+            if payload == "[DONE]":
+                continue
+            data = parse_stream_payload(payload)
+            if data is None or "error" in data:
+                continue
+            content = (data.get("choices") or [{}])[0].get("delta", {}).get("content")
+            if content:
+                collected.append(content)
+
+    for chunk in chunks:
+        handle(parser.feed(chunk))
+    handle(parser.close())
+    return ''.join(collected)
+
+
+def bench(func, chunks, repeat: int = 3):
+    """取多次运行的最短耗时"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(chunks)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    chunks = build_stream(events, chunk_size)
+    expected = ''.join(f"分析内容{i}，" for i in range(events))
+
+    print(f"事件数: {events}, 分块数: {len(chunks)}, 平均分块大小: {sum(map(len, chunks)) / len(chunks):.0f}")
+    for name, func in (("legacy", legacy_parse), ("incremental", incremental_parse)):
+        elapsed, content = bench(func, chunks)
+        print(f"{name:12s} {elapsed * 1000:9.1f} ms  内容完整: {content == expected}  "
+              f"丢失字符: {len(expected) - len(content)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+扫描结果响应格式对比
+
+在全市场规模的合成扫描输出上，对比NDJSON、MessagePack和Arrow评分表的
+响应大小、服务端编码耗时和客户端解析耗时。未安装的格式会被跳过。
+
+用法: python -m benchmarks.bench_wire_format [股票数] [每只AI分析股票的片段数]
+"""
+import io
+import sys
+import json
+import time
+from benchmarks.bench_event_encoder import build_events
+from utils import wire_format
+from utils.event_encoder import encode_event
+
+
+def _time(func, repeat: int = 5):
+    """取多次运行的最短耗时"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    stocks = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    chunks = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    # 全市场扫描只对前几只股票做AI分析，其余只有评分事件
+    events = build_events(5, chunks) + build_events(stocks, 0)[1:]
+    print(f"股票数: {stocks}, 事件数: {len(events)}")
+
+    formats = [("ndjson",
+                lambda: b"".join(encode_event(event) for event in events),
+                lambda body: [json.loads(line) for line in body.splitlines()])]
+    if wire_format.is_available(wire_format.FORMAT_MSGPACK):
+        msgpack = wire_format.msgpack
+        formats.append(("msgpack",
+                        lambda: b"".join(wire_format.pack(event) for event in events),
+                        lambda body: list(msgpack.Unpacker(io.BytesIO(body)))))
+    if wire_format.is_available(wire_format.FORMAT_ARROW):
+        pa = wire_format.pa
+        formats.append(("arrow",
+                        lambda: wire_format.encode_score_table(events),
+                        lambda body: pa.ipc.open_stream(body).read_all()))
+
+    for name, encode, parse in formats:
+        encode_time, body = _time(encode)
+        parse_time, _ = _time(lambda: parse(body))
+        print(f"{name:8s} {len(body) / 1024:9.0f} KB  编码 {encode_time * 1000:8.1f} ms  解析 {parse_time * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,35 @@
 import pandas as pd
 import os
+import time
+import asyncio
 import json
 import httpx
 import re
-from typing import AsyncGenerator
+from typing import AsyncGenerator, AsyncIterator, Dict, List, Optional, Tuple
+from contextlib import asynccontextmanager, AsyncExitStack
 from dotenv import load_dotenv
 from utils.logger import get_logger
 from utils.api_utils import APIUtils
+from utils.metrics import get_metrics
+from utils.deadline import Deadline
+from utils.event_encoder import encode_event
+from utils.http_client_pool import get_http_client_pool
+from utils.llm_limiter import get_llm_limiter, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from utils.sse_parser import iter_sse_payloads, parse_stream_payload
+from utils.stream_demuxer import SectionDemuxer
+from utils.chunk_coalescer import coalesce_deltas
+from utils.llm_telemetry import get_llm_telemetry, LLMTrace
+from utils.llm_router import LLMEndpoint, LLMRouter, get_llm_router, metric_labels
+from services.ai_result_cache import AIResultCache
+from services.prompt_builder import PromptBuilder, estimate_tokens
 from datetime import datetime
 
 # 获取日志器
 logger = get_logger()
 
+# 环境变量只在模块导入时加载一次
+load_dotenv()
+
 class AIAnalyzer:
     """
     异步AI分析服务
@@ -28,18 +46,36 @@ class AIAnalyzer:
             custom_api_model: 自定义API模型
             custom_api_timeout: 自定义API超时时间
         """
-        # 加载环境变量
-        load_dotenv()
-        
         # 设置API配置
         self.API_URL = custom_api_url or os.getenv('API_URL')
         self.API_KEY = custom_api_key or os.getenv('API_KEY')
         self.API_MODEL = custom_api_model or os.getenv('API_MODEL', 'gpt-3.5-turbo')
         self.API_TIMEOUT = int(custom_api_timeout or os.getenv('API_TIMEOUT', 60))
         
+        # 自定义配置只使用该端点，否则使用API_ENDPOINTS配置的共享路由
+        if any((custom_api_url, custom_api_key, custom_api_model, custom_api_timeout)):
+            self.router = LLMRouter([LLMEndpoint(self.API_URL, self.API_KEY, self.API_MODEL, self.API_TIMEOUT)])
+        else:
+            self.router = get_llm_router()
+            if not self.API_URL and self.router.endpoints:
+                primary = self.router.endpoints[0]
+                self.API_URL, self.API_KEY, self.API_MODEL = primary.url, primary.key, primary.model
+        
+        # 收到429时的最大重试次数
+        self.max_retries = int(os.getenv('LLM_MAX_RETRIES') or 2)
+        
+        # 批量扫描时每次AI请求分析的股票数，小于2时逐只分析
+        self.batch_size = int(os.getenv('AI_BATCH_SIZE') or 0)
+        
+        # 提示词构建和分析结果缓存
+        self.prompt_builder = PromptBuilder()
+        self.result_cache = AIResultCache()
+        
         logger.debug(f"初始化AIAnalyzer: API_URL={self.API_URL}, API_MODEL={self.API_MODEL}, API_KEY={'已提供' if self.API_KEY else '未提供'}, API_TIMEOUT={self.API_TIMEOUT}")
     
-    async def get_ai_analysis(self, df: pd.DataFrame, stock_code: str, market_type: str = 'A', stream: bool = False) -> AsyncGenerator[str, None]:
+    async def get_ai_analysis(self, df: pd.DataFrame, stock_code: str, market_type: str = 'A', stream: bool = False,
+                              deadline: Optional[Deadline] = None,
+                              priority: int = PRIORITY_INTERACTIVE) -> AsyncGenerator[bytes, None]:
         """
         对股票数据进行AI分析
         
@@ -48,340 +84,772 @@ class AIAnalyzer:
             stock_code: 股票代码
             market_type: 市场类型，默认为'A'股
             stream: 是否使用流式响应
+            deadline: 时间预算，用完时中止请求并返回超时事件
+            priority: 上游限流排队优先级，交互式单只分析先于批量扫描
             
         Returns:
-            异步生成器，生成分析结果字符串
+            异步生成器，生成分析结果的NDJSON行（字节）
         """
+        deadline = deadline or Deadline()
+        trace = get_llm_telemetry().trace(self.API_URL, self.API_MODEL)
         try:
             logger.info(f"开始AI分析 {stock_code}, 流式模式: {stream}")
             
             # 提取关键技术指标
-            latest_data = df.iloc[-1]
-            
-            # 计算技术指标
-            rsi = latest_data.get('RSI')
-            price = latest_data.get('Close')
-            price_change = latest_data.get('Change')
-            
-            # 确定MA趋势
-            ma_trend = 'UP' if latest_data.get('MA5', 0) > latest_data.get('MA20', 0) else 'DOWN'
-            
-            # 确定MACD信号
-            macd = latest_data.get('MACD', 0)
-            macd_signal = latest_data.get('MACD_Signal', 0)
-            macd_signal_type = 'BUY' if macd > macd_signal else 'SELL'
-            
-            # 确定成交量状态
-            volume_ratio = latest_data.get('Volume_Ratio', 1)
-            volume_status = 'HIGH' if volume_ratio > 1.5 else ('LOW' if volume_ratio < 0.5 else 'NORMAL')
-            
-            # AI 分析内容
-            # 最近14天的股票数据记录
-            recent_data = df.tail(14).to_dict('records')
-            
-            # 包含trend, volatility, volume_trend, rsi_level的字典
-            technical_summary = {
-                'trend': 'upward' if df.iloc[-1]['MA5'] > df.iloc[-1]['MA20'] else 'downward',
-                'volatility': f"{df.iloc[-1]['Volatility']:.2f}%",
-                'volume_trend': 'increasing' if df.iloc[-1]['Volume_Ratio'] > 1 else 'decreasing',
-                'rsi_level': df.iloc[-1]['RSI']
-            }
-            
-            # 根据市场类型调整分析提示
-            if market_type in ['ETF', 'LOF']:
-                prompt = f"""
-                分析基金 {stock_code}：
-
-                技术指标概要：
-                {technical_summary}
-                
-                近14日交易数据：
-                {recent_data}
-                
-                请提供：
-                1. 净值走势分析（包含支撑位和压力位）
-                2. 成交量分析及其对净值的影响
-                3. 风险评估（包含波动率和折溢价分析）
-                4. 短期和中期净值预测
-                5. 关键价格位分析
-                6. 申购赎回建议（包含止损位）
-                
-                请基于技术指标和市场表现进行分析，给出具体数据支持。
-                """
-            elif market_type == 'US':
-                prompt = f"""
-                分析美股 {stock_code}：
-
-                技术指标概要：
-                {technical_summary}
-                
-                近14日交易数据：
-                {recent_data}
-                
-                请提供：
-                1. 趋势分析（包含支撑位和压力位，美元计价）
-                2. 成交量分析及其含义
-                3. 风险评估（包含波动率和美股市场特有风险）
-                4. 短期和中期目标价位（美元）
-                5. 关键技术位分析
-                6. 具体交易建议（包含止损位）
-                
-                请基于技术指标和美股市场特点进行分析，给出具体数据支持。
-                """
-            elif market_type == 'HK':
-                prompt = f"""
-                分析港股 {stock_code}：
-
-                技术指标概要：
-                {technical_summary}
-                
-                近14日交易数据：
-                {recent_data}
-                
-                请提供：
-                1. 趋势分析（包含支撑位和压力位，港币计价）
-                2. 成交量分析及其含义
-                3. 风险评估（包含波动率和港股市场特有风险）
-                4. 短期和中期目标价位（港币）
-                5. 关键技术位分析
-                6. 具体交易建议（包含止损位）
-                
-                请基于技术指标和港股市场特点进行分析，给出具体数据支持。
-                """
-            else:  # A股
-                prompt = f"""
-                分析A股 {stock_code}：
-
-                技术指标概要：
-                {technical_summary}
-                
-                近14日交易数据：
-                {recent_data}
-                
-                请提供：
-                1. 趋势分析（包含支撑位和压力位）
-                2. 成交量分析及其含义
-                3. 风险评估（包含波动率分析）
-                4. 短期和中期目标价位
-                5. 关键技术位分析
-                6. 具体交易建议（包含止损位）
-                
-                请基于技术指标和A股市场特点进行分析，给出具体数据支持。
-                """
+            indicator_event, technical_summary = self._summarize(df, stock_code)
             
-            # 格式化API URL
-            api_url = APIUtils.format_api_url(self.API_URL)
+            # 构建分析提示词，近期K线编码为紧凑表格并控制在市场的token预算内
+            prompt, prompt_tokens = self.prompt_builder.build(df, stock_code, market_type, technical_summary)
+            get_metrics().inc("ai_prompt_tokens_total", prompt_tokens, market=market_type)
             
-            # 准备请求数据
+            # 准备请求数据，模型和请求头按选中的端点填写
             request_data = {
-                "model": self.API_MODEL,
                 "messages": [{"role": "user", "content": prompt}],
                 "temperature": 0.7,
                 "stream": stream
             }
             
-            # 准备请求头
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.API_KEY}"
-            }
+            # 技术指标数据，分析开始时先发送
+            indicator_event["prompt_tokens"] = prompt_tokens
             
-            # 获取当前日期作为分析日期
-            analysis_date = datetime.now().strftime("%Y-%m-%d")
+            # 同一端点模型、提示词和K线日期的分析直接回放缓存结果，按本次优先使用的端点查找
+            cache_key = self._cache_key(df, prompt, self.router.select()[0])
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                get_metrics().inc("ai_cache_hit_total")
+                logger.info(f"AI分析 {stock_code} 命中缓存")
+                yield encode_event(indicator_event)
+                for event in self._replay_cached(stock_code, cached, stream, indicator_event):
+                    yield event
+                return
+            if self.result_cache.enabled:
+                get_metrics().inc("ai_cache_miss_total")
             
-            # 异步请求API
-            async with httpx.AsyncClient(timeout=self.API_TIMEOUT) as client:
-                # 记录请求
-                logger.debug(f"发送AI请求: URL={api_url}, MODEL={self.API_MODEL}, STREAM={stream}")
-                
-                # 先发送技术指标数据
-                yield json.dumps({
-                    "stock_code": stock_code,
-                    "status": "analyzing",
-                    "rsi": rsi,
-                    "price": price,
-                    "price_change": price_change,
-                    "ma_trend": ma_trend,
-                    "macd_signal": macd_signal_type,
-                    "volume_status": volume_status,
-                    "analysis_date": analysis_date
-                })
-                
-                if stream:
-                    # 流式响应处理
-                    async with client.stream("POST", api_url, json=request_data, headers=headers) as response:
-                        if response.status_code != 200:
-                            error_text = await response.aread()
-                            error_data = json.loads(error_text)
-                            error_message = error_data.get('error', {}).get('message', '未知错误')
-                            logger.error(f"AI API请求失败: {response.status_code} - {error_message}")
-                            yield json.dumps({
-                                "stock_code": stock_code,
-                                "error": f"API请求失败: {error_message}",
-                                "status": "error"
-                            })
-                            return
-                            
-                        # 处理流式响应
-                        buffer = ""
-                        collected_messages = []
-                        chunk_count = 0
-                        
-                        async for chunk in response.aiter_text():
-                            if chunk:
-                                # 分割多行响应（处理某些API可能在一个chunk中返回多行）
-                                lines = chunk.strip().split('\n')
-                                for line in lines:
-                                    line = line.strip()
-                                    if not line:
-                                        continue
-                                        
-                                    # 处理以data:开头的行
-                                    if line.startswith("data: "):
-                                        line = line[6:]  # 去除"data: "前缀
-                                     
-                                    if line == "[DONE]":
-                                        logger.debug("收到流结束标记 [DONE]")
-                                        continue
-                                        
-                                    try:
-                                        # 处理特殊错误情况
-                                        if "error" in line.lower():
-                                            error_msg = line
-                                            try:
-                                                error_data = json.loads(line)
-                                                error_msg = error_data.get("error", line)
-                                            except:
-                                                pass
-                                            
-                                            logger.error(f"流式响应中收到错误: {error_msg}")
-                                            yield json.dumps({
-                                                "stock_code": stock_code,
-                                                "error": f"流式响应错误: {error_msg}",
-                                                "status": "error"
-                                            })
-                                            continue
-                                        
-                                        # 尝试解析JSON
-                                        chunk_data = json.loads(line)
-                                        
-                                        # 检查是否有finish_reason
-                                        finish_reason = chunk_data.get("choices", [{}])[0].get("finish_reason")
-                                        if finish_reason == "stop":
-                                            logger.debug("收到finish_reason=stop，流结束")
-                                            continue
-                                        
-                                        # 获取delta内容
-                                        delta = chunk_data.get("choices", [{}])[0].get("delta", {})
-                                        
-                                        # 检查delta是否为空对象
-                                        if not delta or delta == {}:
-                                            logger.debug("收到空的delta对象，跳过")
-                                            continue
-                                        
-                                        content = delta.get("content", "")
-                                        
-                                        if content:
-                                            chunk_count += 1
-                                            buffer += content
-                                            collected_messages.append(content)
-                                            
-                                            # 直接发送每个内容片段，不累积
-                                            yield json.dumps({
-                                                "stock_code": stock_code,
-                                                "ai_analysis_chunk": content,
-                                                "status": "analyzing"
-                                            })
-                                    except json.JSONDecodeError:
-                                        # 记录解析错误并尝试恢复
-                                        logger.error(f"JSON解析错误，块内容: {line}")
-                                        
-                                        # 如果是特定错误模式，处理它
-                                        if "streaming failed after retries" in line.lower():
-                                            logger.error("检测到流式传输失败")
-                                            yield json.dumps({
-                                                "stock_code": stock_code,
-                                                "error": "流式传输失败，请稍后重试",
-                                                "status": "error"
-                                            })
-                                            return
-                                        continue
-                        
-                        logger.info(f"AI流式处理完成，共收到 {chunk_count} 个内容片段，总长度: {len(buffer)}")
+            if deadline.expired():
+                raise asyncio.TimeoutError()
+            
+            # 记录请求
+            logger.debug(f"发送AI请求: STREAM={stream}, 估算提示词 {prompt_tokens} tokens")
+            
+            # 先发送技术指标数据
+            yield encode_event(indicator_event)
+            
+            if stream:
+                # 流式响应处理
+                async with self._open_stream(request_data, deadline, priority) as (response, deltas, queue_wait, trace, served_by):
+                    if response.status_code != 200:
+                        error_text = await response.aread()
+                        error_data = json.loads(error_text)
+                        error_message = error_data.get('error', {}).get('message', '未知错误')
+                        logger.error(f"AI API请求失败: {response.status_code} - {error_message}")
+                        trace.finish("error")
+                        yield encode_event({
+                            "stock_code": stock_code,
+                            "error": f"API请求失败: {error_message}",
+                            "status": "error"
+                        })
+                        return
                         
-                        # 如果buffer不为空且不以换行符结束，发送一个换行符
-                        if buffer and not buffer.endswith('\n'):
-                            logger.debug("发送换行符")
-                            yield json.dumps({
+                    # 增量解析SSE/NDJSON事件，内容片段收集到列表中最后一次拼接
+                    collected_messages = []
+                    stream_error = False
+                    
+                    async for content, error, fatal in coalesce_deltas(deltas):
+                        if error is not None:
+                            yield encode_event({
                                 "stock_code": stock_code,
-                                "ai_analysis_chunk": "\n",
-                                "status": "analyzing"
+                                "error": error,
+                                "status": "error"
                             })
+                            if fatal:
+                                trace.finish("error")
+                                return
+                            stream_error = True
+                            continue
                         
-                        # 完整的分析内容
-                        full_content = buffer
-                        
-                        # 尝试从分析内容中提取投资建议
-                        recommendation = self._extract_recommendation(full_content)
+                        collected_messages.append(content)
                         
-                        # 计算分析评分
-                        score = self._calculate_analysis_score(full_content, technical_summary)
-                        
-                        # 发送完成状态和评分、建议
-                        yield json.dumps({
+                        # 直接发送每个内容片段，不累积
+                        yield encode_event({
                             "stock_code": stock_code,
-                            "status": "completed",
-                            "score": score,
-                            "recommendation": recommendation
+                            "ai_analysis_chunk": content,
+                            "status": "analyzing"
                         })
-                else:
-                    # 非流式响应处理
-                    response = await client.post(api_url, json=request_data, headers=headers)
                     
-                    if response.status_code != 200:
-                        error_data = response.json()
-                        error_message = error_data.get('error', {}).get('message', '未知错误')
-                        logger.error(f"AI API请求失败: {response.status_code} - {error_message}")
-                        yield json.dumps({
+                    # 完整的分析内容
+                    full_content = "".join(collected_messages)
+                    telemetry = trace.finish("error" if stream_error else "completed", estimate_tokens(full_content))
+                    logger.info(f"AI流式处理完成，共收到 {len(collected_messages)} 个内容片段，总长度: {len(full_content)}，"
+                                f"首字延迟: {telemetry['ttft']}s，耗时: {telemetry['duration']}s，"
+                                f"速度: {telemetry['tokens_per_second']} tokens/s")
+                    
+                    # 如果内容不为空且不以换行符结束，发送一个换行符
+                    if full_content and not full_content.endswith('\n'):
+                        logger.debug("发送换行符")
+                        yield encode_event({
                             "stock_code": stock_code,
-                            "error": f"API请求失败: {error_message}",
-                            "status": "error"
+                            "ai_analysis_chunk": "\n",
+                            "status": "analyzing"
                         })
-                        return
-                    
-                    response_data = response.json()
-                    analysis_text = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
                     
                     # 尝试从分析内容中提取投资建议
-                    recommendation = self._extract_recommendation(analysis_text)
+                    recommendation = self._extract_recommendation(full_content)
                     
                     # 计算分析评分
-                    score = self._calculate_analysis_score(analysis_text, technical_summary)
+                    score = self._calculate_analysis_score(full_content, technical_summary)
+                    
+                    if not stream_error:
+                        # 故障切换或对冲时由其他端点完成，按实际完成的端点缓存
+                        self.result_cache.put(self._cache_key(df, prompt, served_by), full_content, score, recommendation)
                     
-                    # 发送完整的分析结果
-                    yield json.dumps({
+                    # 发送完成状态和评分、建议
+                    yield encode_event({
                         "stock_code": stock_code,
                         "status": "completed",
-                        "analysis": analysis_text,
                         "score": score,
                         "recommendation": recommendation,
-                        "rsi": rsi,
-                        "price": price,
-                        "price_change": price_change,
-                        "ma_trend": ma_trend,
-                        "macd_signal": macd_signal_type,
-                        "volume_status": volume_status,
-                        "analysis_date": analysis_date
+                        "queue_wait": round(queue_wait, 3),
+                        "telemetry": telemetry
                     })
-                    
+            else:
+                # 非流式响应处理，使用当前最快的健康端点
+                endpoint = self.router.select()[0]
+                trace = get_llm_telemetry().trace(endpoint.url, endpoint.model)
+                try:
+                    async with self._upstream(endpoint, request_data, deadline, priority, trace) as (response, queue_wait):
+                        await asyncio.wait_for(response.aread(), deadline.timeout())
+                except (httpx.TransportError, asyncio.TimeoutError):
+                    self.router.record_failure(endpoint)
+                    raise
+                
+                if response.status_code != 200:
+                    if response.status_code >= 500:
+                        self.router.record_failure(endpoint)
+                    error_data = response.json()
+                    error_message = error_data.get('error', {}).get('message', '未知错误')
+                    logger.error(f"AI API请求失败: {response.status_code} - {error_message}")
+                    trace.finish("error")
+                    yield encode_event({
+                        "stock_code": stock_code,
+                        "error": f"API请求失败: {error_message}",
+                        "status": "error"
+                    })
+                    return
+                
+                response_data = response.json()
+                analysis_text = response_data.get("choices", [{}])[0].get("message", {}).get("content", "")
+                trace.on_content(analysis_text)
+                output_tokens = (response_data.get("usage") or {}).get("completion_tokens") or estimate_tokens(analysis_text)
+                telemetry = trace.finish("completed", output_tokens)
+                self.router.record_latency(endpoint, telemetry["duration"])
+                
+                # 尝试从分析内容中提取投资建议
+                recommendation = self._extract_recommendation(analysis_text)
+                
+                # 计算分析评分
+                score = self._calculate_analysis_score(analysis_text, technical_summary)
+                self.result_cache.put(self._cache_key(df, prompt, endpoint), analysis_text, score, recommendation)
+                
+                # 发送完整的分析结果
+                yield encode_event({
+                    **indicator_event,
+                    "status": "completed",
+                    "analysis": analysis_text,
+                    "score": score,
+                    "recommendation": recommendation,
+                    "queue_wait": round(queue_wait, 3),
+                    "telemetry": telemetry
+                })
+                
+        except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+            trace.finish("timeout")
+            if not deadline.expired():
+                logger.error(f"AI分析超时: {str(e)}")
+                yield encode_event({
+                    "stock_code": stock_code,
+                    "error": "分析出错: 请求超时",
+                    "status": "error"
+                })
+                return
+            get_metrics().inc("ai_timeout_total")
+            logger.warning(f"AI分析 {stock_code} 超出时间预算")
+            yield encode_event({
+                "stock_code": stock_code,
+                "error": "AI分析超出时间预算",
+                "status": "error",
+                "timed_out": True
+            })
+        except asyncio.CancelledError:
+            # 退出async with时上游httpx流随之关闭，连接不再复用
+            get_metrics().inc("ai_stream_cancelled_total")
+            logger.info(f"AI分析 {stock_code} 已取消，关闭上游流")
+            raise
         except Exception as e:
+            trace.finish("error")
             logger.error(f"AI分析出错: {str(e)}", exc_info=True)
-            yield json.dumps({
+            yield encode_event({
                 "stock_code": stock_code,
                 "error": f"分析出错: {str(e)}",
                 "status": "error"
             })
+        finally:
+            # 以上未记录结束状态的（取消或下游提前关闭生成器）记为cancelled
+            trace.finish("cancelled")
+            
+    async def get_batch_ai_analysis(self, entries: List[Tuple[str, pd.DataFrame]], market_type: str = 'A',
+                                    stream: bool = False, deadline: Optional[Deadline] = None,
+                                    priority: int = PRIORITY_BATCH) -> AsyncGenerator[bytes, None]:
+        """
+        在一次AI请求中批量分析多只股票
+        
+        多只股票的紧凑数据合并为一个提示词，要求模型按分段标记依次输出，
+        流式响应按标记拆分为每只股票的ai_analysis_chunk事件，事件协议与单只分析一致
+        
+        Args:
+            entries: (股票代码, 包含技术指标的DataFrame)列表
+            market_type: 市场类型，默认为'A'股
+            stream: 是否逐片段输出分析内容，否则每只股票完成时输出完整分析
+            deadline: 时间预算，用完时中止请求并为未完成的股票返回超时事件
+            priority: 上游限流排队优先级
+            
+        Returns:
+            异步生成器，生成分析结果的NDJSON行（字节）
+        """
+        deadline = deadline or Deadline()
+        trace = get_llm_telemetry().trace(self.API_URL, self.API_MODEL)
+        pending: Dict[str, dict] = {}
+        try:
+            for stock_code, df in entries:
+                indicator_event, technical_summary = self._summarize(df, stock_code)
+                
+                # 单只分析已缓存的股票直接回放，不进入批量请求
+                single_prompt, _ = self.prompt_builder.build(df, stock_code, market_type, technical_summary)
+                cache_key = self._cache_key(df, single_prompt, self.router.select()[0])
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    get_metrics().inc("ai_cache_hit_total")
+                    yield encode_event(indicator_event)
+                    for event in self._replay_cached(stock_code, cached, stream, indicator_event):
+                        yield event
+                    continue
+                if self.result_cache.enabled:
+                    get_metrics().inc("ai_cache_miss_total")
+                
+                pending[stock_code] = {
+                    "df": df,
+                    "indicator_event": indicator_event,
+                    "technical_summary": technical_summary,
+                    "prompt": single_prompt,
+                    "chunks": []
+                }
+            
+            if not pending:
+                return
+            
+            prompt, prompt_tokens = self.prompt_builder.build_batch(
+                [(code, item["df"], item["technical_summary"]) for code, item in pending.items()],
+                market_type
+            )
+            get_metrics().inc("ai_prompt_tokens_total", prompt_tokens, market=market_type)
+            get_metrics().inc("ai_batch_requests_total", batch_size=len(pending))
+            logger.info(f"开始批量AI分析 {list(pending)}, 估算提示词 {prompt_tokens} tokens")
+            
+            for item in pending.values():
+                yield encode_event({**item["indicator_event"], "prompt_tokens": prompt_tokens, "batch_size": len(pending)})
+            
+            if deadline.expired():
+                raise asyncio.TimeoutError()
+            
+            request_data = {
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0.7,
+                "stream": True
+            }
+            demuxer = SectionDemuxer(pending)
+            stream_error = False
             
+            def finish(stock_code: str) -> List[bytes]:
+                """结束一只股票的分段，生成完成事件"""
+                item = pending.pop(stock_code)
+                full_content = "".join(item["chunks"])
+                if not full_content:
+                    return [encode_event({
+                        "stock_code": stock_code,
+                        "error": "批量分析结果中缺少该股票的分析",
+                        "status": "error"
+                    })]
+                
+                events = []
+                if stream and not full_content.endswith('\n'):
+                    events.append(encode_event({
+                        "stock_code": stock_code,
+                        "ai_analysis_chunk": "\n",
+                        "status": "analyzing"
+                    }))
+                recommendation = self._extract_recommendation(full_content)
+                score = self._calculate_analysis_score(full_content, item["technical_summary"])
+                if not stream_error:
+                    self.result_cache.put(self._cache_key(item["df"], item["prompt"], served_by), full_content, score,
+                                          recommendation)
+                completed = {"status": "completed", "score": score, "recommendation": recommendation,
+                             "queue_wait": round(queue_wait, 3),
+                             "telemetry": telemetry or trace.snapshot("analyzing")}
+                if stream:
+                    events.append(encode_event({"stock_code": stock_code, **completed}))
+                else:
+                    events.append(encode_event({**item["indicator_event"], **completed, "analysis": full_content}))
+                return events
+            
+            def route(pieces: List[Tuple[Optional[str], Optional[str]]]) -> List[bytes]:
+                """把解复用后的片段转换为事件"""
+                events = []
+                for stock_code, content in pieces:
+                    if content is None:
+                        # 新分段开始，之前的分段已经输出完毕
+                        for previous in demuxer.seen:
+                            if previous != stock_code and previous in pending:
+                                events.extend(finish(previous))
+                        continue
+                    if stock_code not in pending:
+                        logger.debug(f"忽略批量分析中不属于任何股票的内容: {content[:50]}")
+                        continue
+                    pending[stock_code]["chunks"].append(content)
+                    if stream:
+                        events.append(encode_event({
+                            "stock_code": stock_code,
+                            "ai_analysis_chunk": content,
+                            "status": "analyzing"
+                        }))
+                return events
+            
+            # 请求结束前完成的股票携带截至该分段结束时的请求统计
+            telemetry = None
+            received = []
+            async with self._open_stream(request_data, deadline, priority) as (response, deltas, queue_wait, trace, served_by):
+                if response.status_code != 200:
+                    error_text = await response.aread()
+                    error_message = json.loads(error_text).get('error', {}).get('message', '未知错误')
+                    logger.error(f"AI API请求失败: {response.status_code} - {error_message}")
+                    trace.finish("error")
+                    for stock_code in list(pending):
+                        pending.pop(stock_code)
+                        yield encode_event({
+                            "stock_code": stock_code,
+                            "error": f"API请求失败: {error_message}",
+                            "status": "error"
+                        })
+                    return
+                
+                async for content, error, fatal in coalesce_deltas(deltas):
+                    if error is not None:
+                        stream_error = True
+                        for stock_code in list(pending):
+                            if fatal:
+                                pending.pop(stock_code)
+                            yield encode_event({"stock_code": stock_code, "error": error, "status": "error"})
+                        if fatal:
+                            trace.finish("error")
+                            return
+                        continue
+                    received.append(content)
+                    for event in route(demuxer.feed(content)):
+                        yield event
+                
+                telemetry = trace.finish("error" if stream_error else "completed", estimate_tokens("".join(received)))
+                for event in route(demuxer.close()):
+                    yield event
+            
+            for stock_code in list(pending):
+                for event in finish(stock_code):
+                    yield event
+            logger.info(f"批量AI分析完成，共 {len(entries)} 只股票")
+            
+        except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+            trace.finish("timeout")
+            expired = deadline.expired()
+            logger.warning(f"批量AI分析超时: {str(e) or '超出时间预算'}")
+            for stock_code in list(pending):
+                if expired:
+                    get_metrics().inc("ai_timeout_total")
+                yield encode_event({
+                    "stock_code": stock_code,
+                    "error": "AI分析超出时间预算" if expired else "分析出错: 请求超时",
+                    "status": "error",
+                    **({"timed_out": True} if expired else {})
+                })
+        except asyncio.CancelledError:
+            get_metrics().inc("ai_stream_cancelled_total")
+            logger.info(f"批量AI分析 {list(pending)} 已取消，关闭上游流")
+            raise
+        except Exception as e:
+            trace.finish("error")
+            logger.error(f"批量AI分析出错: {str(e)}", exc_info=True)
+            for stock_code in list(pending):
+                yield encode_event({
+                    "stock_code": stock_code,
+                    "error": f"分析出错: {str(e)}",
+                    "status": "error"
+                })
+        finally:
+            trace.finish("cancelled")
+    
+    def _cache_key(self, df: pd.DataFrame, prompt: str, endpoint: LLMEndpoint) -> str:
+        """
+        按端点地址、模型、提示词和最新K线日期构建分析结果缓存键
+        
+        Args:
+            df: 包含技术指标的DataFrame
+            prompt: 单只股票的提示词
+            endpoint: 完成（或将优先完成）请求的端点，不同端点和模型的分析结果分开缓存
+        """
+        bar_date = df.index[-1].strftime('%Y-%m-%d') if hasattr(df.index[-1], 'strftime') else None
+        return self.result_cache.make_key(endpoint.url, endpoint.model, prompt, bar_date)
+    
+    @asynccontextmanager
+    async def _upstream(self, endpoint: LLMEndpoint, request_data: dict, deadline: Deadline,
+                        priority: int, trace: Optional[LLMTrace] = None) -> AsyncIterator[Tuple[httpx.Response, float]]:
+        """
+        经上游限流器向AI接口发送请求，收到429时等待Retry-After后重试
+        
+        Args:
+            endpoint: AI接口端点，决定请求地址、密钥、模型和超时时间
+            request_data: 请求体，模型字段按端点填写
+            deadline: 时间预算，同时限制排队和请求时间
+            priority: 排队优先级
+            trace: 请求耗时记录，每次发出请求时重新计时
+            
+        Returns:
+            (未读取响应体的响应, 累计排队秒数)，退出时关闭响应并归还名额
+        """
+        api_url = APIUtils.format_api_url(endpoint.url)
+        request_data = {**request_data, "model": endpoint.model}
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {endpoint.key}"
+        }
+        limiter = get_llm_limiter(endpoint.url, endpoint.key)
+        client = get_http_client_pool().get_client(api_url)
+        queue_wait = 0.0
+        for attempt in range(self.max_retries + 1):
+            queue_wait += await limiter.acquire(priority, deadline.timeout())
+            try:
+                if trace is not None:
+                    trace.begin()
+                request = client.build_request("POST", api_url, json=request_data, headers=headers,
+                                               timeout=deadline.timeout(endpoint.timeout))
+                response = await client.send(request, stream=True)
+            except BaseException:
+                limiter.release()
+                raise
+            
+            if response.status_code == 429:
+                limiter.record_throttled(response.headers.get('Retry-After'))
+                if attempt < self.max_retries:
+                    # 名额归还后重新排队，限流器在冷却结束前不会放行
+                    try:
+                        await response.aclose()
+                    finally:
+                        limiter.release()
+                    continue
+            elif response.status_code == 200:
+                limiter.record_success()
+            
+            try:
+                yield response, queue_wait
+            finally:
+                try:
+                    await response.aclose()
+                finally:
+                    limiter.release()
+            return
+    
+    @asynccontextmanager
+    async def _open_stream(self, request_data: dict, deadline: Deadline, priority: int
+                           ) -> AsyncIterator[Tuple[httpx.Response, AsyncIterator, float, LLMTrace, LLMEndpoint]]:
+        """
+        向最快的健康端点发起流式请求，必要时对冲或切换到下一个端点
+        
+        首个内容片段在对冲阈值内未到达时，向下一个端点再发起一次请求，保留先输出内容的一路并取消另一路；
+        请求失败（连接错误或5xx）时立即改用下一个端点。所有端点都失败时返回第一个错误响应或抛出第一个异常
+        
+        Args:
+            request_data: 请求体
+            deadline: 时间预算
+            priority: 排队优先级
+            
+        Returns:
+            (响应, 内容增量异步迭代器, 累计排队秒数, 请求耗时记录, 实际返回响应的端点)，退出时关闭所有请求
+        """
+        endpoints = self.router.select()
+        hedge_after = self.router.hedge_after if len(endpoints) > 1 else 0
+        
+        async def attempt(endpoint: LLMEndpoint) -> dict:
+            """发起一路请求并读取到首个内容片段"""
+            trace = get_llm_telemetry().trace(endpoint.url, endpoint.model)
+            stack = AsyncExitStack()
+            try:
+                response, queue_wait = await stack.enter_async_context(
+                    self._upstream(endpoint, request_data, deadline, priority, trace))
+                result = {"endpoint": endpoint, "stack": stack, "response": response,
+                          "queue_wait": queue_wait, "trace": trace, "deltas": None, "first": None}
+                if response.status_code != 200:
+                    trace.finish("error")
+                    return result
+                deltas = self._stream_deltas(response, deadline, trace)
+                stack.push_async_callback(deltas.aclose)
+                try:
+                    result["first"] = await deltas.__anext__()
+                except StopAsyncIteration:
+                    pass
+                result["deltas"] = deltas
+                return result
+            except asyncio.CancelledError:
+                trace.finish("cancelled")
+                await stack.aclose()
+                raise
+            except BaseException as e:
+                trace.finish("timeout" if isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException)) else "error")
+                await stack.aclose()
+                raise
+        
+        def failed(task: asyncio.Task) -> bool:
+            """该路请求是否失败，失败时计入端点健康状态"""
+            endpoint = tasks[task]
+            if task.exception() is not None:
+                if not isinstance(task.exception(), asyncio.TimeoutError) or not deadline.expired():
+                    self.router.record_failure(endpoint)
+                return True
+            if task.result()["response"].status_code != 200:
+                if task.result()["response"].status_code >= 500:
+                    self.router.record_failure(endpoint)
+                return True
+            return False
+        
+        backups = list(endpoints[1:])
+        tasks: Dict[asyncio.Task, LLMEndpoint] = {}
+        started: Dict[asyncio.Task, float] = {}
+        failures: List[asyncio.Task] = []
+        winner: Optional[dict] = None
+        hedged = False
+        
+        def launch(endpoint: LLMEndpoint):
+            task = asyncio.ensure_future(attempt(endpoint))
+            tasks[task] = endpoint
+            started[task] = time.monotonic()
+            running.add(task)
+        
+        running: set = set()
+        launch(endpoints[0])
+        try:
+            while running and winner is None:
+                timeout = hedge_after if hedge_after and not hedged and backups else None
+                done, running = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 首个内容片段超时未到达，向下一个端点发起对冲请求
+                    hedged = True
+                    endpoint = backups.pop(0)
+                    get_metrics().inc("llm_hedged_total", endpoint=metric_labels(endpoint.url, endpoint.model)[0])
+                    logger.info(f"AI请求 {hedge_after:.1f} 秒内未收到内容，对冲请求 {endpoint.name}")
+                    launch(endpoint)
+                    continue
+                for task in done:
+                    if failed(task):
+                        failures.append(task)
+                    elif winner is None:
+                        winner = task.result()
+                    else:
+                        await task.result()["stack"].aclose()
+                if winner is None and not running and backups:
+                    endpoint = backups.pop(0)
+                    logger.warning(f"AI端点 {tasks[failures[-1]].name} 请求失败，改用 {endpoint.name}")
+                    launch(endpoint)
+        except BaseException:
+            for result in [task.result() for task in failures if task.exception() is None] + [winner]:
+                if result is not None:
+                    await result["stack"].aclose()
+            raise
+        finally:
+            # 取消仍在进行的请求，被对冲请求超过的一路按已等待时间计入延迟
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.wait(running)
+            for task in running:
+                if task.cancelled():
+                    if winner is not None:
+                        self.router.record_latency(tasks[task], time.monotonic() - started[task], success=False)
+                elif task.exception() is None:
+                    await task.result()["stack"].aclose()
+        
+        error_results = [task.result() for task in failures if task.exception() is None]
+        if winner is None:
+            # 所有端点都失败：优先返回错误响应，由调用方按原有方式输出错误事件
+            if not error_results:
+                raise failures[0].exception()
+            winner = error_results.pop(0)
+        elif winner["trace"].ttft is not None:
+            self.router.record_latency(winner["endpoint"], winner["trace"].ttft)
+        for result in error_results:
+            await result["stack"].aclose()
+        
+        async def deltas():
+            if winner["first"] is not None:
+                yield winner["first"]
+            if winner["deltas"] is not None:
+                async for item in winner["deltas"]:
+                    yield item
+        
+        async with winner["stack"]:
+            yield winner["response"], deltas(), winner["queue_wait"], winner["trace"], winner["endpoint"]
+    
+    async def _stream_deltas(self, response: httpx.Response, deadline: Deadline,
+                             trace: Optional[LLMTrace] = None) -> AsyncGenerator[Tuple[Optional[str], Optional[str], bool], None]:
+        """
+        解析流式响应，逐个产出内容片段或错误
+        
+        Args:
+            response: 状态码为200的流式响应
+            deadline: 时间预算
+            trace: 请求耗时记录，按合并前的片段记录首字延迟和片段间隔
+            
+        Returns:
+            异步生成器，生成(内容片段, 错误信息, 是否需要中止)
+        """
+        async for payload in iter_sse_payloads(deadline.iterate(response.aiter_text())):
+            if payload == "[DONE]":
+                logger.debug("收到流结束标记 [DONE]")
+                continue
+            
+            chunk_data = parse_stream_payload(payload)
+            if chunk_data is None:
+                # 记录解析错误并尝试恢复
+                logger.error(f"JSON解析错误，块内容: {payload}")
+                
+                # 如果是特定错误模式，处理它
+                if "streaming failed after retries" in payload.lower():
+                    logger.error("检测到流式传输失败")
+                    yield None, "流式传输失败，请稍后重试", True
+                    return
+                continue
+            
+            # 接口在流中返回的错误对象
+            if "error" in chunk_data:
+                error_msg = chunk_data["error"]
+                if isinstance(error_msg, dict):
+                    error_msg = error_msg.get("message", error_msg)
+                logger.error(f"流式响应中收到错误: {error_msg}")
+                yield None, f"流式响应错误: {error_msg}", False
+                continue
+            
+            choice = (chunk_data.get("choices") or [{}])[0]
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                if trace is not None:
+                    trace.on_content(content)
+                yield content, None, False
+            
+            if choice.get("finish_reason") == "stop":
+                logger.debug("收到finish_reason=stop，流结束")
+    
+    def _summarize(self, df: pd.DataFrame, stock_code: str) -> Tuple[dict, dict]:
+        """
+        提取最新K线的关键技术指标
+        
+        Args:
+            df: 包含技术指标的DataFrame
+            stock_code: 股票代码
+            
+        Returns:
+            (技术指标事件, 技术指标概要)
+        """
+        # 提取关键技术指标
+        latest_data = df.iloc[-1]
+        
+        # 计算技术指标
+        rsi = latest_data.get('RSI')
+        price = latest_data.get('Close')
+        price_change = latest_data.get('Change')
+        
+        # 确定MA趋势
+        ma_trend = 'UP' if latest_data.get('MA5', 0) > latest_data.get('MA20', 0) else 'DOWN'
+        
+        # 确定MACD信号
+        macd = latest_data.get('MACD', 0)
+        macd_signal = latest_data.get('MACD_Signal', 0)
+        macd_signal_type = 'BUY' if macd > macd_signal else 'SELL'
+        
+        # 确定成交量状态
+        volume_ratio = latest_data.get('Volume_Ratio', 1)
+        volume_status = 'HIGH' if volume_ratio > 1.5 else ('LOW' if volume_ratio < 0.5 else 'NORMAL')
+        
+        # 包含trend, volatility, volume_trend, rsi_level的字典
+        technical_summary = {
+            'trend': 'upward' if df.iloc[-1]['MA5'] > df.iloc[-1]['MA20'] else 'downward',
+            'volatility': f"{df.iloc[-1]['Volatility']:.2f}%",
+            'volume_trend': 'increasing' if df.iloc[-1]['Volume_Ratio'] > 1 else 'decreasing',
+            'rsi_level': df.iloc[-1]['RSI']
+        }
+        
+        # 技术指标数据，分析开始时先发送
+        indicator_event = {
+            "stock_code": stock_code,
+            "status": "analyzing",
+            "rsi": rsi,
+            "price": price,
+            "price_change": price_change,
+            "ma_trend": ma_trend,
+            "macd_signal": macd_signal_type,
+            "volume_status": volume_status,
+            "analysis_date": datetime.now().strftime("%Y-%m-%d")
+        }
+        return indicator_event, technical_summary
+    
+    def _replay_cached(self, stock_code: str, cached: dict, stream: bool, indicator_event: dict):
+        """
+        按正常分析的事件协议回放缓存的分析结果
+        
+        Args:
+            stock_code: 股票代码
+            cached: 缓存的分析结果
+            stream: 是否使用流式响应
+            indicator_event: 技术指标事件
+            
+        Returns:
+            生成器，生成分析结果的NDJSON行（字节）
+        """
+        analysis = cached["analysis"]
+        if not stream:
+            yield encode_event({
+                **indicator_event,
+                "status": "completed",
+                "analysis": analysis,
+                "score": cached["score"],
+                "recommendation": cached["recommendation"],
+                "cached": True
+            })
+            return
+        
+        # 按行拆分为多个片段，前端无需区分实时分析和缓存回放
+        for line in analysis.splitlines(keepends=True):
+            yield encode_event({
+                "stock_code": stock_code,
+                "ai_analysis_chunk": line,
+                "status": "analyzing"
+            })
+        if not analysis.endswith('\n'):
+            yield encode_event({
+                "stock_code": stock_code,
+                "ai_analysis_chunk": "\n",
+                "status": "analyzing"
+            })
+        yield encode_event({
+            "stock_code": stock_code,
+            "status": "completed",
+            "score": cached["score"],
+            "recommendation": cached["recommendation"],
+            "cached": True
+        })
+    
     def _extract_recommendation(self, analysis_text: str) -> str:
         """从分析文本中提取投资建议"""
         # 查找投资建议部分
@@ -0,0 +1,88 @@
+import os
+import hashlib
+from typing import Any, Dict, Optional
+from utils.logger import get_logger
+from utils.cache_store import CacheStore, get_cache_store
+
+# 获取日志器
+logger = get_logger()
+
+
+class AIResultCache:
+    """
+    AI分析结果缓存
+    按(API地址, 模型, 提示词, 最新K线日期)的哈希缓存完整分析文本及评分、建议，
+    同一交易日重复分析同一只股票时无需再次调用AI接口
+    """
+
+    NAMESPACE = "ai_analysis"
+
+    def __init__(self, store: Optional[CacheStore] = None, ttl: Optional[float] = None):
+        """
+        初始化AI分析结果缓存
+
+        Args:
+            store: 缓存存储，默认使用应用共享的CacheStore
+            ttl: 缓存秒数，默认读取AI_CACHE_TTL，为0时不缓存
+        """
+        self.store = store or get_cache_store()
+        self.ttl = ttl if ttl is not None else float(os.getenv('AI_CACHE_TTL') or 43200)
+
+        logger.debug(f"初始化AIResultCache，缓存秒数: {self.ttl}")
+
+    @property
+    def enabled(self) -> bool:
+        """是否启用缓存"""
+        return self.ttl > 0
+
+    @staticmethod
+    def make_key(api_url: str, model: str, prompt: str, bar_date: Optional[str]) -> str:
+        """
+        构建缓存键
+
+        Args:
+            api_url: API地址
+            model: 模型名称
+            prompt: 提示词
+            bar_date: 最新K线日期
+
+        Returns:
+            str: sha256十六进制摘要
+        """
+        digest = hashlib.sha256()
+        for part in (api_url or '', model or '', bar_date or '', prompt):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        获取缓存的分析结果
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            包含analysis、score、recommendation的字典，未命中时返回None
+        """
+        if not self.enabled:
+            return None
+        return self.store.get(self.NAMESPACE, key)
+
+    def put(self, key: str, analysis: str, score: int, recommendation: str):
+        """
+        缓存分析结果
+
+        Args:
+            key: 缓存键
+            analysis: 完整分析文本
+            score: 分析评分
+            recommendation: 投资建议
+        """
+        if not self.enabled or not analysis:
+            return
+        self.store.set(self.NAMESPACE, key, {
+            "analysis": analysis,
+            "score": score,
+            "recommendation": recommendation
+        }, self.ttl)
@@ -1,8 +1,8 @@
 import asyncio
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from utils.logger import get_logger
-from datetime import datetime, timedelta
+from utils.cache_store import CacheStore, LocalFrameCache, get_cache_store
 
 # 获取日志器
 logger = get_logger()
@@ -13,15 +13,22 @@ class FundServiceAsync:
     提供基金数据的异步搜索和获取功能
     """
     
-    def __init__(self):
-        """初始化异步基金服务"""
+    # 基金列表缓存的命名空间和缓存秒数
+    CACHE_NAMESPACE = "spot_lists"
+    CACHE_TTL = 30 * 60
+    
+    def __init__(self, store: Optional[CacheStore] = None):
+        """
+        初始化异步基金服务
+        
+        Args:
+            store: 工作进程间共享的缓存存储，默认使用应用共享的CacheStore
+        """
         logger.debug("初始化FundServiceAsync")
         
-        # 添加缓存
-        self._etf_cache = None
-        self._lof_cache = None
-        self._cache_timestamp = None
-        self._cache_duration = timedelta(minutes=30)  # 缓存30分钟
+        # 基金列表缓存在共享存储中，多个工作进程不重复获取；进程内保留副本，快照未变化时不重复反序列化
+        self.store = store or get_cache_store()
+        self.frames = LocalFrameCache(self.store, self.CACHE_NAMESPACE)
     
     async def search_funds(self, keyword: str, market_type: str = 'ETF') -> List[Dict[str, Any]]:
         """
@@ -69,6 +76,21 @@ class FundServiceAsync:
             logger.exception(e)
             raise Exception(error_msg)
     
+    async def snapshot_time(self, market_type: str = 'ETF') -> Optional[Tuple[float, float]]:
+        """
+        获取共享缓存中基金列表快照的生成时间和过期时间，不读取快照内容
+        
+        Args:
+            market_type: 市场类型，'ETF'或'LOF'
+            
+        Returns:
+            (生成时间, 过期时间)的Unix时间戳，尚未缓存时返回None
+        """
+        expires_at = await self.frames.expiry(market_type)
+        if expires_at is None:
+            return None
+        return expires_at - self.CACHE_TTL, expires_at
+    
     async def _get_funds_data(self, market_type: str = 'ETF') -> pd.DataFrame:
         """
         异步获取基金数据，支持缓存
@@ -80,18 +102,10 @@ class FundServiceAsync:
             包含基金数据的DataFrame
         """
         # 检查缓存是否有效
-        now = datetime.now()
-        cache_valid = (
-            self._cache_timestamp is not None and 
-            (now - self._cache_timestamp) < self._cache_duration
-        )
-        
-        if market_type == 'ETF' and cache_valid and self._etf_cache is not None:
-            logger.debug("使用ETF缓存数据")
-            return self._etf_cache
-        elif market_type == 'LOF' and cache_valid and self._lof_cache is not None:
-            logger.debug("使用LOF缓存数据")
-            return self._lof_cache
+        df = await self.frames.get(market_type)
+        if df is not None:
+            logger.debug(f"使用{market_type}缓存数据")
+            return df
         
         # 缓存无效，重新获取数据
         try:
@@ -100,12 +114,10 @@ class FundServiceAsync:
             # 使用线程池执行同步的akshare调用
             if market_type == 'ETF':
                 df = await asyncio.to_thread(self._get_etf_data)
-                self._etf_cache = df
             else:
                 df = await asyncio.to_thread(self._get_lof_data)
-                self._lof_cache = df
                 
-            self._cache_timestamp = now
+            await self.frames.set(market_type, df, self.CACHE_TTL)
             return df
             
         except Exception as e:
@@ -0,0 +1,314 @@
+import os
+import time
+import asyncio
+import atexit
+import threading
+import numpy as np
+import pandas as pd
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+from typing import Dict, List, Optional, Tuple, Any
+from utils.logger import get_logger
+from utils.deadline import Deadline
+from utils.metrics import get_metrics
+from utils.request_profiler import observe_stage
+from utils.server_config import get_web_workers
+from services.technical_indicator import TechnicalIndicator
+from services.stock_scorer import StockScorer
+
+# 获取日志器
+logger = get_logger()
+
+# 传入子进程的K线列，calculate_indicators只依赖这些列
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# 进程池在整个应用内共享，首次使用时创建
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """获取共享的计算进程池（惰性创建）"""
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is None:
+            # 多个Web工作进程各自持有进程池，默认按Web工作进程数分摊CPU核数
+            _process_pool_workers = int(os.getenv('INDICATOR_POOL_WORKERS')
+                                        or max(1, min(4, (os.cpu_count() or 1) // get_web_workers())))
+            # 使用spawn启动方式，避免fork带走事件循环和日志线程的状态
+            _process_pool = ProcessPoolExecutor(max_workers=_process_pool_workers, mp_context=get_context('spawn'))
+            logger.info(f"创建指标计算进程池，工作进程数: {_process_pool_workers}")
+        return _process_pool
+
+
+def shutdown_process_pool():
+    """关闭共享的计算进程池"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+            logger.info("指标计算进程池已关闭")
+
+
+atexit.register(shutdown_process_pool)
+
+
+def _unlink_when_done(blocks: List[shared_memory.SharedMemory], futures: List[Future]):
+    """
+    所有批次结束后删除共享内存
+
+    已在子进程中运行的批次无法取消，超时后仍会读写共享内存，等这些批次结束后再删除
+
+    Args:
+        blocks: 当前进程已关闭的共享内存
+        futures: 进程池中的批次
+    """
+    running = [future for future in futures if not future.done()]
+    remaining = [len(running)]
+    lock = threading.Lock()
+
+    def unlink():
+        for block in blocks:
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            unlink()
+
+    if not running:
+        unlink()
+        return
+    logger.debug(f"{len(running)} 批指标计算仍在运行，结束后删除共享内存")
+    for future in running:
+        future.add_done_callback(on_done)
+
+
+def _compute_chunk(bars_name: str, output_name: str, total_rows: int,
+                   spans: List[Tuple[str, int, int]], params: Dict[str, Any],
+                   output_columns: List[str]) -> List[Tuple[str, Optional[int], Optional[str]]]:
+    """
+    子进程中计算一组股票的技术指标和评分
+
+    K线从共享内存读取，指标结果直接写回输出共享内存，只有评分通过进程间通信返回
+
+    Returns:
+        每项为(股票代码, 评分, 错误信息)的列表，评分失败时评分为None
+    """
+    try:
+        bars_shm = shared_memory.SharedMemory(name=bars_name)
+        output_shm = shared_memory.SharedMemory(name=output_name)
+    except FileNotFoundError:
+        # 共享内存已被删除，说明该批次所属的计算已结束，放弃计算
+        return [(code, None, "计算已取消") for code, _, _ in spans]
+    bars = np.ndarray((total_rows, len(BAR_COLUMNS)), dtype=np.float64, buffer=bars_shm.buf)
+    output = np.ndarray((total_rows, len(output_columns)), dtype=np.float64, buffer=output_shm.buf)
+    try:
+        indicator = TechnicalIndicator(params)
+        scorer = StockScorer()
+        results = []
+        for code, start, end in spans:
+            try:
+                df = pd.DataFrame(bars[start:end], columns=BAR_COLUMNS)
+                result_df = indicator.calculate_indicators(df)
+                output[start:end] = result_df[output_columns].to_numpy(dtype=np.float64)
+            except Exception as e:
+                results.append((code, None, str(e)))
+                continue
+            try:
+                results.append((code, scorer.calculate_score(result_df), None))
+            except Exception as e:
+                logger.error(f"评分股票 {code} 时出错: {str(e)}")
+                results.append((code, None, None))
+        return results
+    finally:
+        # 释放对共享内存的引用后才能关闭
+        del bars, output
+        bars_shm.close()
+        output_shm.close()
+
+
+class IndicatorExecutor:
+    """
+    指标计算执行器
+    小批量在当前线程直接计算，超过阈值时把指标计算和评分交给进程池，避免阻塞事件循环
+    """
+
+    def __init__(self, indicator: TechnicalIndicator, scorer: StockScorer, threshold: Optional[int] = None):
+        """
+        初始化指标计算执行器
+
+        Args:
+            indicator: 技术指标计算服务
+            scorer: 股票评分服务
+            threshold: 启用进程池的最小股票数量，默认读取INDICATOR_POOL_THRESHOLD
+        """
+        self.indicator = indicator
+        self.scorer = scorer
+        self.threshold = threshold if threshold is not None else int(os.getenv('INDICATOR_POOL_THRESHOLD') or 30)
+
+        logger.debug(f"初始化IndicatorExecutor，进程池阈值: {self.threshold}")
+
+    async def compute(self, stock_dfs: Dict[str, pd.DataFrame], deadline: Optional[Deadline] = None) -> Tuple[Dict[str, pd.DataFrame], List[Tuple[str, int, str]], Dict[str, str], List[str]]:
+        """
+        批量计算技术指标并评分
+
+        Args:
+            stock_dfs: 字典，键为股票代码，值为原始K线DataFrame
+            deadline: 时间预算，到期时未完成的股票记为超时
+
+        Returns:
+            (带指标的DataFrame字典, 按评分降序的(股票代码, 评分, 推荐)列表, 股票代码到指标错误信息的字典, 超时的股票代码列表)
+        """
+        timed_out = [code for code, df in stock_dfs.items() if getattr(df, 'timed_out', False)]
+        if timed_out:
+            stock_dfs = {code: df for code, df in stock_dfs.items() if not getattr(df, 'timed_out', False)}
+
+        if len(stock_dfs) < self.threshold or self.threshold <= 0:
+            stock_with_indicators, results, errors, unfinished = self._compute_inline(stock_dfs, deadline)
+        else:
+            # 进程池中指标和评分在同一批次内完成，按整体耗时记为指标阶段
+            started = time.perf_counter()
+            stock_with_indicators, results, errors, unfinished = await self._compute_in_pool(stock_dfs, deadline)
+            observe_stage("indicators", started, "pool")
+        return stock_with_indicators, results, errors, timed_out + unfinished
+
+    def _compute_inline(self, stock_dfs: Dict[str, pd.DataFrame], deadline: Optional[Deadline] = None) -> Tuple[Dict[str, pd.DataFrame], List[Tuple[str, int, str]], Dict[str, str], List[str]]:
+        """在当前线程中计算"""
+        stock_with_indicators = {}
+        errors = {}
+        timed_out = []
+        started = time.perf_counter()
+        for code, df in stock_dfs.items():
+            if deadline is not None and deadline.expired():
+                timed_out.append(code)
+                continue
+            try:
+                stock_with_indicators[code] = self.indicator.calculate_indicators(df)
+            except Exception as e:
+                logger.error(f"计算 {code} 技术指标时出错: {str(e)}")
+                errors[code] = f"计算技术指标时出错: {str(e)}"
+
+        observe_stage("indicators", started, "batch")
+        started = time.perf_counter()
+        results = self.scorer.batch_score_stocks(stock_with_indicators)
+        observe_stage("scoring", started, "batch")
+        return stock_with_indicators, results, errors, timed_out
+
+    async def _compute_in_pool(self, stock_dfs: Dict[str, pd.DataFrame], deadline: Optional[Deadline] = None) -> Tuple[Dict[str, pd.DataFrame], List[Tuple[str, int, str]], Dict[str, str], List[str]]:
+        """通过共享内存把K线交给进程池计算"""
+        errors = {}
+        spans = []
+        total_rows = 0
+        for code, df in stock_dfs.items():
+            missing = [col for col in BAR_COLUMNS if col not in df.columns]
+            if df.empty or missing:
+                if getattr(df, 'error', None):
+                    reason = df.error
+                elif missing:
+                    reason = f"缺少列 {missing}"
+                else:
+                    reason = "数据为空"
+                logger.error(f"计算 {code} 技术指标时出错: {reason}")
+                errors[code] = f"计算技术指标时出错: {reason}"
+                continue
+            spans.append((code, total_rows, total_rows + len(df)))
+            total_rows += len(df)
+
+        if not spans:
+            return {}, [], errors, []
+
+        output_columns = self.indicator.indicator_columns()
+        bar_bytes = total_rows * len(BAR_COLUMNS) * 8
+        output_bytes = total_rows * len(output_columns) * 8
+        bars_shm = shared_memory.SharedMemory(create=True, size=bar_bytes)
+        output_shm = shared_memory.SharedMemory(create=True, size=output_bytes)
+        pool_futures = {}
+        try:
+            bars = np.ndarray((total_rows, len(BAR_COLUMNS)), dtype=np.float64, buffer=bars_shm.buf)
+            try:
+                for code, start, end in spans:
+                    bars[start:end] = stock_dfs[code][BAR_COLUMNS].to_numpy(dtype=np.float64)
+            finally:
+                del bars
+
+            pool = get_process_pool()
+            chunks = self._split_spans(spans, _process_pool_workers * 2)
+            logger.info(f"进程池计算 {len(spans)} 只股票的技术指标，共 {total_rows} 行，分为 {len(chunks)} 批")
+
+            pool_futures = {
+                pool.submit(
+                    _compute_chunk, bars_shm.name, output_shm.name, total_rows,
+                    chunk, self.indicator.params, output_columns
+                ): chunk
+                for chunk in chunks
+            }
+            # 进程池中排队和执行中的批次数
+            get_metrics().add_gauge("indicator_pool_tasks", len(pool_futures))
+            for future in pool_futures:
+                future.add_done_callback(lambda _: get_metrics().add_gauge("indicator_pool_tasks", -1))
+            futures = {asyncio.wrap_future(future): future for future in pool_futures}
+            try:
+                done, pending = await asyncio.wait(futures, timeout=deadline.remaining() if deadline else None)
+            except asyncio.CancelledError:
+                for future in pool_futures:
+                    future.cancel()
+                raise
+
+            timed_out = []
+            for future in pending:
+                # 尚未开始的批次直接取消，已在子进程中运行的批次结果被丢弃
+                futures[future].cancel()
+                future.cancel()
+                timed_out.extend(code for code, _, _ in pool_futures[futures[future]])
+            if timed_out:
+                logger.warning(f"指标计算超出时间预算，{len(timed_out)} 只股票未完成")
+
+            output = np.ndarray((total_rows, len(output_columns)), dtype=np.float64, buffer=output_shm.buf)
+            span_by_code = {code: (start, end) for code, start, end in spans}
+            stock_with_indicators = {}
+            results = []
+            try:
+                for future in done:
+                    for code, score, error in future.result():
+                        if error is not None:
+                            logger.error(f"计算 {code} 技术指标时出错: {error}")
+                            errors[code] = f"计算技术指标时出错: {error}"
+                            continue
+                        start, end = span_by_code[code]
+                        result_df = stock_dfs[code].copy()
+                        result_df[output_columns] = output[start:end].copy()
+                        stock_with_indicators[code] = result_df
+                        if score is not None:
+                            results.append((code, score, self.scorer.get_recommendation(score)))
+            finally:
+                # 批次抛出异常时也要先释放视图，否则关闭共享内存时的BufferError会掩盖原始异常
+                del output
+
+            # 与batch_score_stocks保持一致，按评分降序排序
+            results.sort(key=lambda x: x[1], reverse=True)
+            return stock_with_indicators, results, errors, timed_out
+        finally:
+            bars_shm.close()
+            output_shm.close()
+            _unlink_when_done([bars_shm, output_shm], list(pool_futures))
+
+    @staticmethod
+    def _split_spans(spans: List[Tuple[str, int, int]], parts: int) -> List[List[Tuple[str, int, int]]]:
+        """按行数把股票大致均匀地分成若干批"""
+        parts = max(1, min(parts, len(spans)))
+        total_rows = spans[-1][2]
+        target = total_rows / parts
+        chunks = [[]]
+        for span in spans:
+            if chunks[-1] and span[1] >= target * len(chunks) and len(chunks) < parts:
+                chunks.append([])
+            chunks[-1].append(span)
+        return chunks
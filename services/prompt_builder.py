@@ -0,0 +1,250 @@
+import os
+import math
+from typing import Callable, Dict, List, Optional, Tuple
+import pandas as pd
+from utils.logger import get_logger
+from utils.stream_demuxer import SECTION_MARKER
+
+# 获取日志器
+logger = get_logger()
+
+# 写入提示词的K线列：(列名, 表头, 小数位数)，小数位数为None时按价格精度
+PROMPT_COLUMNS: List[Tuple[str, str, Optional[int]]] = [
+    ('Open', '开', None),
+    ('High', '高', None),
+    ('Low', '低', None),
+    ('Close', '收', None),
+    ('Change_pct', '涨跌%', 2),
+    ('Volume', '量', 0),
+    ('MA5', 'MA5', None),
+    ('MA20', 'MA20', None),
+    ('RSI', 'RSI', 1),
+    ('MACD', 'MACD', 3),
+    ('Volume_Ratio', '量比', 2),
+]
+
+# 超出预算时依次去掉的列
+OPTIONAL_COLUMNS = ['MACD', 'Volume_Ratio', 'MA5', 'Open']
+
+# 各市场价格精度
+PRICE_PRECISION: Dict[str, int] = {'A': 2, 'HK': 3, 'US': 2, 'ETF': 3, 'LOF': 3}
+
+# 各市场提示词的估算token预算
+MARKET_TOKEN_BUDGETS: Dict[str, int] = {'A': 1200, 'HK': 1200, 'US': 1200, 'ETF': 1000, 'LOF': 1000}
+
+# K线行数上下限
+MAX_ROWS = 14
+MIN_ROWS = 5
+
+# 各市场的分析要求
+MARKET_INSTRUCTIONS: Dict[str, Tuple[str, str]] = {
+    'ETF': ('基金', """请提供：
+1. 净值走势分析（包含支撑位和压力位）
+2. 成交量分析及其对净值的影响
+3. 风险评估（包含波动率和折溢价分析）
+4. 短期和中期净值预测
+5. 关键价格位分析
+6. 申购赎回建议（包含止损位）
+
+请基于技术指标和市场表现进行分析，给出具体数据支持。"""),
+    'US': ('美股', """请提供：
+1. 趋势分析（包含支撑位和压力位，美元计价）
+2. 成交量分析及其含义
+3. 风险评估（包含波动率和美股市场特有风险）
+4. 短期和中期目标价位（美元）
+5. 关键技术位分析
+6. 具体交易建议（包含止损位）
+
+请基于技术指标和美股市场特点进行分析，给出具体数据支持。"""),
+    'HK': ('港股', """请提供：
+1. 趋势分析（包含支撑位和压力位，港币计价）
+2. 成交量分析及其含义
+3. 风险评估（包含波动率和港股市场特有风险）
+4. 短期和中期目标价位（港币）
+5. 关键技术位分析
+6. 具体交易建议（包含止损位）
+
+请基于技术指标和港股市场特点进行分析，给出具体数据支持。"""),
+    'A': ('A股', """请提供：
+1. 趋势分析（包含支撑位和压力位）
+2. 成交量分析及其含义
+3. 风险评估（包含波动率分析）
+4. 短期和中期目标价位
+5. 关键技术位分析
+6. 具体交易建议（包含止损位）
+
+请基于技术指标和A股市场特点进行分析，给出具体数据支持。"""),
+}
+MARKET_INSTRUCTIONS['LOF'] = MARKET_INSTRUCTIONS['ETF']
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数
+
+    中日韩字符按每字1个token计，其余字符按每3个字符1个token计（数字和符号切分较碎）
+
+    Args:
+        text: 文本
+
+    Returns:
+        int: 估算的token数
+    """
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + math.ceil((len(text) - cjk) / 3)
+
+
+class PromptBuilder:
+    """
+    AI分析提示词构建器
+    把近期K线编码为只含选定列的定精度紧凑表格，并按市场类型控制提示词的token预算
+    """
+
+    def __init__(self, token_budget: Optional[int] = None):
+        """
+        初始化提示词构建器
+
+        Args:
+            token_budget: 所有市场统一的token预算，默认读取PROMPT_TOKEN_BUDGET，未设置时使用各市场的默认预算
+        """
+        budget = token_budget or int(os.getenv('PROMPT_TOKEN_BUDGET') or 0)
+        self.budgets = {market: budget or default for market, default in MARKET_TOKEN_BUDGETS.items()}
+
+        logger.debug(f"初始化PromptBuilder，token预算: {self.budgets}")
+
+    def build(self, df: pd.DataFrame, stock_code: str, market_type: str, technical_summary: dict) -> Tuple[str, int]:
+        """
+        构建分析提示词
+
+        先按最多MAX_ROWS行K线和全部选定列编码，超出预算时逐步减少行数（不少于MIN_ROWS），
+        仍超出时依次去掉OPTIONAL_COLUMNS中的列
+
+        Args:
+            df: 包含技术指标的DataFrame
+            stock_code: 股票代码
+            market_type: 市场类型
+            technical_summary: 技术指标概要
+
+        Returns:
+            (提示词, 估算的token数)
+        """
+        label, instructions = MARKET_INSTRUCTIONS.get(market_type, MARKET_INSTRUCTIONS['A'])
+        precision = PRICE_PRECISION.get(market_type, 2)
+
+        def render(columns, rows):
+            data = self._render_data(df, stock_code, technical_summary, columns, rows, precision)
+            return f"分析{label} {stock_code}：\n\n{data}\n\n{instructions}"
+
+        return self._fit(render, df, stock_code, self.budgets.get(market_type, self.budgets['A']))
+
+    def build_batch(self, entries: List[Tuple[str, pd.DataFrame, dict]], market_type: str) -> Tuple[str, int]:
+        """
+        构建多只股票的批量分析提示词
+
+        每只股票的数据段按单只预算的一半控制，分析要求只出现一次，
+        并要求模型在每只股票的分析前输出独占一行的分段标记
+
+        Args:
+            entries: (股票代码, 包含技术指标的DataFrame, 技术指标概要)列表
+            market_type: 市场类型
+
+        Returns:
+            (提示词, 估算的token数)
+        """
+        label, instructions = MARKET_INSTRUCTIONS.get(market_type, MARKET_INSTRUCTIONS['A'])
+        precision = PRICE_PRECISION.get(market_type, 2)
+        budget = self.budgets.get(market_type, self.budgets['A']) // 2
+
+        blocks = []
+        for stock_code, df, technical_summary in entries:
+            block, _ = self._fit(
+                lambda columns, rows: f"【{stock_code}】\n" + self._render_data(
+                    df, stock_code, technical_summary, columns, rows, precision),
+                df, stock_code, budget
+            )
+            blocks.append(block)
+
+        codes = '、'.join(code for code, _, _ in entries)
+        marker = SECTION_MARKER.format(code='代码')
+        prompt = (
+            f"分析以下{len(entries)}只{label}：\n\n" + '\n\n'.join(blocks) + "\n\n"
+            f"请按 {codes} 的顺序逐只分析。每只股票的分析必须以独占一行的分段标记开始，格式为 {marker}，"
+            f"标记之外不要输出其他股票的内容。每只股票的分析要求如下：\n{instructions}"
+        )
+        tokens = estimate_tokens(prompt)
+        logger.debug(f"批量提示词: {len(entries)} 只股票, 估算 {tokens} tokens")
+        return prompt, tokens
+
+    def _fit(self, render: Callable[[list, int], str], df: pd.DataFrame, stock_code: str, budget: int) -> Tuple[str, int]:
+        """
+        在预算内渲染提示词
+
+        Args:
+            render: 按(列, 行数)渲染文本的函数
+            df: 包含技术指标的DataFrame
+            stock_code: 股票代码
+            budget: token预算
+
+        Returns:
+            (文本, 估算的token数)
+        """
+        columns = [col for col in PROMPT_COLUMNS if col[0] in df.columns]
+        rows = min(MAX_ROWS, len(df))
+
+        text = render(columns, rows)
+        tokens = estimate_tokens(text)
+        optional = [name for name in OPTIONAL_COLUMNS if any(col[0] == name for col in columns)]
+        while tokens > budget:
+            if rows > MIN_ROWS:
+                rows -= 1
+            elif optional:
+                drop = optional.pop(0)
+                columns = [col for col in columns if col[0] != drop]
+            else:
+                logger.warning(f"{stock_code} 提示词估算 {tokens} tokens，超出预算 {budget}")
+                break
+            text = render(columns, rows)
+            tokens = estimate_tokens(text)
+
+        logger.debug(f"{stock_code} 提示词: {rows} 行K线, {len(columns)} 列, 估算 {tokens} tokens")
+        return text, tokens
+
+    def _render_data(self, df: pd.DataFrame, stock_code: str, technical_summary: dict,
+                     columns: List[Tuple[str, str, Optional[int]]], rows: int, precision: int) -> str:
+        """按给定列和行数渲染单只股票的数据段"""
+        return (
+            f"技术指标概要：\n{self._format_summary(technical_summary)}\n\n"
+            f"近{rows}日交易数据：\n{self._format_table(df.tail(rows), columns, precision)}"
+        )
+
+    @staticmethod
+    def _format_summary(technical_summary: dict) -> str:
+        """格式化技术指标概要"""
+        rsi = technical_summary.get('rsi_level')
+        rsi_text = f"{rsi:.1f}" if isinstance(rsi, (int, float)) and not pd.isna(rsi) else '-'
+        return (f"趋势: {technical_summary.get('trend')}，波动率: {technical_summary.get('volatility')}，"
+                f"成交量: {technical_summary.get('volume_trend')}，RSI: {rsi_text}")
+
+    @staticmethod
+    def _format_table(df: pd.DataFrame, columns: List[Tuple[str, str, Optional[int]]], price_precision: int) -> str:
+        """
+        把K线编码为以|分隔的定精度表格
+
+        Args:
+            df: 需要编码的K线
+            columns: 选定的列
+            price_precision: 价格精度
+
+        Returns:
+            str: 表格文本，首行为表头
+        """
+        has_dates = isinstance(df.index, pd.DatetimeIndex)
+        lines = ['|'.join((['日期'] if has_dates else []) + [header for _, header, _ in columns])]
+        formats = [f"{{:.{price_precision if digits is None else digits}f}}" for _, _, digits in columns]
+        values = df[[name for name, _, _ in columns]].to_numpy(dtype=float, na_value=float('nan'))
+        for index, row in zip(df.index, values):
+            cells = [fmt.format(value) if not math.isnan(value) else '-' for fmt, value in zip(formats, row)]
+            if has_dates:
+                cells.insert(0, index.strftime('%Y-%m-%d'))
+            lines.append('|'.join(cells))
+        return '\n'.join(lines)
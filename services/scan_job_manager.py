@@ -0,0 +1,486 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
+from utils.logger import get_logger
+from utils.metrics import get_metrics
+from utils.data_dir import get_data_dir
+from utils.server_config import get_worker_id
+from utils.event_encoder import decode_event
+
+# 获取日志器
+logger = get_logger()
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_INTERRUPTED = "interrupted"
+FINISHED_STATUSES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED, JOB_INTERRUPTED)
+
+# 工作进程心跳间隔和判定失联的秒数
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TIMEOUT = 30
+
+
+class JobQueueFullError(Exception):
+    """扫描任务队列已满"""
+
+
+class ScanJobStore:
+    """
+    扫描任务存储
+    使用本地SQLite保存任务状态和任务产生的流式事件；多个工作进程共享同一文件，
+    每个任务记录执行它的工作进程，工作进程定期写入心跳
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        初始化扫描任务存储
+
+        Args:
+            db_path: 数据库文件路径，默认为数据目录下的scan_jobs.db
+        """
+        self.db_path = db_path or os.path.join(get_data_dir(), 'scan_jobs.db')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS scan_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    owner TEXT,
+                    market_type TEXT NOT NULL,
+                    stock_codes TEXT NOT NULL,
+                    min_score INTEGER NOT NULL,
+                    total INTEGER NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    worker TEXT
+                )
+            """)
+            # 兼容没有worker列的旧数据库
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(scan_jobs)").fetchall()]
+            if 'worker' not in columns:
+                self._conn.execute("ALTER TABLE scan_jobs ADD COLUMN worker TEXT")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS scan_workers (
+                    worker_id TEXT PRIMARY KEY,
+                    heartbeat_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS scan_job_events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                )
+            """)
+
+        logger.debug(f"初始化ScanJobStore: {self.db_path}")
+
+    def create_job(self, job_id: str, owner: Optional[str], market_type: str,
+                   stock_codes: List[str], min_score: int, worker: Optional[str] = None) -> Dict[str, Any]:
+        """创建排队中的任务记录，worker为执行该任务的工作进程"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO scan_jobs (job_id, status, owner, market_type, stock_codes, min_score, total, created_at, worker) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, JOB_QUEUED, owner, market_type, json.dumps(stock_codes), min_score, len(stock_codes),
+                 time.time(), worker)
+            )
+        return self.get_job(job_id)
+
+    def update_job(self, job_id: str, if_status: Optional[str] = None, **fields) -> bool:
+        """
+        更新任务字段
+
+        Args:
+            job_id: 任务ID
+            if_status: 指定时只在任务处于该状态时更新，避免覆盖其他工作进程写入的取消状态
+            **fields: 要更新的字段
+
+        Returns:
+            bool: 是否更新了任务
+        """
+        if not fields:
+            return False
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        sql = f"UPDATE scan_jobs SET {assignments} WHERE job_id = ?"
+        params = [*fields.values(), job_id]
+        if if_status is not None:
+            sql += " AND status = ?"
+            params.append(if_status)
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+        return cursor.rowcount == 1
+
+    def get_status(self, job_id: str) -> Optional[str]:
+        """获取任务状态"""
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM scan_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务记录"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM scan_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            event_count = self._conn.execute(
+                "SELECT COUNT(*) FROM scan_job_events WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+        job = dict(row)
+        job['stock_codes'] = json.loads(job['stock_codes'])
+        job['event_count'] = event_count
+        return job
+
+    def append_events(self, job_id: str, start_seq: int, payloads: List[bytes]):
+        """批量追加任务事件"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO scan_job_events (job_id, seq, payload) VALUES (?, ?, ?)",
+                [(job_id, start_seq + i, payload) for i, payload in enumerate(payloads)]
+            )
+
+    def get_events(self, job_id: str, after: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        """获取序号大于after的任务事件"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, payload FROM scan_job_events WHERE job_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (job_id, after, limit)
+            ).fetchall()
+        return [{"seq": row["seq"], "event": decode_event(row["payload"])} for row in rows]
+
+    def mark_unfinished(self, status: str, error: str, worker: Optional[str] = None) -> int:
+        """将未结束的任务（指定worker时只包括该工作进程的任务）标记为指定状态，返回受影响的任务数"""
+        sql = "UPDATE scan_jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?)"
+        params = [status, error, time.time(), JOB_QUEUED, JOB_RUNNING]
+        if worker is not None:
+            sql += " AND worker = ?"
+            params.append(worker)
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+        return cursor.rowcount
+
+    def heartbeat(self, worker: str):
+        """记录工作进程心跳"""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO scan_workers (worker_id, heartbeat_at) VALUES (?, ?)",
+                               (worker, time.time()))
+
+    def remove_worker(self, worker: str):
+        """删除工作进程心跳"""
+        with self._lock:
+            self._conn.execute("DELETE FROM scan_workers WHERE worker_id = ?", (worker,))
+
+    def mark_orphaned(self, status: str, error: str, timeout: float = HEARTBEAT_TIMEOUT) -> int:
+        """
+        将执行进程已退出（心跳超时或没有记录执行进程）的未结束任务标记为指定状态
+
+        Args:
+            status: 目标状态
+            error: 错误信息
+            timeout: 心跳超时秒数
+
+        Returns:
+            int: 受影响的任务数
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM scan_workers WHERE heartbeat_at < ?", (now - timeout,))
+            cursor = self._conn.execute(
+                "UPDATE scan_jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?) "
+                "AND (worker IS NULL OR worker NOT IN (SELECT worker_id FROM scan_workers))",
+                (status, error, now, JOB_QUEUED, JOB_RUNNING)
+            )
+        return cursor.rowcount
+
+    def purge(self, older_than: float) -> int:
+        """删除在指定时间之前结束的任务及其事件"""
+        with self._lock:
+            job_ids = [row[0] for row in self._conn.execute(
+                "SELECT job_id FROM scan_jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (older_than,)
+            ).fetchall()]
+            for job_id in job_ids:
+                self._conn.execute("DELETE FROM scan_job_events WHERE job_id = ?", (job_id,))
+                self._conn.execute("DELETE FROM scan_jobs WHERE job_id = ?", (job_id,))
+        return len(job_ids)
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+class ScanJobManager:
+    """
+    后台扫描任务管理器
+    以有界的工作协程池执行批量扫描，结果写入ScanJobStore，客户端可随时轮询或订阅；
+    多工作进程部署时任务由提交它的进程执行，其他进程可以查询、订阅和取消
+    """
+
+    def __init__(self, service_factory: Callable[[Dict[str, Any]], Any], store: Optional[ScanJobStore] = None,
+                 max_workers: Optional[int] = None, max_pending: Optional[int] = None):
+        """
+        初始化后台扫描任务管理器
+
+        Args:
+            service_factory: 根据API配置创建StockAnalyzerService的工厂函数
+            store: 任务存储，默认使用数据目录下的SQLite文件
+            max_workers: 同时执行的任务数，默认读取SCAN_JOB_WORKERS
+            max_pending: 排队任务上限，默认读取SCAN_JOB_MAX_PENDING
+        """
+        self.service_factory = service_factory
+        self.store = store or ScanJobStore()
+        self.max_workers = max_workers or int(os.getenv('SCAN_JOB_WORKERS') or 2)
+        self.max_pending = max_pending or int(os.getenv('SCAN_JOB_MAX_PENDING') or 20)
+        self.retention = float(os.getenv('SCAN_JOB_RETENTION_HOURS') or 72) * 3600
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        # API配置只保存在内存中，不落盘
+        self._pending_configs: Dict[str, Dict[str, Any]] = {}
+        self.worker_id = get_worker_id()
+        self._heartbeat: Optional[asyncio.Task] = None
+        # 停止时取消的任务标记为中断而不是已取消
+        self._stopping = False
+
+        logger.debug(f"初始化ScanJobManager: 工作协程数={self.max_workers}, 排队上限={self.max_pending}")
+
+    async def start(self):
+        """启动工作协程"""
+        # 先写入心跳，只中断已退出进程遗留的任务，不影响其他仍在运行的工作进程
+        self.store.heartbeat(self.worker_id)
+        interrupted = self.store.mark_orphaned(JOB_INTERRUPTED, "服务重启，任务已中断")
+        if interrupted:
+            logger.warning(f"{interrupted} 个扫描任务因服务重启被标记为中断")
+        self.store.purge(time.time() - self.retention)
+
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.max_workers)]
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        get_metrics().register_gauge("scan_jobs", lambda: [
+            ({"state": "queued"}, self._queue.qsize() if self._queue else 0),
+            ({"state": "running"}, len(self._running)),
+        ])
+        logger.info(f"扫描任务管理器已启动，工作协程数: {self.max_workers}")
+
+    async def stop(self):
+        """停止工作协程，当前进程正在执行的任务标记为中断"""
+        self._stopping = True
+        tasks = self._workers + ([self._heartbeat] if self._heartbeat else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._heartbeat = None
+        self.store.mark_unfinished(JOB_INTERRUPTED, "服务关闭，任务已中断", worker=self.worker_id)
+        self.store.remove_worker(self.worker_id)
+        self.store.close()
+        logger.info("扫描任务管理器已停止")
+
+    async def _heartbeat_loop(self):
+        """定期写入心跳，并中断已退出的工作进程遗留的任务"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                self.store.heartbeat(self.worker_id)
+                interrupted = self.store.mark_orphaned(JOB_INTERRUPTED, "执行任务的工作进程已退出")
+                if interrupted:
+                    logger.warning(f"{interrupted} 个扫描任务因工作进程退出被标记为中断")
+            except Exception as e:
+                logger.error(f"写入扫描任务心跳失败: {str(e)}")
+
+    async def submit(self, stock_codes: List[str], market_type: str = 'A', min_score: int = 0,
+               api_config: Optional[Dict[str, Any]] = None, owner: Optional[str] = None) -> Dict[str, Any]:
+        """
+        提交扫描任务
+
+        Args:
+            stock_codes: 股票代码列表
+            market_type: 市场类型
+            min_score: 最低评分阈值
+            api_config: 自定义API配置
+            owner: 提交任务的客户端标识
+
+        Returns:
+            任务记录
+
+        Raises:
+            JobQueueFullError: 排队任务已达上限
+        """
+        if self._queue is None or self._queue.full():
+            raise JobQueueFullError("扫描任务队列已满，请稍后再试")
+
+        job_id = uuid.uuid4().hex
+        job = await asyncio.to_thread(self.store.create_job, job_id, owner, market_type, stock_codes, min_score,
+                                      worker=self.worker_id)
+        self._pending_configs[job_id] = api_config or {}
+        self._queue.put_nowait(job_id)
+        logger.info(f"提交扫描任务 {job_id}: {len(stock_codes)} 只股票, 市场: {market_type}")
+        return job
+
+    async def get_job(self, job_id: str, owner: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        获取任务状态
+
+        Args:
+            job_id: 任务ID
+            owner: 请求的客户端标识，指定时只返回该客户端提交的任务
+
+        Returns:
+            任务记录，任务不存在或不属于该客户端时为None
+        """
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None or (owner is not None and job['owner'] != owner):
+            return None
+        return job
+
+    async def get_events(self, job_id: str, after: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        """获取任务已产生的事件"""
+        return await asyncio.to_thread(self.store.get_events, job_id, after, limit)
+
+    async def cancel(self, job_id: str, owner: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        取消排队中或执行中的任务
+
+        Args:
+            job_id: 任务ID
+            owner: 请求的客户端标识，指定时只能取消该客户端提交的任务
+
+        Returns:
+            任务记录，任务不存在或不属于该客户端时为None
+        """
+        job = await self.get_job(job_id, owner)
+        if job is None or job['status'] in FINISHED_STATUSES:
+            return job
+
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        else:
+            # 排队中的任务或由其他工作进程执行的任务，执行进程在下次写入事件时发现状态变化并停止
+            self._pending_configs.pop(job_id, None)
+            await asyncio.to_thread(self.store.update_job, job_id, status=JOB_CANCELLED, finished_at=time.time())
+        logger.info(f"取消扫描任务 {job_id}")
+        return await asyncio.to_thread(self.store.get_job, job_id)
+
+    async def subscribe(self, job_id: str, after: int = 0, poll_interval: float = 0.5) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        订阅任务事件，先回放已有事件，再持续推送新事件直到任务结束
+
+        Args:
+            job_id: 任务ID
+            after: 只推送序号大于after的事件
+            poll_interval: 轮询间隔（秒）
+        """
+        while True:
+            job = await asyncio.to_thread(self.store.get_job, job_id)
+            events = await asyncio.to_thread(self.store.get_events, job_id, after)
+            for event in events:
+                after = event['seq']
+                yield event
+            if job is None or (job['status'] in FINISHED_STATUSES and not events):
+                return
+            if not events:
+                await asyncio.sleep(poll_interval)
+
+    async def _worker(self, index: int):
+        """工作协程，依次执行队列中的任务"""
+        while True:
+            job_id = await self._queue.get()
+            try:
+                if job_id not in self._pending_configs or \
+                        await asyncio.to_thread(self.store.get_status, job_id) != JOB_QUEUED:
+                    # 排队期间已被取消
+                    self._pending_configs.pop(job_id, None)
+                    continue
+                task = asyncio.create_task(self._run_job(job_id, self._pending_configs.pop(job_id)))
+                self._running[job_id] = task
+                try:
+                    # asyncio.wait不会把工作协程的取消传递给任务，任务被单独取消时工作协程继续运行
+                    await asyncio.wait({task})
+                except asyncio.CancelledError:
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    raise
+            finally:
+                self._running.pop(job_id, None)
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: str, api_config: Dict[str, Any], flush_size: int = 50, flush_interval: float = 0.5):
+        """执行单个扫描任务，事件按批写入存储，SQLite读写放到线程中执行，不阻塞事件循环"""
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        await asyncio.to_thread(self.store.update_job, job_id, status=JOB_RUNNING, started_at=time.time())
+        logger.info(f"开始执行扫描任务 {job_id}")
+
+        seq = 0
+        pending: List[bytes] = []
+        finished_codes = set()
+        last_flush = time.monotonic()
+
+        async def flush():
+            nonlocal seq, pending, last_flush
+            if pending:
+                payloads, pending = pending, []
+                await asyncio.to_thread(self.store.append_events, job_id, seq + 1, payloads)
+                seq += len(payloads)
+            await asyncio.to_thread(self.store.update_job, job_id, done=len(finished_codes))
+            last_flush = time.monotonic()
+
+        try:
+            service = self.service_factory(api_config)
+            async for chunk in service.scan_stocks(job['stock_codes'], market_type=job['market_type'],
+                                                   min_score=job['min_score'], stream=True):
+                pending.append(chunk)
+                event = decode_event(chunk)
+                code = event.get('stock_code')
+                if code and ('score' in event or event.get('status') == 'error'):
+                    finished_codes.add(code)
+                if len(pending) >= flush_size or time.monotonic() - last_flush >= flush_interval:
+                    await flush()
+                    if await asyncio.to_thread(self.store.get_status, job_id) == JOB_CANCELLED:
+                        # 任务被其他工作进程取消
+                        raise asyncio.CancelledError()
+            await flush()
+            # 最后一次检查之后可能被其他工作进程取消，只在仍为执行中时标记完成
+            if await asyncio.to_thread(self.store.update_job, job_id, if_status=JOB_RUNNING,
+                                       status=JOB_COMPLETED, finished_at=time.time()):
+                logger.info(f"扫描任务 {job_id} 完成，共 {seq} 个事件")
+            else:
+                logger.info(f"扫描任务 {job_id} 已在完成前被取消")
+        except asyncio.CancelledError:
+            await flush()
+            if self._stopping:
+                # 服务关闭时被取消，与进程退出遗留的任务一样标记为中断
+                await asyncio.to_thread(self.store.update_job, job_id, if_status=JOB_RUNNING, status=JOB_INTERRUPTED,
+                                        error="服务关闭，任务已中断", finished_at=time.time())
+                logger.info(f"扫描任务 {job_id} 因服务关闭中断")
+            else:
+                await asyncio.to_thread(self.store.update_job, job_id, status=JOB_CANCELLED, finished_at=time.time())
+                logger.info(f"扫描任务 {job_id} 已取消")
+            raise
+        except Exception as e:
+            await flush()
+            await asyncio.to_thread(self.store.update_job, job_id, if_status=JOB_RUNNING, status=JOB_FAILED,
+                                    error=str(e), finished_at=time.time())
+            logger.error(f"扫描任务 {job_id} 失败: {str(e)}")
+            logger.exception(e)
+        finally:
+            await asyncio.to_thread(self.store.purge, time.time() - self.retention)
@@ -0,0 +1,83 @@
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from utils.logger import get_logger
+from utils.cache_store import CacheStore, get_cache_store
+from utils.market_time import trading_day, latest_bar_date, cache_ttl
+
+# 获取日志器
+logger = get_logger()
+
+
+class ScanResultCache:
+    """
+    批量扫描结果缓存
+    按(市场, 交易日, 股票代码)缓存单只股票的评分记录，重叠的股票池可以共享缓存
+    """
+
+    NAMESPACE = "scan_result"
+
+    def __init__(self, store: Optional[CacheStore] = None, intraday_ttl: Optional[float] = None):
+        """
+        初始化扫描结果缓存
+
+        Args:
+            store: 缓存存储，默认使用应用共享的CacheStore
+            intraday_ttl: 交易时段内的缓存秒数，默认读取SCAN_CACHE_INTRADAY_TTL，为0时交易时段内不缓存
+        """
+        self.store = store or get_cache_store()
+        self.intraday_ttl = intraday_ttl if intraday_ttl is not None else float(os.getenv('SCAN_CACHE_INTRADAY_TTL') or 300)
+
+        logger.debug(f"初始化ScanResultCache，交易时段缓存秒数: {self.intraday_ttl}")
+
+    def _key(self, market_type: str, stock_code: str, now: Optional[datetime] = None) -> str:
+        """构建缓存键"""
+        return f"{market_type}:{trading_day(market_type, now).isoformat()}:{stock_code}"
+
+    def get_many(self, stock_codes: List[str], market_type: str, now: Optional[datetime] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        获取当前交易日已缓存的评分记录
+
+        最新K线日期早于当前应有的最新K线时（如开盘前写入的上一交易日数据、数据源尚未更新当日K线）视为过期
+
+        Args:
+            stock_codes: 股票代码列表
+            market_type: 市场类型
+            now: 参考时间，默认为当前时间
+
+        Returns:
+            股票代码到评分记录的字典
+        """
+        keys = {self._key(market_type, code, now): code for code in stock_codes}
+        found = self.store.get_many(self.NAMESPACE, keys)
+        expected = latest_bar_date(market_type, now).isoformat()
+        return {
+            keys[key]: record for key, record in found.items()
+            if not record.get("bar_date") or record["bar_date"] >= expected
+        }
+
+    def put_many(self, records: Dict[str, Dict[str, Any]], market_type: str, intraday_ttl: Optional[float] = None,
+                 now: Optional[datetime] = None):
+        """
+        缓存评分记录
+
+        当日最后一个交易时段结束后缓存到当地午夜；交易时段内行情仍在变化，只缓存intraday_ttl秒，
+        开盘前和午间休市时同样只缓存intraday_ttl秒且不超过下一个交易时段开始
+
+        Args:
+            records: 股票代码到评分记录的字典
+            market_type: 市场类型
+            intraday_ttl: 覆盖未收盘时的缓存秒数（如定时预计算按其运行间隔缓存）
+            now: 参考时间，默认为当前时间
+        """
+        if not records:
+            return
+        ttl = cache_ttl(market_type, intraday_ttl if intraday_ttl is not None else self.intraday_ttl, now)
+        if ttl <= 0:
+            return
+        self.store.set_many(
+            self.NAMESPACE,
+            {self._key(market_type, code, now): record for code, record in records.items()},
+            ttl
+        )
+        logger.debug(f"缓存 {len(records)} 条{market_type}扫描结果，有效期 {ttl:.0f} 秒")
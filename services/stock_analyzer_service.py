@@ -1,11 +1,22 @@
-import json
+import copy
+import time
+import asyncio
+import pandas as pd
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, AsyncGenerator
+from typing import Any, Dict, List, Optional, AsyncGenerator
 from utils.logger import get_logger
+from utils.metrics import get_metrics
+from utils.request_profiler import observe_stage
+from utils.deadline import Deadline
+from utils.event_encoder import encode_event
 from services.stock_data_provider import StockDataProvider
 from services.technical_indicator import TechnicalIndicator
 from services.stock_scorer import StockScorer
 from services.ai_analyzer import AIAnalyzer
+from utils.llm_limiter import PRIORITY_BATCH
+from services.indicator_executor import IndicatorExecutor
+from services.scan_result_cache import ScanResultCache
 
 # 获取日志器
 logger = get_logger()
@@ -16,6 +27,9 @@ class StockAnalyzerService:
     作为门面类协调数据提供、指标计算、评分和AI分析等组件
     """
     
+    # 数据获取阶段最多占用的剩余时间预算比例，其余留给指标计算和AI分析
+    FETCH_BUDGET_FRACTION = 0.8
+    
     def __init__(self, custom_api_url=None, custom_api_key=None, custom_api_model=None, custom_api_timeout=None):
         """
         初始化股票分析服务
@@ -30,6 +44,8 @@ class StockAnalyzerService:
         self.data_provider = StockDataProvider()
         self.indicator = TechnicalIndicator()
         self.scorer = StockScorer()
+        self.indicator_executor = IndicatorExecutor(self.indicator, self.scorer)
+        self.scan_cache = ScanResultCache()
         self.ai_analyzer = AIAnalyzer(
             custom_api_url=custom_api_url,
             custom_api_key=custom_api_key,
@@ -37,9 +53,60 @@ class StockAnalyzerService:
             custom_api_timeout=custom_api_timeout
         )
         
+        # 按API配置缓存的AI分析器，所有请求视图共享
+        self._ai_config = self._ai_config_key(custom_api_url, custom_api_key, custom_api_model, custom_api_timeout)
+        self._ai_analyzers = OrderedDict()
+        
         logger.info("初始化StockAnalyzerService完成")
     
-    async def analyze_stock(self, stock_code: str, market_type: str = 'A', stream: bool = False) -> AsyncGenerator[str, None]:
+    @staticmethod
+    def _ai_config_key(custom_api_url=None, custom_api_key=None, custom_api_model=None, custom_api_timeout=None) -> tuple:
+        """构建AI配置的缓存键"""
+        return (custom_api_url or None, custom_api_key or None, custom_api_model or None,
+                str(custom_api_timeout) if custom_api_timeout else None)
+    
+    def for_request(self, custom_api_url=None, custom_api_key=None, custom_api_model=None, custom_api_timeout=None,
+                    max_ai_configs: int = 32) -> 'StockAnalyzerService':
+        """
+        获取应用自定义AI配置的轻量视图
+        
+        视图与当前实例共享数据提供、指标计算、评分和缓存等组件，只替换AI分析器；
+        相同的AI配置复用同一个AIAnalyzer实例
+        
+        Args:
+            custom_api_url: 自定义API URL
+            custom_api_key: 自定义API密钥
+            custom_api_model: 自定义API模型
+            custom_api_timeout: 自定义API超时时间
+            max_ai_configs: 最多保留的AI配置数量，超出时淘汰最久未使用的配置
+            
+        Returns:
+            StockAnalyzerService视图
+        """
+        key = self._ai_config_key(custom_api_url, custom_api_key, custom_api_model, custom_api_timeout)
+        if key == self._ai_config:
+            return self
+        
+        ai_analyzer = self._ai_analyzers.get(key)
+        if ai_analyzer is None:
+            ai_analyzer = AIAnalyzer(
+                custom_api_url=custom_api_url,
+                custom_api_key=custom_api_key,
+                custom_api_model=custom_api_model,
+                custom_api_timeout=custom_api_timeout
+            )
+            self._ai_analyzers[key] = ai_analyzer
+            while len(self._ai_analyzers) > max_ai_configs:
+                self._ai_analyzers.popitem(last=False)
+        else:
+            self._ai_analyzers.move_to_end(key)
+        
+        view = copy.copy(self)
+        view.ai_analyzer = ai_analyzer
+        return view
+    
+    async def analyze_stock(self, stock_code: str, market_type: str = 'A', stream: bool = False,
+                            deadline: Optional[Deadline] = None) -> AsyncGenerator[bytes, None]:
         """
         分析单只股票
         
@@ -47,21 +114,40 @@ class StockAnalyzerService:
             stock_code: 股票代码
             market_type: 市场类型，默认为'A'股
             stream: 是否使用流式响应
+            deadline: 时间预算，用完时以超时事件结束
             
         Returns:
-            异步生成器，生成分析结果的JSON字符串
+            异步生成器，生成分析结果的NDJSON行（字节）
         """
+        deadline = deadline or Deadline()
         try:
             logger.info(f"开始分析股票: {stock_code}, 市场: {market_type}")
             
             # 获取股票数据
-            df = await self.data_provider.get_stock_data(stock_code, market_type)
+            started = time.perf_counter()
+            try:
+                df = await asyncio.wait_for(
+                    self.data_provider.get_stock_data(stock_code, market_type),
+                    deadline.stage(self.FETCH_BUDGET_FRACTION).timeout()
+                )
+                observe_stage("fetch", started, "single")
+            except asyncio.TimeoutError:
+                get_metrics().inc("fetch_timeout_total", market=market_type)
+                logger.warning(f"获取股票 {stock_code} 数据超出时间预算")
+                yield encode_event({
+                    "stock_code": stock_code,
+                    "market_type": market_type,
+                    "error": "获取数据超出时间预算",
+                    "status": "error",
+                    "timed_out": True
+                })
+                return
             
             # 检查是否有错误
             if hasattr(df, 'error'):
                 error_msg = df.error
                 logger.error(f"获取股票数据时出错: {error_msg}")
-                yield json.dumps({
+                yield encode_event({
                     "stock_code": stock_code,
                     "market_type": market_type,
                     "error": error_msg,
@@ -73,7 +159,7 @@ class StockAnalyzerService:
             if df.empty:
                 error_msg = f"获取到的股票 {stock_code} 数据为空"
                 logger.error(error_msg)
-                yield json.dumps({
+                yield encode_event({
                     "stock_code": stock_code,
                     "market_type": market_type,
                     "error": error_msg,
@@ -82,11 +168,15 @@ class StockAnalyzerService:
                 return
             
             # 计算技术指标
+            started = time.perf_counter()
             df_with_indicators = self.indicator.calculate_indicators(df)
+            observe_stage("indicators", started, "single")
             
             # 计算评分
+            started = time.perf_counter()
             score = self.scorer.calculate_score(df_with_indicators)
             recommendation = self.scorer.get_recommendation(score)
+            observe_stage("scoring", started, "single")
             
             # 获取最新数据
             latest_data = df_with_indicators.iloc[-1]
@@ -158,22 +248,28 @@ class StockAnalyzerService:
             }
             
             # 输出基本分析结果
-            logger.info(f"基本分析结果: {json.dumps(basic_result)}")
-            yield json.dumps(basic_result)
+            basic_event = encode_event(basic_result)
+            logger.info(f"基本分析结果: {basic_event.decode('utf-8').rstrip()}")
+            yield basic_event
             
             # 使用AI进行深入分析
-            async for analysis_chunk in self.ai_analyzer.get_ai_analysis(df_with_indicators, stock_code, market_type, stream):
+            async for analysis_chunk in self.ai_analyzer.get_ai_analysis(df_with_indicators, stock_code, market_type, stream, deadline=deadline):
                 yield analysis_chunk
                 
             logger.info(f"完成股票分析: {stock_code}")
             
+        except asyncio.CancelledError:
+            get_metrics().inc("analysis_cancelled_total", mode="single")
+            logger.info(f"股票 {stock_code} 的分析已取消")
+            raise
         except Exception as e:
             error_msg = f"分析股票 {stock_code} 时出错: {str(e)}"
             logger.error(error_msg)
             logger.exception(e)
-            yield json.dumps({"error": error_msg})
+            yield encode_event({"error": error_msg})
     
-    async def scan_stocks(self, stock_codes: List[str], market_type: str = 'A', min_score: int = 0, stream: bool = False) -> AsyncGenerator[str, None]:
+    async def scan_stocks(self, stock_codes: List[str], market_type: str = 'A', min_score: int = 0, stream: bool = False,
+                          deadline: Optional[Deadline] = None) -> AsyncGenerator[bytes, None]:
         """
         批量扫描股票
         
@@ -182,103 +278,254 @@ class StockAnalyzerService:
             market_type: 市场类型
             min_score: 最低评分阈值
             stream: 是否使用流式响应
+            deadline: 时间预算，用完时未完成的股票标记为超时，扫描以已有结果结束
             
         Returns:
-            异步生成器，生成扫描结果的JSON字符串
+            异步生成器，生成扫描结果的NDJSON行（字节）
         """
+        deadline = deadline or Deadline()
+        timed_out = []
         try:
             logger.info(f"开始批量扫描 {len(stock_codes)} 只股票, 市场: {market_type}")
             
             # 输出初始状态 - 发送批量分析初始化消息
-            yield json.dumps({
+            yield encode_event({
                 "stream_type": "batch",
                 "stock_codes": stock_codes,
                 "market_type": market_type,
                 "min_score": min_score
             })
             
-            # 批量获取股票数据
-            stock_data_dict = await self.data_provider.get_multiple_stocks_data(stock_codes, market_type)
-            
-            # 计算技术指标
-            stock_with_indicators = {}
-            for code, df in stock_data_dict.items():
-                try:
-                    stock_with_indicators[code] = self.indicator.calculate_indicators(df)
-                except Exception as e:
-                    logger.error(f"计算 {code} 技术指标时出错: {str(e)}")
-                    # 发送错误状态
-                    yield json.dumps({
-                        "stock_code": code,
-                        "error": f"计算技术指标时出错: {str(e)}",
-                        "status": "error"
-                    })
+            # 当前交易日已缓存的评分记录直接输出，只计算缺失的股票
+            records = await asyncio.to_thread(self.scan_cache.get_many, stock_codes, market_type)
+            for code, record in records.items():
+                yield encode_event({
+                    **record,
+                    "cached": True,
+                    "status": "completed" if record["score"] < min_score else "waiting"
+                })
+            missing_codes = [code for code in stock_codes if code not in records]
+            get_metrics().inc("scan_cache_hit_total", len(records), market=market_type)
+            get_metrics().inc("scan_cache_miss_total", len(missing_codes), market=market_type)
+            if records:
+                logger.info(f"扫描缓存命中 {len(records)} 只股票，需计算 {len(missing_codes)} 只")
             
-            # 评分股票
-            results = self.scorer.batch_score_stocks(stock_with_indicators)
+            # 批量获取股票数据
+            stock_data_dict = {}
+            if missing_codes:
+                started = time.perf_counter()
+                stock_data_dict = await self.data_provider.get_multiple_stocks_data(
+                    missing_codes, market_type, deadline=deadline.stage(self.FETCH_BUDGET_FRACTION)
+                )
+                observe_stage("fetch", started, "batch")
             
-            # 过滤低于最低评分的股票
-            filtered_results = [r for r in results if r[1] >= min_score]
+            # 计算技术指标并评分，大批量时在进程池中执行
+            stock_with_indicators, results, indicator_errors, timed_out = await self.indicator_executor.compute(
+                stock_data_dict, deadline=deadline
+            )
+            for code, error in indicator_errors.items():
+                # 发送错误状态
+                yield encode_event({
+                    "stock_code": code,
+                    "error": error,
+                    "status": "error"
+                })
+            for code in timed_out:
+                yield self._timeout_event(code)
             
             # 为每只股票发送基本评分和推荐信息
+            new_records = {}
             for code, score, rec in results:
                 df = stock_with_indicators.get(code)
                 if df is not None and len(df) > 0:
-                    # 获取最新数据
-                    latest_data = df.iloc[-1]
-                    previous_data = df.iloc[-2] if len(df) > 1 else latest_data
-                    
-                    # 价格变动绝对值
-                    price_change_value = latest_data['Close'] - previous_data['Close']
-                    
-                    # 获取涨跌幅
-                    change_percent = latest_data.get('Change_pct')
+                    record = self._build_scan_record(code, score, rec, df)
+                    new_records[code] = record
                     
                     # 发送股票基本信息和评分
-                    yield json.dumps({
-                        "stock_code": code,
-                        "score": score,
-                        "recommendation": rec,
-                        "price": float(latest_data.get('Close', 0)),
-                        "price_change_value": float(price_change_value),  # 价格变动绝对值
-                        "price_change": change_percent,  # 兼容旧版前端，传递涨跌幅
-                        "change_percent": change_percent,  # 涨跌幅百分比，新字段
-                        "rsi": float(latest_data.get('RSI', 0)) if 'RSI' in latest_data else None,
-                        "ma_trend": "UP" if latest_data.get('MA5', 0) > latest_data.get('MA20', 0) else "DOWN",
-                        "macd_signal": "BUY" if latest_data.get('MACD', 0) > latest_data.get('MACD_Signal', 0) else "SELL",
-                        "volume_status": "HIGH" if latest_data.get('Volume_Ratio', 1) > 1.5 else ("LOW" if latest_data.get('Volume_Ratio', 1) < 0.5 else "NORMAL"),
+                    yield encode_event({
+                        **record,
                         "status": "completed" if score < min_score else "waiting"
                     })
+            await asyncio.to_thread(self.scan_cache.put_many, new_records, market_type)
+            records.update(new_records)
+            
+            # 合并缓存和新计算的结果，按评分降序排序
+            results = sorted(
+                ((code, record["score"], record["recommendation"]) for code, record in records.items()),
+                key=lambda x: x[1],
+                reverse=True
+            )
+            
+            # 过滤低于最低评分的股票
+            filtered_results = [r for r in results if r[1] >= min_score]
             
             # 如果需要进一步分析，对评分较高的股票进行AI分析
             if stream and filtered_results:
                 # 只分析前5只评分最高的股票，避免分析过多导致前端卡顿
                 top_stocks = filtered_results[:5]
                 
+                # 启用批量模式时，多只股票合并为一次AI请求
+                batch_size = self.ai_analyzer.batch_size
+                batch = []
+                
                 for stock_code, score, _ in top_stocks:
+                    if deadline.expired():
+                        # 时间预算用完，剩余股票不再进行AI分析
+                        timed_out.append(stock_code)
+                        yield self._timeout_event(stock_code)
+                        continue
+                    
                     df = stock_with_indicators.get(stock_code)
+                    if df is None:
+                        # 命中缓存的股票在需要AI分析时才获取数据
+                        try:
+                            df = await asyncio.wait_for(self._load_indicator_data(stock_code, market_type), deadline.timeout())
+                        except asyncio.TimeoutError:
+                            timed_out.append(stock_code)
+                            yield self._timeout_event(stock_code)
+                            continue
                     if df is not None:
                         # 输出正在分析的股票信息
-                        yield json.dumps({
+                        yield encode_event({
                             "stock_code": stock_code,
                             "status": "analyzing"
                         })
                         
+                        if batch_size > 1:
+                            batch.append((stock_code, df))
+                            if len(batch) < batch_size:
+                                continue
+                            async for analysis_chunk in self.ai_analyzer.get_batch_ai_analysis(batch, market_type, stream, deadline=deadline):
+                                yield analysis_chunk
+                            batch = []
+                            continue
+                        
                         # AI分析
-                        async for analysis_chunk in self.ai_analyzer.get_ai_analysis(df, stock_code, market_type, stream):
+                        async for analysis_chunk in self.ai_analyzer.get_ai_analysis(df, stock_code, market_type, stream,
+                                                                                     deadline=deadline, priority=PRIORITY_BATCH):
                             yield analysis_chunk
+                
+                if batch:
+                    async for analysis_chunk in self.ai_analyzer.get_batch_ai_analysis(batch, market_type, stream, deadline=deadline):
+                        yield analysis_chunk
             
             # 输出扫描完成信息
-            yield json.dumps({
+            yield encode_event({
                 "scan_completed": True,
                 "total_scanned": len(results),
-                "total_matched": len(filtered_results)
+                "total_matched": len(filtered_results),
+                "total_cached": len(records) - len(new_records),
+                "timed_out": timed_out,
+                "partial": bool(timed_out)
             })
             
             logger.info(f"完成批量扫描 {len(stock_codes)} 只股票, 符合条件: {len(filtered_results)}")
             
+        except asyncio.CancelledError:
+            get_metrics().inc("analysis_cancelled_total", mode="batch")
+            logger.info(f"批量扫描 {len(stock_codes)} 只股票已取消")
+            raise
         except Exception as e:
             error_msg = f"批量扫描股票时出错: {str(e)}"
             logger.error(error_msg)
             logger.exception(e)
-            yield json.dumps({"error": error_msg})
+            yield encode_event({"error": error_msg})
+    
+    async def precompute_scores(self, stock_codes: List[str], market_type: str = 'A',
+                                intraday_ttl: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        预计算一批股票的评分记录：刷新K线缓存，计算指标和评分并写入扫描结果缓存
+        
+        Args:
+            stock_codes: 股票代码列表
+            market_type: 市场类型
+            intraday_ttl: 交易时段内评分记录的缓存秒数，默认使用扫描缓存的配置
+            
+        Returns:
+            股票代码到评分记录的字典
+        """
+        stock_data_dict = await self.data_provider.get_multiple_stocks_data(stock_codes, market_type, refresh=True)
+        stock_with_indicators, results, errors, _ = await self.indicator_executor.compute(stock_data_dict)
+        for code, error in errors.items():
+            logger.warning(f"预计算 {code} 失败: {error}")
+        
+        records = {
+            code: self._build_scan_record(code, score, rec, stock_with_indicators[code])
+            for code, score, rec in results
+        }
+        await asyncio.to_thread(self.scan_cache.put_many, records, market_type, intraday_ttl=intraday_ttl)
+        return records
+    
+    def _timeout_event(self, code: str) -> bytes:
+        """构建超出时间预算的股票事件"""
+        get_metrics().inc("scan_symbol_timeout_total")
+        return encode_event({
+            "stock_code": code,
+            "error": "分析超出时间预算，已跳过",
+            "status": "error",
+            "timed_out": True
+        })
+    
+    def _build_scan_record(self, code: str, score: int, rec: str, df: pd.DataFrame) -> Dict[str, Any]:
+        """
+        根据带指标的数据构建单只股票的扫描评分记录
+        
+        Args:
+            code: 股票代码
+            score: 评分
+            rec: 推荐
+            df: 包含技术指标的DataFrame
+            
+        Returns:
+            可JSON序列化的评分记录（不含status）
+        """
+        # 获取最新数据
+        latest_data = df.iloc[-1]
+        previous_data = df.iloc[-2] if len(df) > 1 else latest_data
+        
+        # 价格变动绝对值
+        price_change_value = latest_data['Close'] - previous_data['Close']
+        
+        # 获取涨跌幅
+        change_percent = latest_data.get('Change_pct')
+        if change_percent is not None:
+            change_percent = float(change_percent)
+        
+        # 最新K线日期
+        bar_date = df.index[-1].strftime('%Y-%m-%d') if hasattr(df.index[-1], 'strftime') else None
+        
+        return {
+            "stock_code": code,
+            "score": score,
+            "recommendation": rec,
+            "price": float(latest_data.get('Close', 0)),
+            "price_change_value": float(price_change_value),  # 价格变动绝对值
+            "price_change": change_percent,  # 兼容旧版前端，传递涨跌幅
+            "change_percent": change_percent,  # 涨跌幅百分比，新字段
+            "rsi": float(latest_data.get('RSI', 0)) if 'RSI' in latest_data else None,
+            "ma_trend": "UP" if latest_data.get('MA5', 0) > latest_data.get('MA20', 0) else "DOWN",
+            "macd_signal": "BUY" if latest_data.get('MACD', 0) > latest_data.get('MACD_Signal', 0) else "SELL",
+            "volume_status": "HIGH" if latest_data.get('Volume_Ratio', 1) > 1.5 else ("LOW" if latest_data.get('Volume_Ratio', 1) < 0.5 else "NORMAL"),
+            "bar_date": bar_date
+        }
+    
+    async def _load_indicator_data(self, stock_code: str, market_type: str) -> Optional[pd.DataFrame]:
+        """
+        获取单只股票数据并计算技术指标，失败时返回None
+        
+        Args:
+            stock_code: 股票代码
+            market_type: 市场类型
+            
+        Returns:
+            包含技术指标的DataFrame
+        """
+        df = await self.data_provider.get_stock_data(stock_code, market_type)
+        if hasattr(df, 'error') or df.empty:
+            logger.error(f"获取股票 {stock_code} 数据失败，跳过AI分析")
+            return None
+        try:
+            return self.indicator.calculate_indicators(df)
+        except Exception as e:
+            logger.error(f"计算 {stock_code} 技术指标时出错: {str(e)}")
+            return None
@@ -1,8 +1,16 @@
+import os
+import time
 import pandas as pd
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import asyncio
 from typing import Dict, List, Optional, Tuple, Any
 from utils.logger import get_logger
+from utils.metrics import get_metrics
+from utils.deadline import Deadline
+from utils.market_time import trading_day, cache_ttl
+from utils.cache_store import CacheStore, get_cache_store
+from utils.server_config import get_web_workers
 
 # 获取日志器
 logger = get_logger()
@@ -13,13 +21,29 @@ class StockDataProvider:
     负责获取股票、基金等金融产品的历史数据
     """
     
-    def __init__(self):
-        """初始化数据提供者服务"""
+    # 共享K线缓存的命名空间
+    BAR_NAMESPACE = "bars"
+    
+    def __init__(self, store: Optional[CacheStore] = None):
+        """
+        初始化数据提供者服务
+        
+        Args:
+            store: 工作进程间共享的缓存存储，默认使用应用共享的CacheStore
+        """
+        # K线缓存，只缓存默认日期范围的数据，键为(市场类型, 交易日, 股票代码)；
+        # 进程内LRU在前，共享存储在后，多工作进程时进程内缓存按进程数缩小
+        self._bar_cache: "OrderedDict[Tuple[str, str, str], Tuple[float, pd.DataFrame]]" = OrderedDict()
+        self.bar_cache_max_entries = int(os.getenv('BAR_CACHE_MAX_ENTRIES') or 2000 // get_web_workers())
+        self.bar_cache_intraday_ttl = float(os.getenv('BAR_CACHE_INTRADAY_TTL') or 300)
+        self.store = store or get_cache_store()
+        
         logger.debug("初始化StockDataProvider")
     
     async def get_stock_data(self, stock_code: str, market_type: str = 'A', 
                             start_date: Optional[str] = None, 
-                            end_date: Optional[str] = None) -> pd.DataFrame:
+                            end_date: Optional[str] = None,
+                            refresh: bool = False) -> pd.DataFrame:
         """
         异步获取股票或基金数据
         
@@ -28,18 +52,73 @@ class StockDataProvider:
             market_type: 市场类型，默认为'A'股
             start_date: 开始日期，格式YYYYMMDD，默认为一年前
             end_date: 结束日期，格式YYYYMMDD，默认为今天
+            refresh: 是否跳过K线缓存重新获取（结果仍会写入缓存）
             
         Returns:
             包含历史数据的DataFrame
         """
+        cacheable = start_date is None and end_date is None
+        if cacheable and not refresh:
+            df = await self._get_cached_bars(stock_code, market_type)
+            if df is not None:
+                return df
+        
         # 使用线程池执行同步的akshare调用
-        return await asyncio.to_thread(
+        df = await asyncio.to_thread(
             self._get_stock_data_sync, 
             stock_code, 
             market_type, 
             start_date, 
             end_date
         )
+        
+        if cacheable and not hasattr(df, 'error') and not df.empty:
+            await self._put_cached_bars(stock_code, market_type, df)
+        return df
+    
+    async def _get_cached_bars(self, stock_code: str, market_type: str) -> Optional[pd.DataFrame]:
+        """从K线缓存读取当前交易日未过期的数据，共享存储在线程中读取"""
+        key = (market_type, trading_day(market_type).isoformat(), stock_code)
+        entry = self._bar_cache.get(key)
+        if entry is not None and entry[0] > time.time():
+            self._bar_cache.move_to_end(key)
+            get_metrics().inc("bar_cache_hit_total", market=market_type)
+            logger.debug(f"K线缓存命中: {market_type} {stock_code}")
+            return entry[1]
+        
+        # 其他工作进程获取的K线
+        df = await asyncio.to_thread(self.store.get_frame, self.BAR_NAMESPACE, ":".join(key))
+        if df is None:
+            get_metrics().inc("bar_cache_miss_total", market=market_type)
+            return None
+        get_metrics().inc("bar_cache_shared_hit_total", market=market_type)
+        logger.debug(f"共享K线缓存命中: {market_type} {stock_code}")
+        self._remember_bars(key, df, self._bar_ttl(market_type))
+        return df
+    
+    async def _put_cached_bars(self, stock_code: str, market_type: str, df: pd.DataFrame):
+        """
+        写入K线缓存
+        
+        收盘前最新K线仍可能变化，只缓存bar_cache_intraday_ttl秒；当日收盘后缓存到当地午夜
+        """
+        ttl = self._bar_ttl(market_type)
+        if ttl <= 0:
+            return
+        key = (market_type, trading_day(market_type).isoformat(), stock_code)
+        self._remember_bars(key, df, ttl)
+        await asyncio.to_thread(self.store.set_frame, self.BAR_NAMESPACE, ":".join(key), df, ttl)
+    
+    def _bar_ttl(self, market_type: str) -> float:
+        """K线缓存秒数，开盘前和午间休市时不超过下一个交易时段开始"""
+        return cache_ttl(market_type, self.bar_cache_intraday_ttl)
+    
+    def _remember_bars(self, key: Tuple[str, str, str], df: pd.DataFrame, ttl: float):
+        """写入进程内K线缓存"""
+        self._bar_cache[key] = (time.time() + ttl, df)
+        self._bar_cache.move_to_end(key)
+        while len(self._bar_cache) > self.bar_cache_max_entries:
+            self._bar_cache.popitem(last=False)
     
     def _get_stock_data_sync(self, stock_code: str, market_type: str = 'A', 
                            start_date: Optional[str] = None, 
@@ -264,7 +343,9 @@ class StockDataProvider:
                                      market_type: str = 'A',
                                      start_date: Optional[str] = None, 
                                      end_date: Optional[str] = None,
-                                     max_concurrency: int = 5) -> Dict[str, pd.DataFrame]:
+                                     max_concurrency: int = 5,
+                                     deadline: Optional[Deadline] = None,
+                                     refresh: bool = False) -> Dict[str, pd.DataFrame]:
         """
         异步批量获取多只股票数据
         
@@ -274,26 +355,66 @@ class StockDataProvider:
             start_date: 开始日期，格式YYYYMMDD
             end_date: 结束日期，格式YYYYMMDD
             max_concurrency: 最大并发数，默认为5
+            deadline: 时间预算，到期仍未完成的股票返回带error和timed_out属性的空DataFrame
+            refresh: 是否跳过K线缓存重新获取
             
         Returns:
             字典，键为股票代码，值为对应的DataFrame
         """
         # 使用信号量控制并发数
         semaphore = asyncio.Semaphore(max_concurrency)
+        timed_out_codes = set()
         
         async def get_with_semaphore(code):
-            async with semaphore:
-                try:
-                    return code, await self.get_stock_data(code, market_type, start_date, end_date)
-                except Exception as e:
-                    logger.error(f"获取股票 {code} 数据时出错: {str(e)}")
-                    return code, None
+            try:
+                async with semaphore:
+                    return code, await self.get_stock_data(code, market_type, start_date, end_date, refresh=refresh)
+            except asyncio.CancelledError:
+                # 请求被取消（如客户端断开）或超出时间预算时，排队和进行中的获取任务都会走到这里，信号量随之释放
+                if code in timed_out_codes:
+                    get_metrics().inc("fetch_timeout_total", market=market_type)
+                else:
+                    get_metrics().inc("fetch_cancelled_total", market=market_type)
+                raise
+            except Exception as e:
+                logger.error(f"获取股票 {code} 数据时出错: {str(e)}")
+                return code, None
         
-        # 创建异步任务
-        tasks = [get_with_semaphore(code) for code in stock_codes]
+        if deadline is None or deadline.expires_at is None:
+            # 创建异步任务
+            tasks = [get_with_semaphore(code) for code in stock_codes]
+            
+            # 等待所有任务完成
+            results = await asyncio.gather(*tasks)
+            
+            # 构建结果字典，过滤掉失败的请求
+            return {code: df for code, df in results if df is not None}
         
-        # 等待所有任务完成
-        results = await asyncio.gather(*tasks)
+        # 有时间预算时只等待到截止时间，未完成的任务取消并标记为超时
+        tasks = {asyncio.ensure_future(get_with_semaphore(code)): code for code in stock_codes}
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=deadline.remaining())
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
         
-        # 构建结果字典，过滤掉失败的请求
-        return {code: df for code, df in results if df is not None}
\ No newline at end of file
+        for task in pending:
+            timed_out_codes.add(tasks[task])
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning(f"获取{market_type}数据超出时间预算，{len(pending)} 只股票未完成")
+        
+        result = {}
+        for task, code in tasks.items():
+            if task in done:
+                _, df = task.result()
+                if df is not None:
+                    result[code] = df
+            else:
+                df = pd.DataFrame()
+                df.error = f"获取{market_type}数据超时 {code}"
+                df.timed_out = True
+                result[code] = df
+        return result
@@ -1,5 +1,5 @@
 import pandas as pd
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
 from utils.logger import get_logger
 
 # 获取日志器
@@ -29,7 +29,22 @@ class TechnicalIndicator:
         }
         
         logger.debug(f"初始化TechnicalIndicator技术指标计算服务，参数: {self.params}")
-    
+
+    def indicator_columns(self) -> List[str]:
+        """
+        获取calculate_indicators新增的指标列名
+
+        Returns:
+            按计算顺序排列的指标列名列表
+        """
+        columns = [f'MA{period}' for period in self.params['ma_periods'].values()]
+        columns += [
+            'RSI', 'MACD', 'Signal', 'Histogram',
+            'BB_Middle', 'BB_Upper', 'BB_Lower',
+            'Volume_MA', 'Volume_Ratio', 'ATR', 'Volatility'
+        ]
+        return columns
+
     def calculate_ema(self, series: pd.Series, period: int) -> pd.Series:
         """
         计算指数移动平均线
@@ -1,7 +1,8 @@
 import asyncio
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from utils.logger import get_logger
+from utils.cache_store import CacheStore, LocalFrameCache, get_cache_store
 
 # 获取日志器
 logger = get_logger()
@@ -12,13 +13,24 @@ class USStockServiceAsync:
     提供美股数据的搜索和获取功能
     """
     
-    def __init__(self):
-        """初始化美股服务"""
+    # 美股列表缓存的命名空间、键和缓存秒数
+    CACHE_NAMESPACE = "spot_lists"
+    CACHE_KEY = "US"
+    CACHE_TTL = 30 * 60
+    
+    def __init__(self, store: Optional[CacheStore] = None):
+        """
+        初始化美股服务
+        
+        Args:
+            store: 工作进程间共享的缓存存储，默认使用应用共享的CacheStore
+        """
         logger.debug("初始化USStockServiceAsync")
         
-        # 可选：添加缓存以减少频繁请求
-        self._cache = None
-        self._cache_timestamp = None
+        # 美股列表缓存在共享存储中，减少频繁请求，多个工作进程不重复获取；
+        # 进程内保留副本，快照未变化时不重复反序列化
+        self.store = store or get_cache_store()
+        self.frames = LocalFrameCache(self.store, self.CACHE_NAMESPACE)
     
     async def search_us_stocks(self, keyword: str) -> List[Dict[str, Any]]:
         """
@@ -33,8 +45,7 @@ class USStockServiceAsync:
         try:
             logger.info(f"异步搜索美股: {keyword}")
             
-            # 使用线程池执行同步的akshare调用
-            df = await asyncio.to_thread(self._get_us_stocks_data)
+            df = await self._get_cached_us_stocks()
             
             # 模糊匹配搜索
             mask = df['name'].str.contains(keyword, case=False, na=False)
@@ -62,6 +73,35 @@ class USStockServiceAsync:
             logger.exception(e)
             raise Exception(error_msg)
     
+    async def snapshot_time(self) -> Optional[Tuple[float, float]]:
+        """
+        获取共享缓存中美股列表快照的生成时间和过期时间，不读取快照内容
+        
+        Returns:
+            (生成时间, 过期时间)的Unix时间戳，尚未缓存时返回None
+        """
+        expires_at = await self.frames.expiry(self.CACHE_KEY)
+        if expires_at is None:
+            return None
+        return expires_at - self.CACHE_TTL, expires_at
+    
+    async def _get_cached_us_stocks(self) -> pd.DataFrame:
+        """
+        获取美股列表，优先使用共享缓存
+        
+        Returns:
+            包含美股数据的DataFrame
+        """
+        df = await self.frames.get(self.CACHE_KEY)
+        if df is not None:
+            logger.debug("使用美股缓存数据")
+            return df
+        
+        # 使用线程池执行同步的akshare调用
+        df = await asyncio.to_thread(self._get_us_stocks_data)
+        await self.frames.set(self.CACHE_KEY, df, self.CACHE_TTL)
+        return df
+    
     def _get_us_stocks_data(self) -> pd.DataFrame:
         """
         获取美股数据（同步方法，将被异步方法调用）
@@ -115,8 +155,7 @@ class USStockServiceAsync:
         try:
             logger.info(f"获取美股详情: {symbol}")
             
-            # 使用线程池执行同步的akshare调用
-            df = await asyncio.to_thread(self._get_us_stocks_data)
+            df = await self._get_cached_us_stocks()
             
             # 精确匹配股票代码
             result = df[df['symbol'] == symbol]
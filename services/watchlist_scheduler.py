@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from utils.logger import get_logger
+from utils.market_time import market_now, is_market_open, market_close_time, next_session_start
+from utils.cache_store import CacheStore, get_cache_store
+from utils.server_config import get_worker_id
+
+# 获取日志器
+logger = get_logger()
+
+
+def load_watchlists() -> List[Dict[str, Any]]:
+    """
+    读取自选股预计算配置
+
+    优先读取环境变量WATCHLISTS中的JSON，其次读取WATCHLISTS_FILE指向的JSON文件。
+    每个自选股列表格式：
+    {"name": "核心池", "market_type": "A", "stock_codes": ["600000"],
+     "interval_minutes": 30, "after_close_delay_minutes": 20, "run_on_start": false}
+
+    Returns:
+        规范化后的自选股列表配置
+    """
+    raw = os.getenv('WATCHLISTS')
+    path = os.getenv('WATCHLISTS_FILE')
+    if not raw and path:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                raw = f.read()
+        except OSError as e:
+            logger.error(f"读取自选股配置文件 {path} 失败: {str(e)}")
+            return []
+    if not raw:
+        return []
+
+    try:
+        items = json.loads(raw)
+    except json.JSONDecodeError as e:
+        logger.error(f"解析自选股配置失败: {str(e)}")
+        return []
+
+    watchlists = []
+    for index, item in enumerate(items):
+        codes = [str(code).strip() for code in item.get('stock_codes', []) if str(code).strip()]
+        if not codes:
+            logger.warning(f"自选股列表 {item.get('name', index)} 没有股票代码，已忽略")
+            continue
+        watchlists.append({
+            'name': item.get('name') or f"watchlist-{index}",
+            'market_type': item.get('market_type', 'A'),
+            'stock_codes': list(dict.fromkeys(codes)),
+            'interval_minutes': float(item.get('interval_minutes') or 0),
+            'after_close_delay_minutes': float(item.get('after_close_delay_minutes') or 20),
+            'run_on_start': bool(item.get('run_on_start', False)),
+        })
+    return watchlists
+
+
+def next_run_time(watchlist: Dict[str, Any], now: Optional[datetime] = None) -> datetime:
+    """
+    计算自选股列表下一次预计算时间
+
+    取收盘后运行（收盘时间加延迟，仅工作日）与盘中定时运行（交易时段内每隔interval_minutes，
+    休市时或间隔后已休市时为下一个交易时段开始后interval_minutes）中较早的一个
+
+    Args:
+        watchlist: 自选股列表配置
+        now: 参考时间，默认为当前时间
+
+    Returns:
+        datetime: 带时区的市场当地时间
+    """
+    market_type = watchlist['market_type']
+    local = market_now(market_type, now)
+    close = market_close_time(market_type)
+    delay = timedelta(minutes=watchlist['after_close_delay_minutes'])
+
+    candidates = []
+    for offset in range(8):
+        day = local.date() + timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        run_at = datetime.combine(day, close, tzinfo=local.tzinfo) + delay
+        if run_at > local:
+            candidates.append(run_at)
+            break
+
+    interval = timedelta(minutes=watchlist['interval_minutes'])
+    if interval:
+        run_at = local + interval
+        # 间隔后已不在交易时段内（如午间休市）时推迟到下一个交易时段开始后interval_minutes，
+        # 避免休市时写入的数据按休市缓存时长保留
+        if not is_market_open(market_type, local) or not is_market_open(market_type, run_at):
+            run_at = next_session_start(market_type, local) + interval
+        candidates.append(run_at)
+
+    return min(candidates)
+
+
+class WatchlistScheduler:
+    """
+    自选股预计算调度器
+    在应用事件循环内按收盘后和盘中间隔定时预热K线缓存、计算指标和评分并写入扫描结果缓存，
+    交互请求命中这些股票时可直接返回预计算结果
+    """
+
+    def __init__(self, service, watchlists: Optional[List[Dict[str, Any]]] = None,
+                 store: Optional[CacheStore] = None):
+        """
+        初始化调度器
+
+        Args:
+            service: 共享的StockAnalyzerService实例
+            watchlists: 自选股列表配置，默认通过load_watchlists读取
+            store: 认领预计算租约的共享存储，多个工作进程中同一轮预计算只由一个进程执行
+        """
+        self.service = service
+        self.watchlists = watchlists if watchlists is not None else load_watchlists()
+        self.store = store or get_cache_store()
+        self.worker_id = get_worker_id()
+        self._status: Dict[str, Dict[str, Any]] = {
+            item['name']: {
+                'name': item['name'],
+                'market_type': item['market_type'],
+                'stock_count': len(item['stock_codes']),
+                'running': False,
+                'next_run_at': None,
+                'last_run_at': None,
+                'last_duration': None,
+                'last_scored': None,
+                'last_error': None,
+            }
+            for item in self.watchlists
+        }
+        self._task: Optional[asyncio.Task] = None
+
+        logger.debug(f"初始化WatchlistScheduler，自选股列表数: {len(self.watchlists)}")
+
+    async def start(self):
+        """启动调度协程，没有配置自选股列表时不启动"""
+        if not self.watchlists:
+            return
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"自选股预计算调度器已启动，列表数: {len(self.watchlists)}")
+
+    async def stop(self):
+        """停止调度协程，正在执行的预计算随之取消"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("自选股预计算调度器已停止")
+
+    def status(self) -> List[Dict[str, Any]]:
+        """获取各自选股列表的调度状态"""
+        return [dict(self._status[item['name']]) for item in self.watchlists]
+
+    async def _loop(self):
+        """调度主循环：等待最早到期的列表，依次执行到期的列表"""
+        next_runs = {}
+        for item in self.watchlists:
+            next_runs[item['name']] = datetime.now().astimezone() if item['run_on_start'] else next_run_time(item)
+
+        while True:
+            for item in self.watchlists:
+                self._status[item['name']]['next_run_at'] = next_runs[item['name']].isoformat()
+
+            wake_at = min(next_runs.values())
+            delay = (wake_at - datetime.now(wake_at.tzinfo)).total_seconds()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            now = datetime.now().astimezone()
+            # 依次执行到期的列表，复用数据获取的并发限制，避免预计算之间叠加并发
+            for item in self.watchlists:
+                if next_runs[item['name']] <= now:
+                    try:
+                        if await self._claim(item):
+                            await self._run(item)
+                    except Exception as e:
+                        # 共享存储暂时不可用（如database is locked）时跳过本轮，调度协程继续运行
+                        self._status[item['name']]['last_error'] = str(e)
+                        logger.error(f"自选股列表 {item['name']} 认领预计算失败: {str(e)}")
+                    next_runs[item['name']] = next_run_time(item)
+
+    async def _claim(self, watchlist: Dict[str, Any]) -> bool:
+        """
+        认领本轮预计算，其他工作进程已认领时跳过，租约在线程中认领
+
+        租约时长为运行间隔的一半（至少1分钟），只收盘后运行的列表为1小时，
+        保证同一轮只执行一次而下一轮可以由任意进程认领
+
+        Args:
+            watchlist: 自选股列表配置
+
+        Returns:
+            bool: 是否由当前进程执行
+        """
+        ttl = max(60.0, watchlist['interval_minutes'] * 30) if watchlist['interval_minutes'] else 3600.0
+        if await asyncio.to_thread(self.store.try_claim, f"watchlist:{watchlist['name']}", self.worker_id, ttl):
+            return True
+        logger.debug(f"自选股列表 {watchlist['name']} 本轮预计算已由其他工作进程执行")
+        return False
+
+    async def _run(self, watchlist: Dict[str, Any]):
+        """
+        执行一次自选股列表预计算
+
+        Args:
+            watchlist: 自选股列表配置
+        """
+        status = self._status[watchlist['name']]
+        status['running'] = True
+        started = time.monotonic()
+        status['last_run_at'] = datetime.now().astimezone().isoformat()
+        # 盘中按运行间隔缓存，保证下一轮预计算之前交互请求都能命中
+        intraday_ttl = watchlist['interval_minutes'] * 60 or None
+        try:
+            records = await self.service.precompute_scores(
+                watchlist['stock_codes'],
+                watchlist['market_type'],
+                intraday_ttl=intraday_ttl
+            )
+            status['last_scored'] = len(records)
+            status['last_error'] = None
+            logger.info(f"自选股列表 {watchlist['name']} 预计算完成，"
+                        f"评分 {len(records)}/{len(watchlist['stock_codes'])} 只，"
+                        f"耗时 {time.monotonic() - started:.1f} 秒")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status['last_error'] = str(e)
+            logger.error(f"自选股列表 {watchlist['name']} 预计算失败: {str(e)}")
+            logger.exception(e)
+        finally:
+            status['running'] = False
+            status['last_duration'] = round(time.monotonic() - started, 3)
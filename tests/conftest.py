@@ -0,0 +1,24 @@
+import pytest
+from tests.mock_llm_server import MockLLMServer
+
+
+@pytest.fixture(scope="session")
+def _mock_llm_servers():
+    servers = [MockLLMServer().start(), MockLLMServer().start()]
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def mock_llm(_mock_llm_servers):
+    """本地模拟AI服务，每个测试开始时恢复默认配置"""
+    _mock_llm_servers[0].reset()
+    return _mock_llm_servers[0]
+
+
+@pytest.fixture
+def mock_llm_backup(_mock_llm_servers):
+    """第二个本地模拟AI服务，用于多端点路由测试"""
+    _mock_llm_servers[1].reset()
+    return _mock_llm_servers[1]
@@ -0,0 +1,42 @@
+"""
+测试共用的数据构造和分析调用
+"""
+import json
+import asyncio
+from typing import Optional
+import numpy as np
+import pandas as pd
+from services.technical_indicator import TechnicalIndicator
+
+
+def make_bars(seed: int, rows: int = 120, end: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """
+    生成一段随机游走的K线数据
+
+    Args:
+        seed: 随机种子
+        rows: K线数量
+        end: 最后一根K线的日期，默认从2024-01-01开始
+    """
+    rng = np.random.default_rng(seed)
+    close = 10 + np.cumsum(rng.normal(0, 0.2, rows))
+    index = (pd.date_range(end=end, periods=rows, freq='D') if end is not None
+             else pd.date_range('2024-01-01', periods=rows, freq='D'))
+    return pd.DataFrame({
+        'Open': close + rng.normal(0, 0.05, rows),
+        'High': close + 0.3,
+        'Low': close - 0.3,
+        'Close': close,
+        'Volume': rng.integers(1000, 5000, rows),
+        'Change_pct': rng.normal(0, 1, rows),
+    }, index=index)
+
+
+def collect_analysis(analyzer, stream: bool):
+    """对模拟K线运行一次AI分析，返回解析后的事件列表"""
+    df = TechnicalIndicator().calculate_indicators(make_bars(1))
+
+    async def run():
+        return [json.loads(event) async for event in analyzer.get_ai_analysis(df, '600000', 'A', stream=stream)]
+
+    return asyncio.run(run())
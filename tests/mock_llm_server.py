@@ -0,0 +1,219 @@
+"""
+本地OpenAI兼容的模拟AI服务
+
+提供/v1/chat/completions接口的流式和非流式两种模式，可配置首字延迟、输出速度、
+分块大小、流中错误注入、HTTP错误和429限流，供测试和压测在离线环境下复现AI调用路径。
+
+单独运行: python -m tests.mock_llm_server --port 8001 --ttft 0.5 --tps 50
+"""
+import json
+import time
+import socket
+import asyncio
+import argparse
+import threading
+from typing import Any, Dict, List, Optional
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 默认输出的分析文本
+DEFAULT_TEXT = (
+    "## 趋势分析\n股价站上MA20，短期趋势向上，支撑位关注MA20附近。\n\n"
+    "## 成交量分析\n量比温和放大，资金关注度提升。\n\n"
+    "## 风险评估\n波动率处于中等水平，注意大盘系统性风险。\n\n"
+    "## 投资建议\n建议买入，止损位设在前低下方。\n"
+)
+
+
+class MockLLMConfig:
+    """模拟服务的行为配置，运行中修改立即生效"""
+
+    def __init__(self, **overrides):
+        """
+        初始化配置
+
+        Args:
+            **overrides: 覆盖默认值的配置项
+        """
+        # 首个内容片段之前的延迟（秒）
+        self.ttft = 0.0
+        # 每秒输出的token数，为0时不限速
+        self.tokens_per_second = 0.0
+        # 每个流式事件包含的token数
+        self.chunk_tokens = 1
+        # 每个token包含的字符数
+        self.token_chars = 2
+        # 输出文本，重复到output_tokens个token
+        self.text = DEFAULT_TEXT
+        self.output_tokens: Optional[int] = None
+        # 输出多少个token后在流中注入错误对象，None表示不注入
+        self.error_after_tokens: Optional[int] = None
+        # 非None时直接返回该HTTP状态码的错误
+        self.fail_status: Optional[int] = None
+        # 前多少个请求返回429
+        self.rate_limit_requests = 0
+        self.retry_after = "1"
+        self.update(**overrides)
+
+    def update(self, **overrides):
+        """更新配置项"""
+        for name, value in overrides.items():
+            if not hasattr(self, name):
+                raise AttributeError(f"未知的模拟服务配置: {name}")
+            setattr(self, name, value)
+
+    def tokens(self) -> List[str]:
+        """按配置切分输出文本"""
+        text = self.text
+        if self.output_tokens is not None:
+            needed = self.output_tokens * self.token_chars
+            text = (text * (needed // max(len(text), 1) + 1))[:needed]
+        return [text[i:i + self.token_chars] for i in range(0, len(text), self.token_chars)]
+
+
+def create_app(config: MockLLMConfig, requests_log: List[Dict[str, Any]]) -> FastAPI:
+    """
+    创建模拟服务应用
+
+    Args:
+        config: 行为配置
+        requests_log: 收到的请求体会追加到该列表
+
+    Returns:
+        FastAPI: 应用
+    """
+    app = FastAPI(title="Mock LLM")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        requests_log.append(body)
+
+        if len(requests_log) <= config.rate_limit_requests:
+            return JSONResponse(status_code=429, headers={"Retry-After": config.retry_after},
+                                content={"error": {"message": "Rate limit exceeded"}})
+        if config.fail_status:
+            return JSONResponse(status_code=config.fail_status,
+                                content={"error": {"message": f"Mock error {config.fail_status}"}})
+
+        tokens = config.tokens()
+        model = body.get("model", "mock")
+        created = int(time.time())
+        interval = config.chunk_tokens / config.tokens_per_second if config.tokens_per_second else 0
+
+        if not body.get("stream"):
+            await asyncio.sleep(config.ttft + interval * (len(tokens) / config.chunk_tokens))
+            return {
+                "id": "mock-completion",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": {"completion_tokens": len(tokens)}
+            }
+
+        def event(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+            payload = {
+                "id": "mock-completion",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        async def generate():
+            yield event({"role": "assistant"})
+            await asyncio.sleep(config.ttft)
+            for start in range(0, len(tokens), config.chunk_tokens):
+                if config.error_after_tokens is not None and start >= config.error_after_tokens:
+                    yield f"data: {json.dumps({'error': {'message': 'Mock stream error'}})}\n\n"
+                    break
+                if start and interval:
+                    await asyncio.sleep(interval)
+                yield event({"content": "".join(tokens[start:start + config.chunk_tokens])})
+            yield event({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    return app
+
+
+class MockLLMServer:
+    """在后台线程中运行的模拟服务"""
+
+    def __init__(self, host: str = "127.0.0.1", port: Optional[int] = None, **overrides):
+        """
+        初始化模拟服务
+
+        Args:
+            host: 监听地址
+            port: 监听端口，默认选择空闲端口
+            **overrides: 行为配置
+        """
+        self.host = host
+        self.port = port or self._free_port(host)
+        self.config = MockLLMConfig(**overrides)
+        self.requests: List[Dict[str, Any]] = []
+        self.app = create_app(self.config, self.requests)
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _free_port(host: str) -> int:
+        """获取一个空闲端口"""
+        with socket.socket() as sock:
+            sock.bind((host, 0))
+            return sock.getsockname()[1]
+
+    @property
+    def url(self) -> str:
+        """供AIAnalyzer使用的API地址（自动拼接/v1/chat/completions）"""
+        return f"http://{self.host}:{self.port}"
+
+    def reset(self, **overrides):
+        """恢复默认配置并清空请求记录"""
+        self.config.__init__(**overrides)
+        self.requests.clear()
+
+    def start(self) -> 'MockLLMServer':
+        """启动服务并等待就绪"""
+        config = uvicorn.Config(self.app, host=self.host, port=self.port, log_level="warning")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("模拟AI服务启动失败")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        """停止服务"""
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=10)
+            self._server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容的模拟AI服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft", type=float, default=0.0, help="首字延迟（秒）")
+    parser.add_argument("--tps", type=float, default=0.0, help="每秒输出token数，0为不限速")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="每个流式事件的token数")
+    parser.add_argument("--output-tokens", type=int, default=None, help="输出token数")
+    args = parser.parse_args()
+
+    config = MockLLMConfig(ttft=args.ttft, tokens_per_second=args.tps, chunk_tokens=args.chunk_tokens,
+                           output_tokens=args.output_tokens)
+    uvicorn.run(create_app(config, []), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+from utils.admission import AdmissionController, AdmissionRejectedError, admitted_stream
+from utils.event_encoder import decode_event
+
+
+async def _analysis(release: asyncio.Event):
+    yield b'{"stream_type": "single"}\n'
+    await release.wait()
+    yield b'{"stock_code": "600000"}\n'
+
+
+async def _collect(stream, events):
+    async for chunk in stream:
+        events.append(decode_event(chunk))
+
+
+def test_admission_limits_and_queue_positions():
+    async def run():
+        controller = AdmissionController(max_active=1, max_per_user=1, max_queue=1, max_queued_per_user=1, max_wait=5)
+        release = asyncio.Event()
+        first, second = [], []
+        task1 = asyncio.create_task(_collect(admitted_stream(controller, "a", _analysis(release)), first))
+        await asyncio.sleep(0.01)
+        task2 = asyncio.create_task(_collect(admitted_stream(controller, "b", _analysis(release)), second))
+        await asyncio.sleep(0.01)
+
+        assert controller.active == 1 and controller.queued == 1
+        # 队列已满时立即拒绝
+        with pytest.raises(AdmissionRejectedError) as e:
+            controller.check("c")
+        assert e.value.reason == "queue_full" and e.value.retry_after >= 1
+
+        release.set()
+        await asyncio.gather(task1, task2)
+        assert first[0] == {"stream_type": "single"}
+        assert second[0] == {"queue": {"position": 1, "active": 1}}
+        assert second[-1] == {"stock_code": "600000"}
+        assert controller.active == 0 and controller.queued == 0
+
+    asyncio.run(run())
+
+
+def test_admission_wait_timeout_and_per_user_limit():
+    async def run():
+        controller = AdmissionController(max_active=2, max_per_user=1, max_queue=4, max_queued_per_user=1, max_wait=5)
+        release = asyncio.Event()
+        task = asyncio.create_task(_collect(admitted_stream(controller, "a", _analysis(release)), []))
+        await asyncio.sleep(0.01)
+
+        # 同一用户超过运行数时排队，排队超时后返回拒绝事件并退出队列
+        events = []
+        await _collect(admitted_stream(controller, "a", _analysis(release), timeout=0.05), events)
+        assert events[0] == {"queue": {"position": 1, "active": 1}}
+        assert events[-1]["status"] == "rejected"
+        assert controller.queued == 0
+
+        # 其他用户不受影响
+        ticket = controller.enqueue("b")
+        assert controller.position(ticket) == 0
+        controller.release(ticket)
+        release.set()
+        await task
+        assert controller.stats()["active"] == 0
+
+    asyncio.run(run())
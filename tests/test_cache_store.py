@@ -0,0 +1,44 @@
+import asyncio
+import pandas as pd
+from utils.cache_store import CacheStore, LocalFrameCache
+from tests.helpers import make_bars
+
+
+def test_frames_shared_between_connections(tmp_path):
+    """一个连接写入的DataFrame可由另一个连接（其他工作进程）原样读出"""
+    df = make_bars(1)
+    CacheStore(str(tmp_path / "cache.db")).set_frame("bars", "A:600000", df, ttl=60)
+    other = CacheStore(str(tmp_path / "cache.db"))
+    pd.testing.assert_frame_equal(other.get_frame("bars", "A:600000"), df)
+    assert other.get_frame("bars", "A:000001") is None
+
+
+def test_claim_is_exclusive_until_expiry(tmp_path):
+    """租约由第一个认领者持有，过期或释放后其他进程才能认领"""
+    first, second = CacheStore(str(tmp_path / "cache.db")), CacheStore(str(tmp_path / "cache.db"))
+    assert first.try_claim("watchlist:core", "w1", ttl=60)
+    assert not second.try_claim("watchlist:core", "w2", ttl=60)
+    assert first.try_claim("watchlist:core", "w1", ttl=60)
+
+    first.release("watchlist:core", "w1")
+    assert second.try_claim("watchlist:core", "w2", ttl=-1)
+    assert first.try_claim("watchlist:core", "w1", ttl=60)
+
+
+def test_local_frame_copy_follows_shared_version(tmp_path):
+    """快照未变化时复用进程内副本，其他进程写入新快照后重新读取"""
+    async def run():
+        local = LocalFrameCache(CacheStore(str(tmp_path / "cache.db")), "spot_lists")
+        other = CacheStore(str(tmp_path / "cache.db"))
+        assert await local.get("US") is None
+
+        await local.set("US", make_bars(1), ttl=60)
+        first = await local.get("US")
+        assert await local.get("US") is first
+
+        other.set_frame("spot_lists", "US", make_bars(2), ttl=120)
+        refreshed = await local.get("US")
+        assert refreshed is not first
+        pd.testing.assert_frame_equal(refreshed, make_bars(2))
+
+    asyncio.run(run())
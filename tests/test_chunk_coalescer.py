@@ -0,0 +1,26 @@
+import asyncio
+from utils.chunk_coalescer import coalesce_deltas
+
+
+def test_coalesce_by_window_and_size():
+    """首个片段立即输出，其余片段按时间窗口和字节上限合并，错误项保持顺序"""
+    async def deltas():
+        for i in range(10):
+            yield f"{i}", None, False
+            await asyncio.sleep(0.001)
+        yield None, "流式响应错误", False
+        await asyncio.sleep(0.05)
+        yield "x" * 8, None, False
+        yield "y" * 8, None, False
+
+    async def run(**kwargs):
+        return [item async for item in coalesce_deltas(deltas(), **kwargs)]
+
+    items = asyncio.run(run(window_ms=1000, max_bytes=1024))
+    assert items == [("0", None, False), ("123456789", None, False), (None, "流式响应错误", False),
+                     ("x" * 8 + "y" * 8, None, False)]
+
+    items = asyncio.run(run(window_ms=1000, max_bytes=8))
+    assert ("x" * 8, None, False) in items and ("y" * 8, None, False) in items
+
+    assert len(asyncio.run(run(window_ms=0))) == 13
@@ -0,0 +1,58 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from utils import event_encoder
+from utils.event_encoder import encode_event, decode_event
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    if request.param == "orjson" and event_encoder.orjson is None:
+        pytest.skip("未安装orjson")
+    monkeypatch.setattr(event_encoder, "BACKEND", request.param)
+    return request.param
+
+
+def test_encodes_numpy_and_pandas_values(backend):
+    line = encode_event({
+        "stock_code": "600000",
+        "price": np.float64(10.5),
+        "score": np.int64(72),
+        "up": np.bool_(True),
+        "closes": np.array([1, 2]),
+        "bar_date": pd.Timestamp("2024-06-28"),
+        "missing": pd.NaT,
+        "recommendation": "买入",
+    })
+
+    assert isinstance(line, bytes)
+    assert line.endswith(b"\n") and line.count(b"\n") == 1
+    assert "买入".encode("utf-8") in line
+    assert decode_event(line) == {
+        "stock_code": "600000",
+        "price": 10.5,
+        "score": 72,
+        "up": True,
+        "closes": [1, 2],
+        "bar_date": "2024-06-28T00:00:00",
+        "missing": None,
+        "recommendation": "买入",
+    }
+
+
+def test_non_finite_floats_become_null(backend):
+    line = encode_event({
+        "change": float("nan"),
+        "ratio": np.float64("inf"),
+        "closes": np.array([1.5, np.nan]),
+        "nested": {"values": [float("-inf"), 2.0]},
+    })
+
+    assert b"NaN" not in line and b"Infinity" not in line
+    assert json.loads(line) == {
+        "change": None,
+        "ratio": None,
+        "closes": [1.5, None],
+        "nested": {"values": [None, 2.0]},
+    }
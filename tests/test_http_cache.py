@@ -0,0 +1,36 @@
+import time
+from email.utils import formatdate
+from starlette.requests import Request
+from utils.http_cache import cache_headers, is_not_modified, make_etag
+
+
+def _request(**headers):
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"",
+                    "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]})
+
+
+def test_conditional_requests():
+    etag = make_etag("search_us", 1700000000.0, "apple")
+    assert etag != make_etag("search_us", 1700001800.0, "apple")
+
+    assert not is_not_modified(_request(), etag, 1700000000.0)
+    assert is_not_modified(_request(if_none_match=etag), etag)
+    # gzip代理返回的弱ETag同样匹配
+    assert is_not_modified(_request(if_none_match=f'"other", W/{etag}'), etag)
+    assert not is_not_modified(_request(if_none_match='"other"'), etag)
+
+    modified = formatdate(1700000000, usegmt=True)
+    assert is_not_modified(_request(if_modified_since=modified), etag, 1700000000.0)
+    assert not is_not_modified(_request(if_modified_since=modified), etag, 1700000100.0)
+    # If-None-Match优先于If-Modified-Since
+    assert not is_not_modified(_request(if_none_match='"other"', if_modified_since=modified), etag, 1700000000.0)
+
+
+def test_cache_headers():
+    headers = cache_headers('"abc"', 1700000000.0, "search", private=False, expires_at=time.time() + 30)
+    assert headers["Cache-Control"] in ("public, max-age=30", "public, max-age=29")
+    assert headers["Last-Modified"] == "Tue, 14 Nov 2023 22:13:20 GMT"
+
+    headers = cache_headers('"abc"', None, "config", private=True)
+    assert headers["Cache-Control"] == "private, max-age=60"
+    assert headers["Vary"] == "Authorization" and "Last-Modified" not in headers
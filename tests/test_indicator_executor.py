@@ -0,0 +1,64 @@
+import asyncio
+import pytest
+import pandas as pd
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from services.technical_indicator import TechnicalIndicator
+from services.stock_scorer import StockScorer
+from services.indicator_executor import IndicatorExecutor, shutdown_process_pool, _unlink_when_done
+from tests.helpers import make_bars
+
+
+def test_pool_matches_inline():
+    """进程池计算结果应与直接计算一致"""
+    stock_dfs = {f"{600000 + i}": make_bars(i) for i in range(6)}
+    broken = pd.DataFrame()
+    broken.error = "获取A股数据失败"
+    stock_dfs['000000'] = broken
+
+    indicator = TechnicalIndicator()
+    scorer = StockScorer()
+    inline = IndicatorExecutor(indicator, scorer, threshold=1000)
+    pooled = IndicatorExecutor(indicator, scorer, threshold=1)
+
+    try:
+        inline_dfs, inline_results, inline_errors, _ = asyncio.run(inline.compute(stock_dfs))
+        pooled_dfs, pooled_results, pooled_errors, _ = asyncio.run(pooled.compute(stock_dfs))
+    finally:
+        shutdown_process_pool()
+
+    assert pooled_results == inline_results
+    assert set(pooled_errors) == set(inline_errors) == {'000000'}
+    for code, df in inline_dfs.items():
+        pd.testing.assert_frame_equal(pooled_dfs[code], df, check_dtype=False)
+
+
+def test_shared_memory_kept_until_running_chunks_finish():
+    """超时后仍在运行的批次结束前不删除共享内存"""
+    block = shared_memory.SharedMemory(create=True, size=8)
+    block.close()
+    running = Future()
+    running.set_running_or_notify_cancel()
+    cancelled = Future()
+    cancelled.cancel()
+
+    _unlink_when_done([block], [running, cancelled])
+    attached = shared_memory.SharedMemory(name=block.name)
+    attached.close()
+
+    running.set_result([])
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=block.name)
+
+
+def test_chunk_failure_propagates(monkeypatch):
+    """批次失败时抛出原始异常，而不是关闭共享内存时的BufferError"""
+    indicator = TechnicalIndicator()
+    monkeypatch.setattr(indicator, "params", {**indicator.params, "unpicklable": lambda: None})
+    pooled = IndicatorExecutor(indicator, StockScorer(), threshold=1)
+    try:
+        with pytest.raises(Exception) as excinfo:
+            asyncio.run(pooled.compute({f"{600000 + i}": make_bars(i) for i in range(2)}))
+    finally:
+        shutdown_process_pool()
+    assert not isinstance(excinfo.value, BufferError)
@@ -0,0 +1,60 @@
+import asyncio
+from collections import OrderedDict
+from utils import llm_limiter
+from utils.llm_limiter import LLMLimiter, PRIORITY_INTERACTIVE, PRIORITY_BATCH, get_llm_limiter
+
+
+def test_interactive_requests_jump_the_queue():
+    """名额释放后交互式请求先于先排队的批量请求放行"""
+    async def run():
+        limiter = LLMLimiter("test", max_concurrency=1, rpm=0)
+        order = []
+
+        async def request(name, priority):
+            await limiter.acquire(priority)
+            order.append(name)
+            await asyncio.sleep(0.01)
+            limiter.release()
+
+        holder = asyncio.create_task(request("holder", PRIORITY_BATCH))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(request(f"batch{i}", PRIORITY_BATCH)) for i in range(2)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("interactive", PRIORITY_INTERACTIVE)))
+        await asyncio.gather(holder, *tasks)
+        return order
+
+    assert asyncio.run(run()) == ["holder", "interactive", "batch0", "batch1"]
+
+
+def test_throttled_pauses_and_halves_limit():
+    """收到429后按Retry-After暂停放行并减半并发上限"""
+    async def run():
+        limiter = LLMLimiter("test", max_concurrency=4, rpm=0)
+        limiter.record_throttled("1")
+        assert limiter.limit == 2
+        waited = await limiter.acquire(PRIORITY_INTERACTIVE)
+        limiter.release()
+        return waited
+
+    waited = asyncio.run(run())
+    assert 0.9 <= waited < 1.5
+
+
+def test_idle_limiters_evicted(monkeypatch):
+    """自定义地址和密钥产生的限流器超过上限时丢弃空闲的，有请求的保留"""
+    monkeypatch.setattr(llm_limiter, "_limiters", OrderedDict())
+    monkeypatch.setattr(llm_limiter, "LIMITER_MAX_ENTRIES", 2)
+
+    async def run():
+        busy = get_llm_limiter("http://busy", "k")
+        await busy.acquire()
+        for index in range(5):
+            get_llm_limiter(f"http://custom-{index}", "k")
+        assert list(llm_limiter._limiters.values())[0] is busy
+        assert len(llm_limiter._limiters) == 2
+        busy.release()
+        get_llm_limiter("http://another", "k")
+        assert busy not in llm_limiter._limiters.values()
+
+    asyncio.run(run())
@@ -0,0 +1,73 @@
+import time
+from services.ai_analyzer import AIAnalyzer
+from services.ai_result_cache import AIResultCache
+from utils.cache_store import CacheStore
+from tests.helpers import collect_analysis
+from tests.mock_llm_server import DEFAULT_TEXT
+from utils.llm_router import LLMEndpoint, LLMRouter
+from utils.llm_limiter import get_llm_limiter
+
+
+def _routed_analyzer(servers, hedge_after=0):
+    analyzer = AIAnalyzer(custom_api_url=servers[0].url, custom_api_key='test-key', custom_api_model='mock')
+    analyzer.result_cache = AIResultCache(ttl=0)
+    analyzer.router = LLMRouter([LLMEndpoint(s.url, 'test-key', f'mock-{i}') for i, s in enumerate(servers)],
+                                hedge_after=hedge_after)
+    return analyzer
+
+
+def test_select_prefers_fast_healthy_endpoints():
+    """健康端点按首字延迟排序，连续失败的端点排到最后"""
+    a, b, c = LLMEndpoint('http://a', None, 'm'), LLMEndpoint('http://b', None, 'm'), LLMEndpoint('http://c', None, 'm')
+    router = LLMRouter([a, b, c], hedge_after=0)
+    router.record_latency(a, 2.0)
+    router.record_latency(b, 0.5)
+    assert router.select() == [c, b, a]
+
+    for _ in range(3):
+        router.record_failure(c)
+    assert not c.healthy
+    assert router.select() == [b, a, c]
+
+
+def test_hedged_request_wins_over_slow_endpoint(mock_llm, mock_llm_backup):
+    """首字超过对冲阈值时由第二个端点输出，慢的一路被取消"""
+    mock_llm.config.update(ttft=2.0)
+    analyzer = _routed_analyzer([mock_llm, mock_llm_backup], hedge_after=0.2)
+
+    started = time.monotonic()
+    events = collect_analysis(analyzer, stream=True)
+    assert time.monotonic() - started < 1.5
+    assert ''.join(e.get('ai_analysis_chunk', '') for e in events) == DEFAULT_TEXT
+    assert events[-1]['status'] == 'completed'
+    assert len(mock_llm.requests) == 1 and mock_llm_backup.requests[0]['model'] == 'mock-1'
+    assert get_llm_limiter(mock_llm.url, 'test-key').active == 0
+
+    # 慢端点按已等待时间计入延迟，下次请求优先选择对冲成功的端点
+    assert analyzer.router.select()[0].model == 'mock-1'
+
+
+def test_failed_endpoint_falls_back(mock_llm, mock_llm_backup):
+    """端点返回5xx时改用下一个端点"""
+    mock_llm.config.update(fail_status=503)
+    analyzer = _routed_analyzer([mock_llm, mock_llm_backup])
+
+    events = collect_analysis(analyzer, stream=True)
+    assert events[-1]['status'] == 'completed'
+    assert len(mock_llm.requests) == 1 and len(mock_llm_backup.requests) == 1
+    assert analyzer.router.endpoints[0].failures == 1
+
+
+def test_failover_result_cached_under_serving_endpoint(mock_llm, mock_llm_backup, tmp_path):
+    """故障切换后由备用端点完成的分析不作为主端点的结果回放"""
+    mock_llm.config.update(fail_status=503)
+    analyzer = _routed_analyzer([mock_llm, mock_llm_backup])
+    analyzer.result_cache = AIResultCache(CacheStore(str(tmp_path / "cache.db")), ttl=60)
+    assert collect_analysis(analyzer, stream=True)[-1]['status'] == 'completed'
+
+    # 主端点恢复后仍优先使用，缓存中没有它的结果，重新请求
+    mock_llm.config.update(fail_status=None)
+    assert analyzer.router.select()[0].model == 'mock-0'
+    events = collect_analysis(analyzer, stream=True)
+    assert events[-1]['status'] == 'completed' and not events[-1].get('cached')
+    assert len(mock_llm.requests) == 2 and len(mock_llm_backup.requests) == 1
@@ -0,0 +1,39 @@
+from utils.metrics import MetricsRegistry
+from utils import llm_router
+from utils.llm_router import LLMEndpoint, LLMRouter, metric_labels
+from utils.llm_telemetry import get_llm_telemetry
+
+
+def test_prometheus_rendering():
+    metrics = MetricsRegistry()
+    metrics.inc("http_requests_total", route="/api/config", status=200)
+    metrics.observe("analysis_stage_seconds", 0.02, buckets=(0.01, 0.1), stage="fetch")
+    metrics.observe("analysis_stage_seconds", 0.5, buckets=(0.01, 0.1), stage="fetch")
+    metrics.add_gauge("streams_in_flight", 1, route='a"b')
+    metrics.register_gauge("llm_queue_depth", lambda: [({"limiter": "x"}, 3)])
+    metrics.inc("bar_cache_hit_total", 3)
+    metrics.inc("bar_cache_shared_hit_total")
+    metrics.inc("bar_cache_miss_total", 4)
+
+    lines = metrics.render_prometheus().splitlines()
+    assert 'http_requests_total{route="/api/config",status="200"} 1' in lines
+    assert 'analysis_stage_seconds_bucket{stage="fetch",le="0.01"} 0' in lines
+    assert 'analysis_stage_seconds_bucket{stage="fetch",le="0.1"} 1' in lines
+    assert 'analysis_stage_seconds_bucket{stage="fetch",le="+Inf"} 2' in lines
+    assert 'analysis_stage_seconds_count{stage="fetch"} 2' in lines
+    assert 'streams_in_flight{route="a\\"b"} 1' in lines
+    assert 'llm_queue_depth{limiter="x"} 3' in lines
+    assert 'cache_hit_ratio{cache="bar"} 0.5000' in lines
+    assert "# TYPE analysis_stage_seconds histogram" in lines
+
+
+def test_llm_labels_bounded_for_custom_endpoints(monkeypatch):
+    """请求中自定义的地址和模型统一使用custom标签，配置的端点使用端点名称"""
+    router = LLMRouter([LLMEndpoint("https://api.example.com/v1?key=secret", "k", "gpt-4o-mini", name="主线路")])
+    monkeypatch.setattr(llm_router, "_router", router)
+
+    assert metric_labels("https://api.example.com/v1", "gpt-4o-mini") == ("主线路", "gpt-4o-mini")
+    for index in range(3):
+        trace = get_llm_telemetry().trace(f"https://attacker-{index}.example", f"model-{index}")
+        assert (trace.endpoint, trace.model) == ("custom", "custom")
+    assert LLMEndpoint("https://u:p@host:8443/v1?key=secret", None, "m").name == "https://host:8443/v1#m"
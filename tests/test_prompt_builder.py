@@ -0,0 +1,23 @@
+from services.technical_indicator import TechnicalIndicator
+from services.prompt_builder import PromptBuilder, estimate_tokens, MIN_ROWS
+from tests.helpers import make_bars
+
+
+def test_prompt_fits_budget():
+    """提示词按预算减少K线行数和列数"""
+    df = TechnicalIndicator().calculate_indicators(make_bars(1))
+    summary = {'trend': 'upward', 'volatility': '2.10%', 'volume_trend': 'increasing', 'rsi_level': 55.0}
+
+    full_prompt, full_tokens = PromptBuilder(token_budget=10000).build(df, '600000', 'A', summary)
+    assert full_tokens == estimate_tokens(full_prompt)
+    assert '近14日交易数据' in full_prompt and 'MACD' in full_prompt
+    assert 'Timestamp' not in full_prompt
+
+    budget = full_tokens - 150
+    prompt, tokens = PromptBuilder(token_budget=budget).build(df, '600000', 'A', summary)
+    assert tokens <= budget
+    assert '近14日交易数据' not in prompt and 'MACD' in prompt
+
+    # 行数减到下限后开始去掉可选列
+    prompt, _ = PromptBuilder(token_budget=1).build(df, '600000', 'A', summary)
+    assert f'近{MIN_ROWS}日交易数据' in prompt and 'MACD' not in prompt
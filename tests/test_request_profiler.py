@@ -0,0 +1,46 @@
+import time
+import asyncio
+from types import SimpleNamespace
+from utils.event_encoder import decode_event
+from utils.request_profiler import RequestProfile, frame_name, load_profile, profile_stream, record_stage
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def _analysis():
+    yield b'{"stream_type": "single"}\n'
+    _busy(0.1)
+    record_stage("StockScorer", 0.1)
+    yield b'{"stock_code": "600000"}\n'
+
+
+def test_profile_stream_collects_samples_and_stages(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATA_DIR", str(tmp_path))
+    # 未开启剖析时不记录
+    record_stage("StockScorer", 1.0)
+
+    async def run():
+        profile = RequestProfile(interval=0.002)
+        profile.activate()
+        return [decode_event(chunk) async for chunk in profile_stream(_analysis(), profile)]
+
+    events = asyncio.run(run())
+    assert events[1] == {"stock_code": "600000"}
+    summary = events[-1]["profile"]
+    assert summary["stages"] == {"StockScorer": {"calls": 1, "seconds": 0.1}}
+    assert summary["samples"] > 0 and summary["error"] is None
+    assert summary["top_functions"][0]["function"] == "_busy (test_request_profiler.py)"
+
+    folded = load_profile(summary["profile_id"])
+    assert "_analysis (test_request_profiler.py);_busy (test_request_profiler.py)" in folded
+    assert load_profile("../secret") is None
+
+
+def test_frame_name_without_qualname():
+    # Python 3.10的代码对象没有co_qualname
+    code = SimpleNamespace(co_name="get_stock_data", co_filename="/app/services/stock_data_provider.py")
+    assert frame_name(code) == "get_stock_data (stock_data_provider.py)"
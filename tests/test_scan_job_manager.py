@@ -0,0 +1,129 @@
+import json
+import asyncio
+from services.scan_job_manager import ScanJobManager, ScanJobStore, JobQueueFullError
+
+
+class _FakeService:
+    """按股票代码依次输出评分事件的假扫描服务"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    async def scan_stocks(self, stock_codes, market_type='A', min_score=0, stream=False):
+        yield json.dumps({"stream_type": "batch", "stock_codes": stock_codes})
+        for i, code in enumerate(stock_codes):
+            await asyncio.sleep(self.delay)
+            yield json.dumps({"stock_code": code, "score": 50 + i, "status": "waiting"})
+        yield json.dumps({"scan_completed": True, "total_scanned": len(stock_codes)})
+
+
+def test_job_lifecycle(tmp_path):
+    async def run():
+        store = ScanJobStore(str(tmp_path / "jobs.db"))
+        manager = ScanJobManager(lambda config: _FakeService(), store=store, max_workers=1, max_pending=2)
+        await manager.start()
+        try:
+            job = await manager.submit(["600519", "000858"], owner="guest")
+            assert job['status'] == "queued"
+
+            events = [event async for event in manager.subscribe(job['job_id'], poll_interval=0.01)]
+            assert [e['seq'] for e in events] == [1, 2, 3, 4]
+            assert events[-1]['event']['scan_completed'] is True
+
+            finished = await manager.get_job(job['job_id'])
+            assert finished['status'] == "completed"
+            assert finished['done'] == finished['total'] == 2
+            assert (await manager.get_events(job['job_id'], after=3))[0]['seq'] == 4
+        finally:
+            await manager.stop()
+
+    asyncio.run(run())
+
+
+def test_queue_full_and_cancel(tmp_path):
+    async def run():
+        store = ScanJobStore(str(tmp_path / "jobs.db"))
+        manager = ScanJobManager(lambda config: _FakeService(delay=10), store=store, max_workers=1, max_pending=1)
+        await manager.start()
+        try:
+            running = await manager.submit(["600519"])
+            await asyncio.sleep(0.05)
+            queued = await manager.submit(["000858"])
+            try:
+                await manager.submit(["000001"])
+                assert False, "队列已满时应拒绝提交"
+            except JobQueueFullError:
+                pass
+
+            assert (await manager.cancel(queued['job_id']))['status'] == "cancelled"
+            await manager.cancel(running['job_id'])
+            await asyncio.sleep(0.05)
+            assert (await manager.get_job(running['job_id']))['status'] == "cancelled"
+        finally:
+            await manager.stop()
+
+    asyncio.run(run())
+
+
+def test_jobs_shared_between_workers(tmp_path):
+    """两个工作进程共享任务存储：启动时不中断对方的任务，可以取消对方执行的任务"""
+    async def run():
+        first = ScanJobManager(lambda config: _FakeService(delay=0.05), store=ScanJobStore(str(tmp_path / "jobs.db")),
+                               max_workers=1, max_pending=2)
+        second = ScanJobManager(lambda config: _FakeService(), store=ScanJobStore(str(tmp_path / "jobs.db")),
+                                max_workers=1, max_pending=2)
+        second.worker_id = "other-worker"
+        await first.start()
+        try:
+            job = await first.submit([f"{600000 + i}" for i in range(20)])
+            await asyncio.sleep(0.1)
+            await second.start()
+            assert (await second.get_job(job['job_id']))['status'] == "running"
+
+            await second.cancel(job['job_id'])
+            await asyncio.sleep(0.7)
+            assert job['job_id'] not in first._running
+            assert (await first.get_job(job['job_id']))['status'] == "cancelled"
+        finally:
+            await second.stop()
+            await first.stop()
+
+    asyncio.run(run())
+
+
+def test_other_users_cannot_read_or_cancel(tmp_path):
+    async def run():
+        store = ScanJobStore(str(tmp_path / "jobs.db"))
+        manager = ScanJobManager(lambda config: _FakeService(delay=10), store=store, max_workers=1, max_pending=2)
+        await manager.start()
+        try:
+            job = await manager.submit(["600519"], owner="alice")
+            assert await manager.get_job(job['job_id'], owner="bob") is None
+            assert await manager.cancel(job['job_id'], owner="bob") is None
+            assert (await manager.get_job(job['job_id'], owner="alice"))['status'] != "cancelled"
+            assert await manager.cancel(job['job_id'], owner="alice") is not None
+        finally:
+            await manager.stop()
+
+    asyncio.run(run())
+
+
+def test_shutdown_marks_running_job_interrupted(tmp_path):
+    async def run():
+        manager = ScanJobManager(lambda config: _FakeService(delay=10), store=ScanJobStore(str(tmp_path / "jobs.db")),
+                                 max_workers=1, max_pending=2)
+        await manager.start()
+        job = await manager.submit(["600519"])
+        await asyncio.sleep(0.05)
+        await manager.stop()
+        return ScanJobStore(str(tmp_path / "jobs.db")).get_job(job['job_id'])['status']
+
+    assert asyncio.run(run()) == "interrupted"
+
+
+def test_completion_does_not_overwrite_cancel(tmp_path):
+    store = ScanJobStore(str(tmp_path / "jobs.db"))
+    store.create_job("job", "guest", "A", ["600519"], 0)
+    store.update_job("job", status="cancelled")
+    assert not store.update_job("job", if_status="running", status="completed")
+    assert store.get_status("job") == "cancelled"
@@ -0,0 +1,66 @@
+import json
+import time
+import asyncio
+import pandas as pd
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from services.stock_analyzer_service import StockAnalyzerService
+from services.scan_result_cache import ScanResultCache
+from utils.cache_store import CacheStore
+from utils.market_time import cache_ttl
+from tests.helpers import make_bars
+
+SHANGHAI = ZoneInfo("Asia/Shanghai")
+
+
+def test_repeat_scan_served_from_cache(tmp_path):
+    """重复扫描只计算未缓存的股票"""
+    service = StockAnalyzerService()
+    service.scan_cache = ScanResultCache(CacheStore(str(tmp_path / "cache.db")), intraday_ttl=60)
+
+    fetched = []
+
+    async def fake_fetch(stock_codes, market_type='A', *args, **kwargs):
+        fetched.append(list(stock_codes))
+        return {code: make_bars(int(code), end=pd.Timestamp.today().normalize()) for code in stock_codes}
+
+    service.data_provider.get_multiple_stocks_data = fake_fetch
+
+    async def scan(codes):
+        return [json.loads(chunk) async for chunk in service.scan_stocks(codes, min_score=0, stream=False)]
+
+    first = asyncio.run(scan(["600000", "600001"]))
+    second = asyncio.run(scan(["600001", "600002"]))
+
+    assert fetched == [["600000", "600001"], ["600002"]]
+    cached_rows = [row for row in second if row.get("cached")]
+    assert [row["stock_code"] for row in cached_rows] == ["600001"]
+    first_row = next(row for row in first if row.get("stock_code") == "600001" and "score" in row)
+    assert cached_rows[0]["score"] == first_row["score"]
+    assert second[-1]["total_scanned"] == 2 and second[-1]["total_cached"] == 1
+
+
+def test_cache_ttl_outside_sessions():
+    """开盘前和午间休市只按盘中时长缓存且不跨过下一个交易时段，收盘后缓存到午夜"""
+    monday = datetime(2024, 6, 3, tzinfo=SHANGHAI)
+    assert cache_ttl("A", 7200, monday.replace(hour=8)) == 5400
+    assert cache_ttl("A", 300, monday.replace(hour=8)) == 300
+    assert cache_ttl("A", 7200, monday.replace(hour=12)) == 3600
+    assert cache_ttl("A", 7200, monday.replace(hour=10)) == 7200
+    assert cache_ttl("A", 7200, monday.replace(hour=16)) == 8 * 3600
+    assert cache_ttl("A", 0, monday.replace(hour=12)) == 0
+
+
+def test_stale_bar_date_not_served(tmp_path):
+    """开盘前写入的上一交易日评分在开盘后不再使用"""
+    cache = ScanResultCache(CacheStore(str(tmp_path / "cache.db")), intraday_ttl=86400)
+    monday = datetime(2024, 6, 3, tzinfo=SHANGHAI)
+    cache.put_many({"600000": {"stock_code": "600000", "score": 60, "bar_date": "2024-05-31"}}, "A",
+                   now=monday.replace(hour=8))
+    assert cache.get_many(["600000"], "A", now=monday.replace(hour=9)) != {}
+    assert cache.get_many(["600000"], "A", now=monday.replace(hour=10)) == {}
+
+    # 午间休市写入的评分在13:00下午开盘时过期
+    cache.put_many({"600001": {"stock_code": "600001", "score": 60, "bar_date": "2024-06-03"}}, "A",
+                   now=monday.replace(hour=12))
+    assert cache.store.get_expiry(cache.NAMESPACE, "A:2024-06-03:600001") - time.time() <= 3600
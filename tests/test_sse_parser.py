@@ -0,0 +1,38 @@
+import json
+from utils.sse_parser import SSEParser
+
+
+def _feed_all(parser: SSEParser, chunks):
+    """依次输入所有文本块并返回全部事件"""
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    events.extend(parser.close())
+    return events
+
+
+def test_events_split_across_chunks():
+    """事件在任意位置被拆分时结果不变"""
+    payloads = [json.dumps({"choices": [{"delta": {"content": f"片段{i}\n"}}]}) for i in range(20)]
+    stream = ''.join(f"data: {payload}\r\n\r\n" for payload in payloads) + "data: [DONE]\n\n"
+    expected = payloads + ["[DONE]"]
+
+    for size in (1, 2, 7, 64, len(stream)):
+        chunks = [stream[i:i + size] for i in range(0, len(stream), size)]
+        assert _feed_all(SSEParser(), chunks) == expected
+
+
+def test_multiline_data_comments_and_ndjson():
+    """多行data字段、注释行、无空行分隔的事件和NDJSON"""
+    stream = (
+        ": keep-alive\n"
+        "event: message\n"
+        "data: {\"a\":\n"
+        "data: 1}\n"
+        "\n"
+        "data: {\"b\": 2}\n"
+        "data: {\"c\": 3}\n"
+        "{\"d\": 4}\n"
+        "data: [DONE]"
+    )
+    assert _feed_all(SSEParser(), [stream]) == ['{"a":\n1}', '{"b": 2}', '{"c": 3}', '{"d": 4}', '[DONE]']
@@ -1,9 +1,14 @@
 import os
-import requests
 import json
+import requests
 from utils.logger import get_logger
 from dotenv import load_dotenv
 from utils.api_utils import APIUtils
+from services.ai_analyzer import AIAnalyzer
+from services.ai_result_cache import AIResultCache
+from utils.llm_telemetry import get_llm_telemetry
+from tests.mock_llm_server import DEFAULT_TEXT
+from tests.helpers import collect_analysis
 
 # 获取日志器
 logger = get_logger()
@@ -28,17 +33,18 @@ def _truncate_json_for_logging(json_obj, max_length=500):
         return json_str
     return json_str[:max_length] + f"... [截断，总长度: {len(json_str)}字符]"
 
-def test_api_stream():
+def run_api_stream(api_url, api_key, api_model):
     """
     测试API流式响应功能
-    """
-    # 加载环境变量
-    load_dotenv()
     
-    # 获取API配置
-    api_url = os.getenv('API_URL')
-    api_key = os.getenv('API_KEY')
-    api_model = os.getenv('API_MODEL', 'gemini-2.0-flash')
+    Args:
+        api_url: API地址
+        api_key: API密钥
+        api_model: 模型名称
+        
+    Returns:
+        str: 拼接后的完整内容，请求失败时返回None
+    """
     
     logger.info(f"开始测试API流式响应，API URL: {api_url}, MODEL: {api_model}")
     
@@ -132,6 +138,7 @@ def test_api_stream():
             
             logger.info(f"流式处理完成，共收到 {chunk_count} 个内容片段")
             logger.info(f"完整内容:\n{buffer}")
+            return buffer
             
         else:
             try:
@@ -146,5 +153,65 @@ def test_api_stream():
         logger.error(f"测试过程中发生异常: {str(e)}")
         logger.exception(e)
 
+def _analyzer(mock_llm):
+    analyzer = AIAnalyzer(custom_api_url=mock_llm.url, custom_api_key='test-key', custom_api_model='mock')
+    analyzer.result_cache = AIResultCache(ttl=0)
+    return analyzer
+
+
+def test_api_stream(mock_llm):
+    """模拟服务的SSE流可以按OpenAI格式逐行解析"""
+    mock_llm.config.update(chunk_tokens=4)
+    assert run_api_stream(mock_llm.url, 'test-key', 'mock') == DEFAULT_TEXT
+
+
+def test_ai_analyzer_stream(mock_llm):
+    """AIAnalyzer流式分析模拟服务的输出"""
+    events = collect_analysis(_analyzer(mock_llm), stream=True)
+    assert mock_llm.requests[0]['stream'] is True
+    assert ''.join(e.get('ai_analysis_chunk', '') for e in events) == DEFAULT_TEXT
+    assert events[-1]['status'] == 'completed'
+    assert events[-1]['recommendation'] == '买入'
+
+
+def test_ai_analyzer_stream_telemetry(mock_llm):
+    """完成事件和汇总统计包含首字延迟与输出速度"""
+    mock_llm.config.update(ttft=0.2, tokens_per_second=200)
+    events = collect_analysis(_analyzer(mock_llm), stream=True)
+    telemetry = events[-1]['telemetry']
+    assert telemetry['status'] == 'completed'
+    assert 0.2 <= telemetry['ttft'] < telemetry['duration']
+    assert telemetry['output_chars'] == len(DEFAULT_TEXT)
+    assert telemetry['tokens_per_second'] > 0 and telemetry['gap_p50'] > 0
+
+    # 请求中自定义的地址统一统计为custom
+    stats = next(s for s in get_llm_telemetry().snapshot() if s['endpoint'] == 'custom')
+    assert stats['completed'] >= 1 and stats['ttft']['p50'] is not None
+
+
+def test_ai_analyzer_non_stream(mock_llm):
+    """AIAnalyzer非流式分析模拟服务的输出"""
+    events = collect_analysis(_analyzer(mock_llm), stream=False)
+    assert events[-1]['status'] == 'completed'
+    assert events[-1]['analysis'] == DEFAULT_TEXT
+
+
+def test_ai_analyzer_stream_error(mock_llm):
+    """流中注入的错误对象转为错误事件"""
+    mock_llm.config.update(error_after_tokens=10)
+    events = collect_analysis(_analyzer(mock_llm), stream=True)
+    assert any(e.get('status') == 'error' and 'Mock stream error' in e['error'] for e in events)
+
+
+def test_ai_analyzer_retries_rate_limit(mock_llm):
+    """429响应按Retry-After重试后成功"""
+    mock_llm.config.update(rate_limit_requests=1, retry_after="0")
+    events = collect_analysis(_analyzer(mock_llm), stream=False)
+    assert len(mock_llm.requests) == 2
+    assert events[-1]['status'] == 'completed'
+
+
 if __name__ == "__main__":
-    test_api_stream()
+    # 直接运行时测试真实API
+    load_dotenv()
+    run_api_stream(os.getenv('API_URL'), os.getenv('API_KEY'), os.getenv('API_MODEL', 'gemini-2.0-flash'))
@@ -0,0 +1,35 @@
+from utils.stream_demuxer import SectionDemuxer
+
+
+def _demux(chunks):
+    """按片段输入并合并每只股票的内容"""
+    demuxer = SectionDemuxer(["600000", "000001"])
+    texts = {}
+    starts = []
+    for chunk in chunks:
+        for code, content in demuxer.feed(chunk):
+            if content is None:
+                starts.append(code)
+            else:
+                texts[code] = texts.get(code, "") + content
+    for code, content in demuxer.close():
+        if content is None:
+            starts.append(code)
+        else:
+            texts[code] = texts.get(code, "") + content
+    return starts, texts
+
+
+def test_markers_split_across_chunks():
+    """分段标记在任意位置被拆分时结果不变"""
+    output = (
+        "好的，以下是分析。\n"
+        "===STOCK 600000===\n## 趋势\n上涨 === 注意\n===\n"
+        "**===STOCK 000001===**\n## 趋势\n下跌"
+    )
+    for size in (1, 3, 8, len(output)):
+        starts, texts = _demux([output[i:i + size] for i in range(0, len(output), size)])
+        assert starts == ["600000", "000001"]
+        assert texts[None] == "好的，以下是分析。\n"
+        assert texts["600000"] == "## 趋势\n上涨 === 注意\n===\n"
+        assert texts["000001"] == "## 趋势\n下跌"
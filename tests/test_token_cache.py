@@ -0,0 +1,32 @@
+import time
+from utils.token_cache import TokenCache
+
+
+def test_token_cache_expiry_and_eviction():
+    cache = TokenCache(max_entries=2, max_age=60)
+    now = time.time()
+    cache.put("a", "admin", now + 600)
+    cache.put("b", "admin", now - 1)
+
+    assert cache.get("a") == "admin"
+    # 令牌已过期时即使仍在缓存中也重新校验
+    assert cache.get("b") is None
+    assert cache.get("missing") is None
+
+    cache.put("c", "admin", now + 600)
+    cache.put("d", "admin", now + 600)
+    # 超出容量时淘汰最久未使用的条目
+    assert cache.get("a") is None
+    assert cache.stats() == {"entries": 2, "hits": 1, "misses": 3}
+
+
+def test_token_cache_max_age():
+    cache = TokenCache(max_age=0.05)
+    cache.put("a", "admin", None)
+    assert cache.get("a") == "admin"
+    time.sleep(0.06)
+    assert cache.get("a") is None
+
+    disabled = TokenCache(max_age=0)
+    disabled.put("a", "admin", None)
+    assert disabled.get("a") is None
@@ -0,0 +1,57 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from services.watchlist_scheduler import WatchlistScheduler, next_run_time
+from utils.cache_store import CacheStore
+
+SHANGHAI = ZoneInfo("Asia/Shanghai")
+
+
+def test_interval_run_skips_lunch_break():
+    """盘中间隔跨过午间休市时推迟到下午开盘后"""
+    watchlist = {"market_type": "A", "interval_minutes": 30, "after_close_delay_minutes": 20}
+    monday = datetime(2024, 6, 3, tzinfo=SHANGHAI)
+    assert next_run_time(watchlist, monday.replace(hour=10)) == monday.replace(hour=10, minute=30)
+    assert next_run_time(watchlist, monday.replace(hour=11, minute=25)) == monday.replace(hour=13, minute=30)
+    assert next_run_time(watchlist, monday.replace(hour=12)) == monday.replace(hour=13, minute=30)
+    # 收盘前最后一次间隔落在收盘后时，收盘后运行更早
+    assert next_run_time(watchlist, monday.replace(hour=14, minute=50)) == monday.replace(hour=15, minute=20)
+
+
+def _watchlist(**overrides):
+    return {"name": "core", "market_type": "A", "stock_codes": ["600000"], "interval_minutes": 30,
+            "after_close_delay_minutes": 20, "run_on_start": True, **overrides}
+
+
+def test_only_one_scheduler_claims_each_run(tmp_path):
+    """多个工作进程的调度器中同一轮预计算只由一个认领"""
+    first = WatchlistScheduler(None, [_watchlist()], store=CacheStore(str(tmp_path / "cache.db")))
+    second = WatchlistScheduler(None, [_watchlist()], store=CacheStore(str(tmp_path / "cache.db")))
+    first.worker_id, second.worker_id = "w1", "w2"
+
+    async def claims():
+        return await first._claim(first.watchlists[0]), await second._claim(second.watchlists[0])
+
+    assert asyncio.run(claims()) == (True, False)
+
+
+def test_claim_error_does_not_stop_loop(tmp_path):
+    """认领租约出错时记录错误，调度协程继续运行"""
+    store = CacheStore(str(tmp_path / "cache.db"))
+
+    def locked(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    store.try_claim = locked
+    scheduler = WatchlistScheduler(None, [_watchlist()], store=store)
+
+    async def run():
+        await scheduler.start()
+        await asyncio.sleep(0.05)
+        alive = not scheduler._task.done()
+        await scheduler.stop()
+        return alive
+
+    assert asyncio.run(run())
+    assert scheduler.status()[0]["last_error"] == "database is locked"
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from utils import wire_format
+from utils.wire_format import NotAcceptableError, negotiate, score_rows
+
+EVENTS = [
+    {"stream_type": "batch", "stock_codes": ["600000", "000001"]},
+    {"stock_code": "600000", "score": 82, "recommendation": "买入", "price": np.float64(10.5), "rsi": 61.2,
+     "bar_date": "2024-06-28", "status": "waiting"},
+    {"stock_code": "000001", "error": "分析超出时间预算，已跳过", "status": "error", "timed_out": True},
+    {"stock_code": "600000", "status": "analyzing", "price": 10.5, "rsi": 61.2},
+    {"stock_code": "600000", "ai_analysis_chunk": "## 趋势分析\n", "status": "analyzing"},
+    {"stock_code": "600000", "ai_analysis_chunk": "站上MA20。\n", "status": "analyzing"},
+    {"stock_code": "600000", "status": "completed", "score": 75, "recommendation": "持有"},
+    {"scan_completed": True, "total_scanned": 2, "timed_out": ["000001"]},
+]
+
+
+def test_negotiate(monkeypatch):
+    assert negotiate(None) == "json"
+    assert negotiate("application/json, text/plain, */*") == "json"
+    assert negotiate("application/x-msgpack") == "msgpack"
+    assert negotiate("application/json;q=0.5, application/vnd.apache.arrow.stream") == "arrow"
+    with pytest.raises(NotAcceptableError):
+        negotiate("text/csv")
+    with pytest.raises(NotAcceptableError):
+        negotiate("application/vnd.apache.arrow.stream", ("json", "msgpack"))
+
+    # 未安装依赖时可以回退到客户端接受的其他格式，否则拒绝
+    monkeypatch.setattr(wire_format, "msgpack", None)
+    assert negotiate("application/msgpack, application/json;q=0.1") == "json"
+    with pytest.raises(NotAcceptableError, match="msgpack"):
+        negotiate("application/msgpack")
+
+
+def test_score_rows():
+    rows = score_rows(EVENTS)
+    assert [row["stock_code"] for row in rows] == ["600000", "000001"]
+    assert rows[0]["score"] == 82 and rows[0]["recommendation"] == "买入"
+    assert rows[0]["ai_score"] == 75 and rows[0]["ai_recommendation"] == "持有"
+    assert rows[0]["ai_analysis"] == "## 趋势分析\n站上MA20。\n"
+    assert rows[0]["status"] == "completed"
+    assert rows[1]["status"] == "error" and "score" not in rows[1]
+
+
+def test_msgpack_and_arrow_roundtrip():
+    msgpack = pytest.importorskip("msgpack")
+    assert msgpack.unpackb(wire_format.pack(EVENTS[1]))["price"] == 10.5
+
+    pa = pytest.importorskip("pyarrow")
+    payload = wire_format.encode_score_table(EVENTS, {"summary": EVENTS[-1]})
+    table = pa.ipc.open_stream(payload).read_all()
+    assert table.column("stock_code").to_pylist() == ["600000", "000001"]
+    assert table.column("ai_score").to_pylist() == [75, None]
+    assert b'"total_scanned"' in table.schema.metadata[b"summary"]
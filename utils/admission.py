@@ -0,0 +1,282 @@
+import os
+import math
+import time
+import asyncio
+from collections import Counter, deque
+from typing import Any, AsyncGenerator, Deque, Dict, List, Optional, Tuple
+from utils.logger import get_logger
+from utils.metrics import get_metrics
+from utils.event_encoder import encode_event
+
+# 获取日志器
+logger = get_logger()
+
+# 排队时推送位置事件的最长间隔（秒），位置变化时在下一次检查时推送
+POSITION_INTERVAL = 1.0
+
+# Retry-After的上限（秒）
+MAX_RETRY_AFTER = 600
+
+# 排队等待时间直方图的分桶上界（秒）
+WAIT_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+class AdmissionRejectedError(Exception):
+    """分析请求未被接纳：队列已满或排队超时"""
+
+    def __init__(self, message: str, reason: str, retry_after: int):
+        """
+        Args:
+            message: 错误信息
+            reason: queue_full、user_queue_full或timeout
+            retry_after: 建议客户端等待的秒数
+        """
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """一个分析请求的排队凭证"""
+
+    def __init__(self, user: str, future: asyncio.Future):
+        self.user = user
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.admitted_at: Optional[float] = None
+        self.released = False
+
+
+class AdmissionController:
+    """
+    分析请求准入控制
+    限制同时运行的分析流总数和每个用户的运行数，超出的请求按先后顺序排队；
+    队列已满时立即拒绝并给出Retry-After，排队超过最长等待时间时放弃。
+    按工作进程统计，多个工作进程时总并发为各进程之和
+    """
+
+    def __init__(self, max_active: Optional[int] = None, max_per_user: Optional[int] = None,
+                 max_queue: Optional[int] = None, max_queued_per_user: Optional[int] = None,
+                 max_wait: Optional[float] = None):
+        """
+        初始化准入控制
+
+        Args:
+            max_active: 同时运行的分析流数，默认读取ANALYZE_MAX_CONCURRENCY
+            max_per_user: 每个用户同时运行的分析流数，默认读取ANALYZE_MAX_PER_USER
+            max_queue: 最大排队数，默认读取ANALYZE_MAX_QUEUE
+            max_queued_per_user: 每个用户的最大排队数，默认读取ANALYZE_MAX_QUEUED_PER_USER
+            max_wait: 最长排队秒数，默认读取ANALYZE_MAX_WAIT
+        """
+        self.max_active = max_active or int(os.getenv('ANALYZE_MAX_CONCURRENCY') or 2)
+        self.max_per_user = max_per_user or int(os.getenv('ANALYZE_MAX_PER_USER') or 1)
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('ANALYZE_MAX_QUEUE') or 8)
+        self.max_queued_per_user = max_queued_per_user if max_queued_per_user is not None else int(os.getenv('ANALYZE_MAX_QUEUED_PER_USER') or 2)
+        self.max_wait = max_wait or float(os.getenv('ANALYZE_MAX_WAIT') or 30)
+
+        self.active = 0
+        self._active_by_user: Counter = Counter()
+        self._queue: Deque[AdmissionTicket] = deque()
+        # 分析流平均运行时长的指数移动平均，用于估算Retry-After
+        self._avg_duration = 10.0
+
+    @property
+    def queued(self) -> int:
+        """排队中的请求数"""
+        return len(self._queue)
+
+    def retry_after(self) -> int:
+        """按平均运行时长和排队数估算客户端应等待的秒数"""
+        estimate = self._avg_duration * (self.queued + 1) / self.max_active
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(estimate)))
+
+    def check(self, user: str):
+        """
+        检查请求能否排队，不占用名额
+
+        Args:
+            user: 用户标识
+
+        Raises:
+            AdmissionRejectedError: 队列已满或该用户排队数已达上限
+        """
+        if self.queued >= self.max_queue and not self._can_start(user):
+            self._reject("分析请求过多，请稍后再试", "queue_full")
+        if sum(1 for ticket in self._queue if ticket.user == user) >= self.max_queued_per_user and not self._can_start(user):
+            self._reject("您的分析请求过多，请等待已有分析完成", "user_queue_full")
+
+    def enqueue(self, user: str) -> AdmissionTicket:
+        """
+        排队一个分析请求，有空闲名额时立即放行；之后必须调用release
+
+        Args:
+            user: 用户标识
+
+        Returns:
+            AdmissionTicket: 排队凭证
+
+        Raises:
+            AdmissionRejectedError: 队列已满或该用户排队数已达上限
+        """
+        self.check(user)
+        ticket = AdmissionTicket(user, asyncio.get_running_loop().create_future())
+        self._queue.append(ticket)
+        self._dispatch()
+        return ticket
+
+    def position(self, ticket: AdmissionTicket) -> int:
+        """凭证在队列中的位置，从1开始，已放行时为0"""
+        if ticket.future.done():
+            return 0
+        for index, queued in enumerate(self._queue):
+            if queued is ticket:
+                return index + 1
+        return 0
+
+    async def wait(self, ticket: AdmissionTicket, timeout: Optional[float] = None) -> AsyncGenerator[int, None]:
+        """
+        等待放行，排队期间位置变化时生成当前位置；立即放行时不生成
+
+        Args:
+            ticket: 排队凭证
+            timeout: 最长排队秒数，默认为max_wait
+
+        Raises:
+            AdmissionRejectedError: 排队超时
+        """
+        limit = time.monotonic() + (timeout if timeout is not None else self.max_wait)
+        last_position = None
+        while not ticket.future.done():
+            position = self.position(ticket)
+            if position != last_position:
+                last_position = position
+                yield position
+            remaining = limit - time.monotonic()
+            if remaining <= 0:
+                self.release(ticket)
+                self._reject("排队超时，请稍后再试", "timeout")
+            try:
+                await asyncio.wait_for(asyncio.shield(ticket.future), min(remaining, POSITION_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+
+        waited = ticket.admitted_at - ticket.enqueued_at
+        get_metrics().observe("analyze_queue_wait_seconds", waited, buckets=WAIT_BUCKETS)
+        if waited > 1:
+            logger.info(f"分析请求排队 {waited:.1f} 秒后开始（用户: {ticket.user}）")
+
+    def release(self, ticket: AdmissionTicket):
+        """
+        归还名额或退出队列，重复调用时只有第一次生效
+
+        Args:
+            ticket: 排队凭证
+        """
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.admitted_at is not None:
+            self.active -= 1
+            self._active_by_user[ticket.user] -= 1
+            if self._active_by_user[ticket.user] <= 0:
+                del self._active_by_user[ticket.user]
+            duration = time.monotonic() - ticket.admitted_at
+            self._avg_duration = self._avg_duration * 0.8 + duration * 0.2
+        else:
+            try:
+                self._queue.remove(ticket)
+            except ValueError:
+                pass
+            if not ticket.future.done():
+                ticket.future.cancel()
+        self._dispatch()
+
+    def _can_start(self, user: str) -> bool:
+        """没有人排队且有空闲名额时新请求可以直接开始"""
+        return not self._queue and self.active < self.max_active and self._active_by_user[user] < self.max_per_user
+
+    def _reject(self, message: str, reason: str):
+        """记录并抛出拒绝"""
+        get_metrics().inc("analyze_rejected_total", reason=reason)
+        raise AdmissionRejectedError(message, reason, self.retry_after())
+
+    def _dispatch(self):
+        """按排队顺序放行，跳过运行数已达上限的用户"""
+        for ticket in list(self._queue):
+            if self.active >= self.max_active:
+                break
+            if self._active_by_user[ticket.user] >= self.max_per_user:
+                continue
+            self._queue.remove(ticket)
+            if ticket.future.done():
+                continue
+            self.active += 1
+            self._active_by_user[ticket.user] += 1
+            ticket.admitted_at = time.monotonic()
+            ticket.future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """当前运行数、排队数和各用户运行数"""
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "by_user": dict(self._active_by_user),
+        }
+
+
+async def admitted_stream(controller: 'AdmissionController', user: str, stream: AsyncGenerator[bytes, None],
+                          timeout: Optional[float] = None) -> AsyncGenerator[bytes, None]:
+    """
+    在准入控制下迭代分析事件流，排队期间推送{"queue": {...}}位置事件
+
+    名额在生成器开始迭代时申请、结束时归还，客户端在开始前断开不会占用名额；
+    未被接纳时推送带retry_after的错误事件后结束
+
+    Args:
+        controller: 准入控制
+        user: 用户标识
+        stream: 分析事件流（NDJSON行）
+        timeout: 最长排队秒数，默认为controller.max_wait
+
+    Returns:
+        异步生成器，生成排队事件和原事件
+    """
+    try:
+        ticket = controller.enqueue(user)
+    except AdmissionRejectedError as e:
+        yield encode_event({"error": str(e), "status": "rejected", "retry_after": e.retry_after})
+        return
+    try:
+        async for position in controller.wait(ticket, timeout):
+            yield encode_event({"queue": {"position": position, "active": controller.active}})
+        async for chunk in stream:
+            yield chunk
+    except AdmissionRejectedError as e:
+        logger.warning(f"分析请求未被接纳（用户: {user}）: {e}")
+        yield encode_event({"error": str(e), "status": "rejected", "retry_after": e.retry_after})
+    finally:
+        controller.release(ticket)
+
+
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """获取进程内共享的分析请求准入控制"""
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController()
+    return _admission_controller
+
+
+def _admission_samples(attribute: str) -> List[Tuple[Dict[str, Any], float]]:
+    """准入控制的运行数或排队数，供指标采集"""
+    if _admission_controller is None:
+        return []
+    return [({}, getattr(_admission_controller, attribute))]
+
+
+get_metrics().register_gauge("analyze_active", lambda: _admission_samples("active"))
+get_metrics().register_gauge("analyze_queued", lambda: _admission_samples("queued"))
@@ -0,0 +1,300 @@
+import os
+import json
+import asyncio
+import time
+import pickle
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+import pandas as pd
+from utils.logger import get_logger
+from utils.data_dir import get_data_dir
+
+# 获取日志器
+logger = get_logger()
+
+
+class CacheStore:
+    """
+    本地键值缓存
+    基于SQLite文件，按命名空间存放JSON值并支持过期时间；
+    多个工作进程打开同一文件即共享缓存，另提供基于过期时间的租约用于在进程间认领后台任务
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        初始化缓存存储
+
+        Args:
+            db_path: 数据库文件路径，默认为数据目录下的cache.db
+        """
+        self.db_path = db_path or os.path.join(get_data_dir(), 'cache.db')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # 多个工作进程同时写入时等待锁而不是立即报错
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+
+        logger.debug(f"初始化CacheStore: {self.db_path}")
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """获取单个未过期的值，不存在时返回None"""
+        return self.get_many(namespace, [key]).get(key)
+
+    def get_many(self, namespace: str, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        批量获取未过期的值
+
+        Args:
+            namespace: 命名空间
+            keys: 键列表
+
+        Returns:
+            命中的键值字典
+        """
+        keys = list(keys)
+        now = time.time()
+        found = {}
+        with self._lock:
+            # SQLite对单条语句的参数个数有限制，分批查询
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ", ".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM cache_entries WHERE namespace = ? AND key IN ({placeholders}) "
+                    f"AND (expires_at IS NULL OR expires_at > ?)",
+                    (namespace, *batch, now)
+                ).fetchall()
+                for key, value in rows:
+                    found[key] = json.loads(value)
+        return found
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        """写入单个值，ttl为None时不过期"""
+        self.set_many(namespace, {key: value}, ttl)
+
+    def set_many(self, namespace: str, items: Dict[str, Any], ttl: Optional[float] = None):
+        """
+        批量写入值
+
+        Args:
+            namespace: 命名空间
+            items: 键值字典，值需可JSON序列化
+            ttl: 过期秒数，None表示不过期
+        """
+        if not items:
+            return
+        expires_at = time.time() + ttl if ttl is not None else None
+        rows = [(namespace, key, json.dumps(value, ensure_ascii=False), expires_at) for key, value in items.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                rows
+            )
+
+    def get_frame(self, namespace: str, key: str) -> Optional[pd.DataFrame]:
+        """
+        获取未过期的DataFrame，不存在时返回None
+
+        Args:
+            namespace: 命名空间
+            key: 键
+
+        Returns:
+            DataFrame或None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache_entries WHERE namespace = ? AND key = ? "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, key, now)
+            ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def get_expiry(self, namespace: str, key: str) -> Optional[float]:
+        """
+        获取未过期条目的过期时间，不读取值，可用于判断缓存的快照是否变化
+
+        Args:
+            namespace: 命名空间
+            key: 键
+
+        Returns:
+            过期的Unix时间戳，条目不存在、已过期或不过期时返回None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_frame(self, namespace: str, key: str, df: pd.DataFrame, ttl: Optional[float] = None) -> Optional[float]:
+        """
+        写入DataFrame
+
+        以pickle二进制存放，读取比JSON快一个数量级且保留索引和列类型；
+        缓存文件只由本应用的工作进程读写，不接收外部数据
+
+        Args:
+            namespace: 命名空间
+            key: 键
+            df: DataFrame
+            ttl: 过期秒数，None表示不过期
+
+        Returns:
+            写入的过期时间，不过期时为None
+        """
+        value = sqlite3.Binary(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL))
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, value, expires_at)
+            )
+        return expires_at
+
+    def try_claim(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        认领或续期租约
+
+        租约不存在、已过期或已属于owner时认领成功并把过期时间设为ttl秒后
+
+        Args:
+            name: 租约名称
+            owner: 认领者标识，通常为工作进程标识
+            ttl: 租约有效秒数
+
+        Returns:
+            bool: 是否认领成功
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at <= ?",
+                (name, owner, now + ttl, now)
+            )
+        return cursor.rowcount == 1
+
+    def release(self, name: str, owner: str):
+        """释放owner持有的租约"""
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def delete(self, namespace: str, key: str):
+        """删除单个值"""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def purge_expired(self) -> int:
+        """删除所有已过期的值，返回删除条数"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+
+class LocalFrameCache:
+    """
+    共享DataFrame的进程内副本
+    共享存储中的DataFrame每次读取都要反序列化，进程内保留读取过的副本，
+    只在共享存储中的过期时间（每次写入都会变化）与副本不一致时重新读取；
+    存储读写在线程中执行，其他工作进程写入时不阻塞事件循环
+    """
+
+    def __init__(self, store: CacheStore, namespace: str):
+        """
+        初始化进程内副本
+
+        Args:
+            store: 共享缓存存储
+            namespace: 命名空间
+        """
+        self.store = store
+        self.namespace = namespace
+        self._frames: Dict[str, Tuple[float, pd.DataFrame]] = {}
+
+    async def expiry(self, key: str) -> Optional[float]:
+        """获取共享存储中条目的过期时间，不存在或已过期时返回None"""
+        return await asyncio.to_thread(self.store.get_expiry, self.namespace, key)
+
+    async def get(self, key: str) -> Optional[pd.DataFrame]:
+        """
+        获取未过期的DataFrame，共享存储中的版本未变化时直接返回进程内副本
+
+        Args:
+            key: 键
+
+        Returns:
+            DataFrame或None
+        """
+        expires_at = await self.expiry(key)
+        if expires_at is None:
+            self._frames.pop(key, None)
+            return None
+        entry = self._frames.get(key)
+        if entry is not None and entry[0] == expires_at:
+            return entry[1]
+        df = await asyncio.to_thread(self.store.get_frame, self.namespace, key)
+        if df is None:
+            self._frames.pop(key, None)
+            return None
+        self._frames[key] = (expires_at, df)
+        return df
+
+    async def set(self, key: str, df: pd.DataFrame, ttl: float):
+        """
+        写入共享存储并更新进程内副本
+
+        Args:
+            key: 键
+            df: DataFrame
+            ttl: 过期秒数
+        """
+        expires_at = await asyncio.to_thread(self.store.set_frame, self.namespace, key, df, ttl)
+        self._frames[key] = (expires_at, df)
+
+
+_cache_store: Optional[CacheStore] = None
+_cache_store_lock = threading.Lock()
+
+
+def get_cache_store() -> CacheStore:
+    """获取应用共享的缓存存储"""
+    global _cache_store
+    with _cache_store_lock:
+        if _cache_store is None:
+            _cache_store = CacheStore()
+            purged = _cache_store.purge_expired()
+            if purged:
+                logger.debug(f"清理过期缓存 {purged} 条")
+        return _cache_store
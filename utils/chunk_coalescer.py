@@ -0,0 +1,85 @@
+import os
+import asyncio
+from typing import AsyncIterator, List, Optional, Tuple
+
+# 流式增量：(内容片段, 错误信息, 是否需要中止)
+Delta = Tuple[Optional[str], Optional[str], bool]
+
+
+async def coalesce_deltas(deltas: AsyncIterator[Delta], window_ms: Optional[float] = None,
+                          max_bytes: Optional[int] = None) -> AsyncIterator[Delta]:
+    """
+    合并流式响应中的内容片段，减少下游事件数和传输字节
+
+    第一个内容片段立即输出以保证首字延迟；之后的片段在时间窗口内累积，
+    窗口到期或累积字节数达到上限时合并输出；错误项先输出已累积的内容再原样输出
+
+    Args:
+        deltas: 内容增量的异步迭代器
+        window_ms: 合并时间窗口（毫秒），默认读取AI_STREAM_COALESCE_MS，为0时不合并
+        max_bytes: 单次输出的最大累积字节数，默认读取AI_STREAM_COALESCE_BYTES
+
+    Returns:
+        合并后的内容增量异步迭代器
+    """
+    window = (window_ms if window_ms is not None else float(os.getenv('AI_STREAM_COALESCE_MS') or 50)) / 1000
+    max_bytes = max_bytes or int(os.getenv('AI_STREAM_COALESCE_BYTES') or 1024)
+    if window <= 0:
+        async for item in deltas:
+            yield item
+        return
+
+    loop = asyncio.get_running_loop()
+    iterator = deltas.__aiter__()
+    pending: List[str] = []
+    size = 0
+    flush_at = 0.0
+    first = True
+    next_task: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if next_task is None:
+                next_task = asyncio.ensure_future(iterator.__anext__())
+            # 有累积内容时最多等到窗口结束；等待期间保留读取任务，不中断上游迭代
+            timeout = max(0.0, flush_at - loop.time()) if pending else None
+            done, _ = await asyncio.wait({next_task}, timeout=timeout)
+            if not done:
+                yield ''.join(pending), None, False
+                pending, size = [], 0
+                continue
+
+            task, next_task = next_task, None
+            try:
+                item = task.result()
+            except StopAsyncIteration:
+                break
+
+            content, error, fatal = item
+            if error is not None:
+                if pending:
+                    yield ''.join(pending), None, False
+                    pending, size = [], 0
+                yield item
+                continue
+            if first:
+                first = False
+                yield item
+                continue
+
+            if not pending:
+                flush_at = loop.time() + window
+            pending.append(content)
+            size += len(content.encode('utf-8'))
+            if size >= max_bytes:
+                yield ''.join(pending), None, False
+                pending, size = [], 0
+
+        if pending:
+            yield ''.join(pending), None, False
+    finally:
+        if next_task is not None and not next_task.done():
+            # 读取任务仍在运行，取消它并等待上游迭代结束后再返回，避免与上游响应的关闭交错
+            next_task.cancel()
+            await asyncio.wait({next_task})
+        else:
+            await iterator.aclose()
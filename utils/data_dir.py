@@ -0,0 +1,49 @@
+import os
+import time
+import secrets
+
+
+def get_data_dir() -> str:
+    """
+    获取本地数据目录
+
+    默认为项目根目录下的data目录，可通过DATA_DIR环境变量修改
+
+    Returns:
+        str: 已确保存在的数据目录路径
+    """
+    data_dir = os.getenv('DATA_DIR') or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'
+    )
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+
+def load_or_create_secret(filename: str) -> str:
+    """
+    读取数据目录下的密钥文件，不存在时生成并保存
+
+    多个工作进程同时启动时只有第一个创建成功，其余读取同一份密钥
+
+    Args:
+        filename: 密钥文件名
+
+    Returns:
+        str: 十六进制密钥
+    """
+    path = os.path.join(get_data_dir(), filename)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    # 另一个进程可能刚创建文件尚未写完，读到空内容时稍后重试
+    for _ in range(50):
+        with open(path, 'r') as f:
+            secret = f.read().strip()
+        if secret:
+            return secret
+        time.sleep(0.01)
+    raise RuntimeError(f"密钥文件 {path} 为空")
@@ -0,0 +1,82 @@
+import time
+import asyncio
+from typing import AsyncIterator, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class Deadline:
+    """
+    请求级的时间预算
+    从创建时开始计时，供数据获取、指标计算和AI分析各阶段共享
+    """
+
+    def __init__(self, seconds: Optional[float] = None):
+        """
+        初始化时间预算
+
+        Args:
+            seconds: 预算秒数，None表示不限时
+        """
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds else None
+
+    def remaining(self) -> Optional[float]:
+        """剩余秒数，不限时返回None"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """预算是否已用完"""
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def stage(self, fraction: float) -> 'Deadline':
+        """
+        为某个阶段划出部分剩余预算，给后续阶段留出时间
+
+        Args:
+            fraction: 占剩余预算的比例（0-1）
+
+        Returns:
+            Deadline: 阶段预算，不限时时同样不限时
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return Deadline()
+        return Deadline(max(remaining * fraction, 1e-6))
+
+    def timeout(self, default: Optional[float] = None) -> Optional[float]:
+        """
+        计算某个阶段可用的超时时间
+
+        Args:
+            default: 阶段自身的超时时间
+
+        Returns:
+            default与剩余预算中较小的一个
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        if default is None:
+            return remaining
+        return min(default, remaining)
+
+    async def iterate(self, iterator: AsyncIterator[T]) -> AsyncIterator[T]:
+        """
+        在预算内迭代异步迭代器，超时抛出asyncio.TimeoutError
+
+        Args:
+            iterator: 异步迭代器
+        """
+        if self.expires_at is None:
+            async for item in iterator:
+                yield item
+            return
+        while True:
+            try:
+                item = await asyncio.wait_for(iterator.__anext__(), self.remaining())
+            except StopAsyncIteration:
+                return
+            yield item
@@ -0,0 +1,109 @@
+import os
+import json
+import math
+import datetime
+from typing import Any
+import numpy as np
+import pandas as pd
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson为可选依赖
+    orjson = None
+
+
+def to_builtin(obj: Any) -> Any:
+    """
+    把numpy、pandas和日期类型转换为可JSON序列化的值
+
+    Args:
+        obj: 序列化器无法直接处理的对象
+
+    Returns:
+        转换后的值
+    """
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, pd.Series):
+        return obj.tolist()
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+
+def _finite(obj: Any) -> Any:
+    """把事件中的NaN和无穷大替换为None，与orjson的输出保持一致"""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    if isinstance(obj, (np.generic, np.ndarray, pd.Series)):
+        return _finite(to_builtin(obj))
+    return obj
+
+
+def _resolve_backend() -> str:
+    """按EVENT_JSON_BACKEND（auto、orjson或json）选择序列化后端"""
+    backend = (os.getenv('EVENT_JSON_BACKEND') or 'auto').lower()
+    if backend == 'json':
+        return 'json'
+    if orjson is None:
+        if backend == 'orjson':
+            logger.warning("EVENT_JSON_BACKEND=orjson 但未安装orjson，使用标准库json")
+        return 'json'
+    return 'orjson'
+
+
+BACKEND = _resolve_backend()
+
+_ORJSON_OPTIONS = (
+    orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+) if orjson is not None else 0
+
+
+def encode_event(event: Any) -> bytes:
+    """
+    把流式事件编码为一行NDJSON
+
+    安装orjson时使用orjson直接输出UTF-8字节，否则使用标准库json；两种后端都原生支持
+    numpy标量和数组、pandas时间戳和缺失值，调用方无需先转换为Python类型；NaN和无穷大都输出为null
+
+    Args:
+        event: 事件字典
+
+    Returns:
+        以换行结尾的UTF-8字节
+    """
+    if BACKEND == 'orjson':
+        return orjson.dumps(event, default=to_builtin, option=_ORJSON_OPTIONS)
+    try:
+        text = json.dumps(event, ensure_ascii=False, separators=(',', ':'), default=to_builtin, allow_nan=False)
+    except ValueError:
+        # 标准库json会把NaN和无穷大输出为非法的JSON字面量，只在出现时才逐项替换
+        text = json.dumps(_finite(event), ensure_ascii=False, separators=(',', ':'), default=to_builtin)
+    return (text + '\n').encode('utf-8')
+
+
+def decode_event(line: Any) -> Any:
+    """
+    解码一行NDJSON事件
+
+    Args:
+        line: 字节或字符串，可以带结尾换行
+
+    Returns:
+        事件字典
+    """
+    if BACKEND == 'orjson':
+        return orjson.loads(line)
+    return json.loads(line)
@@ -0,0 +1,133 @@
+import time
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from utils.metrics import get_metrics
+
+# 各接口的Cache-Control最长缓存秒数；基于行情快照的接口同时不超过快照剩余的有效期
+CACHE_POLICIES = {
+    "config": 60,
+    "search": 300,
+    "detail": 60,
+}
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    根据数据版本和请求参数生成ETag
+
+    Args:
+        *parts: 决定响应内容的数据版本和参数
+
+    Returns:
+        带引号的强ETag
+    """
+    digest = hashlib.sha256("\x00".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """按弱比较判断If-None-Match是否包含etag（经过gzip的代理会把强ETag改为弱ETag）"""
+    if header.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in header.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[float] = None) -> bool:
+    """
+    判断条件请求的缓存是否仍然有效
+
+    有If-None-Match时只按ETag判断，否则按If-Modified-Since判断
+
+    Args:
+        request: 当前请求
+        etag: 当前内容的ETag
+        last_modified: 当前内容的修改时间（Unix时间戳）
+
+    Returns:
+        客户端缓存有效时为True
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cache_headers(etag: str, last_modified: Optional[float], policy: str, private: bool,
+                  expires_at: Optional[float] = None) -> Dict[str, str]:
+    """
+    构建缓存相关的响应头
+
+    Args:
+        etag: 内容的ETag
+        last_modified: 内容的修改时间（Unix时间戳）
+        policy: CACHE_POLICIES中的策略名
+        private: 是否只允许浏览器缓存（需要登录时不允许代理缓存共享）
+        expires_at: 数据快照的过期时间，缓存时间不超过快照的剩余有效期
+
+    Returns:
+        响应头字典
+    """
+    max_age = CACHE_POLICIES[policy]
+    if expires_at is not None:
+        max_age = max(0, min(max_age, int(expires_at - time.time())))
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"{'private' if private else 'public'}, max-age={max_age}",
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    if private:
+        headers["Vary"] = "Authorization"
+    return headers
+
+
+def not_modified(request: Request, etag: str, snapshot: Optional[Tuple[float, float]], policy: str,
+                 private: bool, route: str) -> Optional[Response]:
+    """
+    客户端缓存有效时返回304响应
+
+    Args:
+        request: 当前请求
+        etag: 当前内容的ETag
+        snapshot: 数据快照的(生成时间, 过期时间)，没有快照时为None
+        policy: 缓存策略名
+        private: 是否只允许浏览器缓存
+        route: 用于统计的路由名称
+
+    Returns:
+        304响应，缓存无效时返回None
+    """
+    last_modified, expires_at = snapshot or (None, None)
+    if not is_not_modified(request, etag, last_modified):
+        return None
+    get_metrics().inc("http_not_modified_total", route=route)
+    return Response(status_code=304, headers=cache_headers(etag, last_modified, policy, private, expires_at))
+
+
+def cacheable_json(content: Any, etag: str, snapshot: Optional[Tuple[float, float]], policy: str,
+                   private: bool) -> JSONResponse:
+    """
+    返回带ETag、Last-Modified和Cache-Control的JSON响应
+
+    Args:
+        content: 响应内容
+        etag: 内容的ETag
+        snapshot: 数据快照的(生成时间, 过期时间)，没有快照时为None
+        policy: 缓存策略名
+        private: 是否只允许浏览器缓存
+
+    Returns:
+        JSON响应
+    """
+    last_modified, expires_at = snapshot or (None, None)
+    return JSONResponse(content=content, headers=cache_headers(etag, last_modified, policy, private, expires_at))
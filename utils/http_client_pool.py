@@ -0,0 +1,115 @@
+import os
+import asyncio
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+import httpx
+from utils.logger import get_logger
+
+# 获取日志器
+logger = get_logger()
+
+
+def _http2_available() -> bool:
+    """检查是否安装了HTTP/2依赖（h2）"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class HTTPClientPool:
+    """
+    应用级HTTP客户端池
+    按目标地址（scheme://host:port）复用httpx.AsyncClient，保持长连接，
+    避免每次AI请求重新建立TCP和TLS连接
+    """
+
+    def __init__(self, max_connections: Optional[int] = None, max_keepalive: Optional[int] = None,
+                 keepalive_expiry: Optional[float] = None, http2: Optional[str] = None):
+        """
+        初始化客户端池
+
+        Args:
+            max_connections: 每个目标地址的最大连接数，默认读取HTTP_MAX_CONNECTIONS
+            max_keepalive: 每个目标地址保持的空闲连接数，默认读取HTTP_MAX_KEEPALIVE
+            keepalive_expiry: 空闲连接保持秒数，默认读取HTTP_KEEPALIVE_EXPIRY
+            http2: 是否启用HTTP/2（auto/true/false），默认读取HTTP2_ENABLED，auto表示安装了h2时启用
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections or int(os.getenv('HTTP_MAX_CONNECTIONS') or 20),
+            max_keepalive_connections=max_keepalive or int(os.getenv('HTTP_MAX_KEEPALIVE') or 10),
+            keepalive_expiry=keepalive_expiry or float(os.getenv('HTTP_KEEPALIVE_EXPIRY') or 60),
+        )
+
+        mode = (http2 or os.getenv('HTTP2_ENABLED') or 'auto').lower()
+        available = _http2_available()
+        if mode in ('true', '1', 'yes') and not available:
+            logger.warning("HTTP2_ENABLED已开启但未安装h2，回退到HTTP/1.1（可通过 pip install httpx[http2] 安装）")
+        self.http2 = mode not in ('false', '0', 'no') and available
+
+        # 客户端的连接绑定在创建它的事件循环上，因此按(事件循环, 目标地址)区分
+        self._clients: Dict[Tuple[int, str], Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+
+        logger.debug(f"初始化HTTPClientPool: limits={self.limits}, http2={self.http2}")
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        """提取URL的scheme://host:port部分"""
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def get_client(self, url: str) -> httpx.AsyncClient:
+        """
+        获取目标地址对应的共享客户端
+
+        客户端不设置默认超时，调用方按请求传入timeout
+
+        Args:
+            url: 请求地址
+
+        Returns:
+            httpx.AsyncClient: 共享客户端，不要在调用方关闭
+        """
+        loop = asyncio.get_running_loop()
+        key = (id(loop), self._origin(url))
+        entry = self._clients.get(key)
+        if entry is not None and entry[0] is loop and not entry[1].is_closed:
+            return entry[1]
+
+        # 清理已关闭事件循环遗留的客户端
+        for stale_key, (stale_loop, _) in list(self._clients.items()):
+            if stale_loop.is_closed():
+                del self._clients[stale_key]
+
+        client = httpx.AsyncClient(limits=self.limits, http2=self.http2, timeout=None)
+        self._clients[key] = (loop, client)
+        logger.debug(f"为 {key[1]} 创建HTTP客户端，当前客户端数: {len(self._clients)}")
+        return client
+
+    async def aclose(self):
+        """关闭当前事件循环上的所有客户端"""
+        loop = asyncio.get_running_loop()
+        for key, (client_loop, client) in list(self._clients.items()):
+            if client_loop is loop:
+                await client.aclose()
+            if client_loop is loop or client_loop.is_closed():
+                del self._clients[key]
+        logger.info("HTTP客户端池已关闭")
+
+
+_http_client_pool: Optional[HTTPClientPool] = None
+
+
+def get_http_client_pool() -> HTTPClientPool:
+    """获取应用共享的HTTP客户端池"""
+    global _http_client_pool
+    if _http_client_pool is None:
+        _http_client_pool = HTTPClientPool()
+    return _http_client_pool
+
+
+async def close_http_client_pool():
+    """关闭应用共享的HTTP客户端池"""
+    if _http_client_pool is not None:
+        await _http_client_pool.aclose()
@@ -0,0 +1,261 @@
+import os
+import time
+import heapq
+import asyncio
+import hashlib
+import itertools
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from utils.logger import get_logger
+from utils.metrics import get_metrics
+from utils.llm_router import metric_labels, sanitize_url
+
+# 获取日志器
+logger = get_logger()
+
+# 请求优先级，数值越小越先执行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# 429退避时间的上下限（秒）
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 120.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    解析Retry-After响应头
+
+    Args:
+        value: 秒数或HTTP日期
+
+    Returns:
+        需要等待的秒数，无法解析时返回None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMLimiter:
+    """
+    上游AI接口限流器
+    限制同一(API地址, 密钥)的并发请求数和每分钟请求数，排队请求按优先级放行；
+    收到429时按Retry-After暂停放行并减半并发上限，之后随成功请求逐步恢复
+    """
+
+    def __init__(self, name: str, max_concurrency: Optional[int] = None, rpm: Optional[int] = None,
+                 label: Optional[str] = None):
+        """
+        初始化限流器
+
+        Args:
+            name: 限流器名称，用于日志
+            label: 指标中的端点标签，默认为名称
+            max_concurrency: 最大并发请求数，默认读取LLM_MAX_CONCURRENCY
+            rpm: 每分钟最大请求数，默认读取LLM_RPM，为0时不限制
+        """
+        self.name = name
+        self.label = label or name
+        self.max_concurrency = max_concurrency or int(os.getenv('LLM_MAX_CONCURRENCY') or 4)
+        self.rpm = rpm if rpm is not None else int(os.getenv('LLM_RPM') or 0)
+
+        # 当前生效的并发上限，429后减半，成功请求后逐步恢复
+        self.limit = self.max_concurrency
+        self.active = 0
+        self.cooldown_until = 0.0
+        self._successes = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._starts: Deque[float] = deque()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._wakeup_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        logger.debug(f"初始化LLMLimiter {name}: 并发={self.max_concurrency}, RPM={self.rpm or '不限'}")
+
+    @property
+    def queued(self) -> int:
+        """排队中的请求数"""
+        return sum(1 for _, _, future in self._queue if not future.done())
+
+    @property
+    def idle(self) -> bool:
+        """没有进行中和排队的请求，也不在429冷却中，可以安全丢弃"""
+        return self.active == 0 and self.queued == 0 and self.cooldown_until <= time.monotonic()
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None) -> float:
+        """
+        获取一个请求名额，用完后必须调用release
+
+        Args:
+            priority: 优先级，PRIORITY_INTERACTIVE先于PRIORITY_BATCH
+            timeout: 最长排队秒数，超时抛出asyncio.TimeoutError
+
+        Returns:
+            float: 排队等待的秒数
+        """
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), future))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if future.done() and not future.cancelled():
+                # 放行和取消同时发生，归还名额
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+        waited = time.monotonic() - started
+        label = "interactive" if priority <= PRIORITY_INTERACTIVE else "batch"
+        get_metrics().inc("llm_queue_wait_seconds_total", waited, priority=label)
+        get_metrics().inc("llm_requests_total", priority=label)
+        if waited > 1:
+            logger.info(f"AI请求在 {self.name} 排队 {waited:.1f} 秒（优先级: {label}）")
+        return waited
+
+    def release(self):
+        """归还请求名额"""
+        self.active = max(0, self.active - 1)
+        self._dispatch()
+
+    def record_success(self):
+        """记录一次成功请求，逐步恢复被429压低的并发上限"""
+        if self.limit < self.max_concurrency:
+            self._successes += 1
+            if self._successes >= self.limit:
+                self._successes = 0
+                self.limit += 1
+                logger.info(f"{self.name} 并发上限恢复到 {self.limit}")
+                self._dispatch()
+
+    def record_throttled(self, retry_after: Optional[str] = None) -> float:
+        """
+        记录一次429响应，暂停放行并减半并发上限
+
+        Args:
+            retry_after: Retry-After响应头
+
+        Returns:
+            float: 暂停放行的秒数
+        """
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            # 没有Retry-After时按当前冷却时间指数退避
+            remaining = self.cooldown_until - time.monotonic()
+            delay = remaining * 2 if remaining > 0 else MIN_BACKOFF
+        delay = min(max(delay, MIN_BACKOFF), MAX_BACKOFF)
+
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+        self.limit = max(1, self.limit // 2)
+        self._successes = 0
+        get_metrics().inc("llm_throttled_total", endpoint=self.label)
+        logger.warning(f"{self.name} 返回429，暂停 {delay:.1f} 秒，并发上限降为 {self.limit}")
+        return delay
+
+    def _dispatch(self):
+        """按优先级放行排队的请求"""
+        while self._queue and self._queue[0][2].done():
+            heapq.heappop(self._queue)
+
+        now = time.monotonic()
+        while self._queue and self.active < self.limit:
+            wait = self._blocked_for(now)
+            if wait > 0:
+                self._schedule_wakeup(wait)
+                return
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self.active += 1
+            self._starts.append(now)
+            future.set_result(None)
+
+    def _blocked_for(self, now: float) -> float:
+        """因429冷却或每分钟请求数还需等待的秒数"""
+        wait = self.cooldown_until - now
+        if self.rpm > 0:
+            while self._starts and self._starts[0] <= now - 60:
+                self._starts.popleft()
+            if len(self._starts) >= self.rpm:
+                wait = max(wait, self._starts[0] + 60 - now)
+        return wait
+
+    def _schedule_wakeup(self, delay: float):
+        """在限制解除后重新尝试放行"""
+        loop = asyncio.get_running_loop()
+        if self._wakeup is not None and self._wakeup_loop is loop and not self._wakeup.cancelled():
+            return
+
+        def wakeup():
+            self._wakeup = None
+            self._dispatch()
+
+        self._wakeup = loop.call_later(delay, wakeup)
+        self._wakeup_loop = loop
+
+
+# 按(API地址, 密钥摘要)共享的限流器，最近使用的在后；请求可以携带自定义地址和密钥，
+# 超过LLM_LIMITER_MAX_ENTRIES时丢弃最久未使用的空闲限流器
+_limiters: 'OrderedDict[Tuple[str, str], LLMLimiter]' = OrderedDict()
+LIMITER_MAX_ENTRIES = int(os.getenv('LLM_LIMITER_MAX_ENTRIES') or 64)
+
+
+def _limiter_samples(attribute: str) -> List[Tuple[Dict[str, Any], float]]:
+    """各限流器的排队数或进行中请求数，供指标采集；自定义配置的限流器按custom标签合计"""
+    totals: Dict[str, float] = {}
+    for limiter in list(_limiters.values()):
+        totals[limiter.label] = totals.get(limiter.label, 0) + getattr(limiter, attribute)
+    return [({"limiter": label}, value) for label, value in totals.items()]
+
+
+get_metrics().register_gauge("llm_queue_depth", lambda: _limiter_samples("queued"))
+get_metrics().register_gauge("llm_active_requests", lambda: _limiter_samples("active"))
+
+
+def get_llm_limiter(api_url: Optional[str], api_key: Optional[str]) -> LLMLimiter:
+    """
+    获取(API地址, 密钥)对应的共享限流器
+
+    Args:
+        api_url: API地址
+        api_key: API密钥，只保存其摘要
+
+    Returns:
+        LLMLimiter: 限流器
+    """
+    key_digest = hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:12]
+    key = (api_url or '', key_digest)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        _evict_idle_limiters(LIMITER_MAX_ENTRIES - 1)
+        limiter = _limiters[key] = LLMLimiter(f"{sanitize_url(api_url)}#{key_digest[:6]}",
+                                              label=metric_labels(api_url)[0])
+    _limiters.move_to_end(key)
+    return limiter
+
+
+def _evict_idle_limiters(keep: int):
+    """
+    从最久未使用的开始丢弃空闲的限流器，直到不超过keep个；有请求或在冷却中的限流器保留
+
+    Args:
+        keep: 保留的限流器数量上限
+    """
+    excess = len(_limiters) - keep
+    for key in list(_limiters):
+        if excess <= 0:
+            break
+        if _limiters[key].idle:
+            del _limiters[key]
+            excess -= 1
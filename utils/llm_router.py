@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from utils.logger import get_logger
+from utils.metrics import get_metrics
+
+# 获取日志器
+logger = get_logger()
+
+# 连续失败多少次后暂时摘除端点
+FAILURE_THRESHOLD = 3
+# 摘除时间（秒），连续摘除时翻倍，不超过上限
+UNHEALTHY_BASE = 30.0
+UNHEALTHY_MAX = 300.0
+# 首字延迟指数滑动平均的权重
+LATENCY_ALPHA = 0.3
+# 请求中自定义的地址和模型在指标中的统一标签，避免按调用方提供的值产生无限多的时间序列
+CUSTOM_LABEL = "custom"
+
+
+def sanitize_url(api_url: Optional[str]) -> str:
+    """去掉查询参数和用户信息的API地址，避免密钥进入日志和统计"""
+    parts = urlsplit(api_url or '')
+    host = parts.hostname or ''
+    if parts.port:
+        host = f"{host}:{parts.port}"
+    return f"{parts.scheme}://{host}{parts.path}" if parts.scheme else (api_url or '')
+
+
+class LLMEndpoint:
+    """一个OpenAI兼容的AI接口端点及其健康和延迟状态"""
+
+    def __init__(self, url: str, key: Optional[str], model: str, timeout: int = 60, name: Optional[str] = None):
+        """
+        初始化端点
+
+        Args:
+            url: API地址
+            key: API密钥
+            model: 模型名称
+            timeout: 请求超时时间（秒）
+            name: 端点名称，默认使用地址和模型
+        """
+        self.url = url
+        self.key = key
+        self.model = model
+        self.timeout = timeout
+        self.name = name or f"{sanitize_url(url)}#{model}"
+
+        # 首字延迟的滑动平均，没有样本时为None
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.unhealthy_until = 0.0
+        self._ejections = 0
+
+    @property
+    def healthy(self) -> bool:
+        """是否可以正常接收请求"""
+        return time.monotonic() >= self.unhealthy_until
+
+    def status(self) -> Dict[str, Any]:
+        """端点状态，不包含密钥"""
+        return {
+            "name": self.name,
+            "model": self.model,
+            "healthy": self.healthy,
+            "latency": round(self.latency, 4) if self.latency is not None else None,
+            "failures": self.failures,
+        }
+
+
+def load_endpoints() -> List[LLMEndpoint]:
+    """
+    读取AI接口端点配置
+
+    优先读取环境变量API_ENDPOINTS中的JSON列表，每项格式：
+    {"url": "https://api.example.com", "key": "sk-...", "model": "gpt-4o-mini", "timeout": 60, "name": "主线路"}
+    其中key、model和timeout缺省时使用API_KEY、API_MODEL和API_TIMEOUT；
+    未配置时使用API_URL作为唯一端点
+
+    Returns:
+        端点列表，未配置任何地址时为空
+    """
+    default_key = os.getenv('API_KEY')
+    default_model = os.getenv('API_MODEL', 'gpt-3.5-turbo')
+    default_timeout = int(os.getenv('API_TIMEOUT', 60))
+
+    raw = os.getenv('API_ENDPOINTS')
+    if raw:
+        try:
+            items = json.loads(raw)
+            endpoints = [
+                LLMEndpoint(item['url'], item.get('key') or default_key, item.get('model') or default_model,
+                            int(item.get('timeout') or default_timeout), item.get('name'))
+                for item in items if item.get('url')
+            ]
+            if endpoints:
+                return endpoints
+        except (json.JSONDecodeError, TypeError, KeyError, ValueError, AttributeError) as e:
+            logger.error(f"解析API_ENDPOINTS失败，使用API_URL: {str(e)}")
+
+    url = os.getenv('API_URL')
+    return [LLMEndpoint(url, default_key, default_model, default_timeout)] if url else []
+
+
+class LLMRouter:
+    """
+    AI接口端点路由
+    按首字延迟的滑动平均选择最快的健康端点，连续失败的端点暂时摘除；
+    可配置对冲阈值，首个内容片段超时未到达时由调用方向下一个端点发起对冲请求
+    """
+
+    def __init__(self, endpoints: List[LLMEndpoint], hedge_after: Optional[float] = None):
+        """
+        初始化路由
+
+        Args:
+            endpoints: 端点列表，顺序即无延迟数据时的优先级
+            hedge_after: 对冲阈值（秒），默认读取LLM_HEDGE_AFTER_MS，为0时不对冲
+        """
+        self.endpoints = endpoints
+        self.hedge_after = hedge_after if hedge_after is not None else float(os.getenv('LLM_HEDGE_AFTER_MS') or 0) / 1000
+        self._lock = threading.Lock()
+
+        if len(endpoints) > 1:
+            logger.info(f"AI端点路由: {[e.name for e in endpoints]}，对冲阈值: {self.hedge_after or '不对冲'}")
+
+    def select(self) -> List[LLMEndpoint]:
+        """
+        按优先级排列端点
+
+        健康端点在前，按首字延迟从低到高排列，没有延迟数据的端点按配置顺序优先尝试；
+        摘除中的端点排在最后，作为全部不可用时的兜底
+
+        Returns:
+            端点列表
+        """
+        order = {id(endpoint): index for index, endpoint in enumerate(self.endpoints)}
+        with self._lock:
+            return sorted(self.endpoints, key=lambda e: (
+                not e.healthy,
+                e.latency is not None,
+                e.latency or 0.0,
+                order[id(e)]
+            ))
+
+    def record_latency(self, endpoint: LLMEndpoint, latency: float, success: bool = True):
+        """
+        记录一次首字延迟
+
+        Args:
+            endpoint: 端点
+            latency: 首字延迟（秒）；对冲中被取消的请求传入已等待的时间
+            success: 请求是否成功，成功时清除连续失败计数
+        """
+        with self._lock:
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += LATENCY_ALPHA * (latency - endpoint.latency)
+            if success:
+                endpoint.failures = 0
+                endpoint._ejections = 0
+
+    def record_failure(self, endpoint: LLMEndpoint):
+        """
+        记录一次失败（连接错误、5xx或在首个内容片段前中断），连续失败达到阈值时暂时摘除端点
+
+        Args:
+            endpoint: 端点
+        """
+        with self._lock:
+            endpoint.failures += 1
+            if endpoint.failures < FAILURE_THRESHOLD:
+                return
+            delay = min(UNHEALTHY_BASE * (2 ** endpoint._ejections), UNHEALTHY_MAX)
+            endpoint._ejections += 1
+            endpoint.failures = 0
+            endpoint.unhealthy_until = time.monotonic() + delay
+        get_metrics().inc("llm_endpoint_ejected_total", endpoint=metric_labels(endpoint.url, endpoint.model)[0])
+        logger.warning(f"AI端点 {endpoint.name} 连续失败，暂停使用 {delay:.0f} 秒")
+
+    def status(self) -> List[Dict[str, Any]]:
+        """各端点状态"""
+        with self._lock:
+            return [endpoint.status() for endpoint in self.endpoints]
+
+
+_router: Optional[LLMRouter] = None
+
+
+def get_llm_router() -> LLMRouter:
+    """获取按环境变量配置的共享端点路由"""
+    global _router
+    if _router is None:
+        _router = LLMRouter(load_endpoints())
+    return _router
+
+
+def metric_labels(api_url: Optional[str], model: Optional[str] = None) -> Tuple[str, str]:
+    """
+    AI请求指标的(端点, 模型)标签
+
+    API_ENDPOINTS或API_URL配置的端点使用端点名称和模型；请求中自定义的地址或模型统一为custom，
+    标签取值数量不随调用方提供的配置增长
+
+    Args:
+        api_url: API地址
+        model: 模型名称，为None时只按地址匹配
+
+    Returns:
+        (端点标签, 模型标签)
+    """
+    url = sanitize_url(api_url)
+    for endpoint in get_llm_router().endpoints:
+        if sanitize_url(endpoint.url) == url and (model is None or endpoint.model == model):
+            return endpoint.name, endpoint.model
+    return CUSTOM_LABEL, CUSTOM_LABEL
@@ -0,0 +1,234 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+from utils.metrics import get_metrics
+from utils.llm_router import metric_labels
+from utils.request_profiler import record_stage
+
+
+def percentiles(values: List[float], qs: Tuple[float, ...] = (0.5, 0.9, 0.99)) -> Dict[str, Optional[float]]:
+    """
+    计算分位数（最近秩法）
+
+    Args:
+        values: 样本
+        qs: 分位点
+
+    Returns:
+        如{"p50": 0.12, "p90": 0.3, "p99": 0.5}，没有样本时值为None
+    """
+    ordered = sorted(values)
+    result: Dict[str, Optional[float]] = {}
+    for q in qs:
+        name = f"p{q * 100:g}"
+        result[name] = round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4) if ordered else None
+    return result
+
+
+class LLMTrace:
+    """
+    单次AI请求的耗时记录
+    记录发出请求、首个内容片段和之后每个片段的到达时间，结束时汇总到LLMTelemetry
+    """
+
+    def __init__(self, telemetry: 'LLMTelemetry', endpoint: str, model: str):
+        """
+        初始化请求记录
+
+        Args:
+            telemetry: 汇总统计
+            endpoint: 端点标签（配置的端点名称或custom）
+            model: 模型标签
+        """
+        self.telemetry = telemetry
+        self.endpoint = endpoint
+        self.model = model
+        self.started: Optional[float] = None
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+        self.gaps: List[float] = []
+        self.chars = 0
+        self.summary: Optional[Dict[str, Any]] = None
+
+    def begin(self):
+        """发出请求时调用，重试时重新计时"""
+        self.started = time.monotonic()
+        self.first_at = self.last_at = None
+        self.gaps = []
+        self.chars = 0
+
+    def on_content(self, content: str):
+        """
+        记录收到的内容片段
+
+        Args:
+            content: 上游返回的内容片段（合并前）
+        """
+        now = time.monotonic()
+        if self.first_at is None:
+            self.first_at = now
+        else:
+            self.gaps.append(now - self.last_at)
+        self.last_at = now
+        self.chars += len(content)
+
+    @property
+    def ttft(self) -> Optional[float]:
+        """首字延迟（秒），尚未收到内容时为None"""
+        if self.started is None or self.first_at is None:
+            return None
+        return self.first_at - self.started
+
+    def snapshot(self, status: str, output_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """
+        计算截至当前的统计，不汇总
+
+        Args:
+            status: 请求状态
+            output_tokens: 输出token数，未提供时不计算输出速度
+
+        Returns:
+            本次请求的统计
+        """
+        now = time.monotonic()
+        duration = now - (self.started if self.started is not None else now)
+        ttft = self.first_at - self.started if self.first_at is not None else None
+        # 流式请求按首字之后的生成时间计算速度，非流式按总耗时计算
+        generation = now - self.first_at if self.first_at is not None and self.gaps else duration
+        tokens_per_second = output_tokens / generation if output_tokens and generation > 0 else None
+
+        gap_stats = percentiles(self.gaps, (0.5, 0.95))
+        return {
+            "status": status,
+            "ttft": round(ttft, 4) if ttft is not None else None,
+            "duration": round(duration, 4),
+            "output_chars": self.chars,
+            "output_tokens": output_tokens,
+            "tokens_per_second": round(tokens_per_second, 2) if tokens_per_second is not None else None,
+            "gap_p50": gap_stats["p50"],
+            "gap_p95": gap_stats["p95"],
+        }
+
+    def finish(self, status: str, output_tokens: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        结束记录并汇总，重复调用时只有第一次生效；请求未发出时不记录
+
+        Args:
+            status: completed、error、timeout或cancelled
+            output_tokens: 输出token数，未提供时不计算输出速度
+
+        Returns:
+            本次请求的统计，请求未发出时返回None
+        """
+        if self.summary is not None or self.started is None:
+            return self.summary
+        self.summary = self.snapshot(status, output_tokens)
+        self.telemetry.record(self)
+        # 开启剖析的请求记录AI分析耗时和首字延迟
+        record_stage("AIAnalyzer", self.summary["duration"])
+        if self.summary["ttft"] is not None:
+            record_stage("AIAnalyzer.ttft", self.summary["ttft"])
+        return self.summary
+
+
+class LLMTelemetry:
+    """
+    AI接口的延迟和吞吐统计
+    按(端点, 模型)汇总请求数、错误和超时次数，以及最近若干次请求的首字延迟、
+    片段间隔、总耗时和输出速度的分位数
+    """
+
+    def __init__(self, window: Optional[int] = None):
+        """
+        初始化统计
+
+        Args:
+            window: 每个(端点, 模型)保留的最近请求数，默认读取LLM_TELEMETRY_WINDOW
+        """
+        self.window = window or int(os.getenv('LLM_TELEMETRY_WINDOW') or 500)
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def trace(self, api_url: Optional[str], model: Optional[str]) -> LLMTrace:
+        """
+        创建一次请求的记录
+
+        Args:
+            api_url: API地址
+            model: 模型名称
+
+        Returns:
+            LLMTrace: 请求记录
+        """
+        return LLMTrace(self, *metric_labels(api_url, model or ''))
+
+    def record(self, trace: LLMTrace):
+        """汇总一次结束的请求"""
+        summary = trace.summary
+        metrics = get_metrics()
+        metrics.inc("llm_calls_total", endpoint=trace.endpoint, model=trace.model, status=summary["status"])
+        if summary["status"] == "completed":
+            if summary["ttft"] is not None:
+                metrics.observe("llm_ttft_seconds", summary["ttft"], endpoint=trace.endpoint, model=trace.model)
+            metrics.observe("llm_duration_seconds", summary["duration"], endpoint=trace.endpoint, model=trace.model)
+        with self._lock:
+            stats = self._stats.get((trace.endpoint, trace.model))
+            if stats is None:
+                stats = self._stats[(trace.endpoint, trace.model)] = {
+                    "requests": 0, "completed": 0, "errors": 0, "timeouts": 0, "cancelled": 0,
+                    "output_chars": 0, "output_tokens": 0,
+                    "ttft": deque(maxlen=self.window),
+                    "duration": deque(maxlen=self.window),
+                    "tokens_per_second": deque(maxlen=self.window),
+                    # 片段间隔样本较多，按每次请求约20个片段保留
+                    "gaps": deque(maxlen=self.window * 20),
+                }
+            stats["requests"] += 1
+            key = {"completed": "completed", "error": "errors", "timeout": "timeouts"}.get(summary["status"], "cancelled")
+            stats[key] += 1
+            stats["output_chars"] += summary["output_chars"]
+            stats["output_tokens"] += summary["output_tokens"] or 0
+            stats["gaps"].extend(trace.gaps)
+            if summary["status"] == "completed":
+                stats["duration"].append(summary["duration"])
+                if summary["ttft"] is not None:
+                    stats["ttft"].append(summary["ttft"])
+                if summary["tokens_per_second"] is not None:
+                    stats["tokens_per_second"].append(summary["tokens_per_second"])
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """
+        导出统计
+
+        Returns:
+            每个(端点, 模型)的计数和最近请求的分位数，请求中自定义的配置合并为custom
+        """
+        with self._lock:
+            items = [(key, dict(stats, ttft=list(stats["ttft"]), duration=list(stats["duration"]),
+                                tokens_per_second=list(stats["tokens_per_second"]), gaps=list(stats["gaps"])))
+                     for key, stats in sorted(self._stats.items())]
+        return [{
+            "endpoint": endpoint,
+            "model": model,
+            "requests": stats["requests"],
+            "completed": stats["completed"],
+            "errors": stats["errors"],
+            "timeouts": stats["timeouts"],
+            "cancelled": stats["cancelled"],
+            "output_chars": stats["output_chars"],
+            "output_tokens": stats["output_tokens"],
+            "ttft": percentiles(stats["ttft"]),
+            "inter_token_gap": percentiles(stats["gaps"]),
+            "duration": percentiles(stats["duration"]),
+            "tokens_per_second": percentiles(stats["tokens_per_second"]),
+        } for (endpoint, model), stats in items]
+
+
+_telemetry = LLMTelemetry()
+
+
+def get_llm_telemetry() -> LLMTelemetry:
+    """获取进程内共享的AI接口统计"""
+    return _telemetry
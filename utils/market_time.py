@@ -0,0 +1,183 @@
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+# 各市场所在时区
+MARKET_TIMEZONES: Dict[str, str] = {
+    'A': 'Asia/Shanghai',
+    'ETF': 'Asia/Shanghai',
+    'LOF': 'Asia/Shanghai',
+    'HK': 'Asia/Hong_Kong',
+    'US': 'America/New_York',
+}
+
+# 各市场交易时段（当地时间，不含节假日）
+MARKET_SESSIONS: Dict[str, List[Tuple[time, time]]] = {
+    'A': [(time(9, 30), time(11, 30)), (time(13, 0), time(15, 0))],
+    'ETF': [(time(9, 30), time(11, 30)), (time(13, 0), time(15, 0))],
+    'LOF': [(time(9, 30), time(11, 30)), (time(13, 0), time(15, 0))],
+    'HK': [(time(9, 30), time(12, 0)), (time(13, 0), time(16, 0))],
+    'US': [(time(9, 30), time(16, 0))],
+}
+
+
+def market_now(market_type: str, now: Optional[datetime] = None) -> datetime:
+    """
+    获取市场当地时间
+
+    Args:
+        market_type: 市场类型
+        now: 参考时间，默认为当前时间
+
+    Returns:
+        datetime: 带时区的市场当地时间
+    """
+    tz = ZoneInfo(MARKET_TIMEZONES.get(market_type, 'Asia/Shanghai'))
+    if now is None:
+        return datetime.now(tz)
+    if now.tzinfo is None:
+        now = now.astimezone()
+    return now.astimezone(tz)
+
+
+def trading_day(market_type: str, now: Optional[datetime] = None) -> date:
+    """
+    获取市场当前所属的交易日，周末回退到上一个周五
+
+    Args:
+        market_type: 市场类型
+        now: 参考时间，默认为当前时间
+
+    Returns:
+        date: 交易日
+    """
+    day = market_now(market_type, now).date()
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def is_market_open(market_type: str, now: Optional[datetime] = None) -> bool:
+    """
+    判断市场当前是否处于交易时段
+
+    Args:
+        market_type: 市场类型
+        now: 参考时间，默认为当前时间
+
+    Returns:
+        bool: 是否处于交易时段
+    """
+    local = market_now(market_type, now)
+    if local.weekday() >= 5:
+        return False
+    current = local.time()
+    return any(start <= current < end for start, end in MARKET_SESSIONS.get(market_type, MARKET_SESSIONS['A']))
+
+
+def market_close_time(market_type: str) -> time:
+    """获取市场每日收盘时间（当地时间）"""
+    return MARKET_SESSIONS.get(market_type, MARKET_SESSIONS['A'])[-1][1]
+
+
+def seconds_until_day_end(market_type: str, now: Optional[datetime] = None) -> float:
+    """
+    距离市场当地午夜的秒数
+
+    Args:
+        market_type: 市场类型
+        now: 参考时间，默认为当前时间
+
+    Returns:
+        float: 秒数
+    """
+    local = market_now(market_type, now)
+    midnight = datetime.combine(local.date() + timedelta(days=1), time(0, 0), tzinfo=local.tzinfo)
+    return (midnight - local).total_seconds()
+
+
+def is_closed_for_day(market_type: str, now: Optional[datetime] = None) -> bool:
+    """
+    判断市场当日的交易是否已全部结束（收盘后或周末），不含开盘前和午间休市
+
+    Args:
+        market_type: 市场类型
+        now: 参考时间，默认为当前时间
+
+    Returns:
+        bool: 当日最后一个交易时段是否已结束
+    """
+    local = market_now(market_type, now)
+    return local.weekday() >= 5 or local.time() >= market_close_time(market_type)
+
+
+def next_session_start(market_type: str, now: Optional[datetime] = None) -> datetime:
+    """
+    下一个交易时段的开始时间（不含节假日）
+
+    Args:
+        market_type: 市场类型
+        now: 参考时间，默认为当前时间
+
+    Returns:
+        datetime: 晚于参考时间的最近一个交易时段开始时间（市场当地时间）
+    """
+    local = market_now(market_type, now)
+    sessions = MARKET_SESSIONS.get(market_type, MARKET_SESSIONS['A'])
+    for offset in range(8):
+        day = local.date() + timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        for start, _ in sessions:
+            start_at = datetime.combine(day, start, tzinfo=local.tzinfo)
+            if start_at > local:
+                return start_at
+    raise ValueError(f"无法确定 {market_type} 市场的下一个交易时段")
+
+
+def latest_bar_date(market_type: str, now: Optional[datetime] = None) -> date:
+    """
+    当前应当存在的最新日K线日期：当日开盘后为当日，开盘前为上一个工作日
+
+    Args:
+        market_type: 市场类型
+        now: 参考时间，默认为当前时间
+
+    Returns:
+        date: 最新K线日期（不含节假日，节假日返回的日期没有对应K线）
+    """
+    local = market_now(market_type, now)
+    day = local.date()
+    first_open = MARKET_SESSIONS.get(market_type, MARKET_SESSIONS['A'])[0][0]
+    if day.weekday() < 5 and local.time() >= first_open:
+        return day
+    day -= timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def cache_ttl(market_type: str, intraday_ttl: float, now: Optional[datetime] = None) -> float:
+    """
+    行情派生数据（K线、评分）的缓存秒数
+
+    当日交易全部结束后数据不再变化，缓存到当地午夜；交易时段内、开盘前和午间休市时
+    只缓存intraday_ttl秒，且不在交易时段内时不超过下一个交易时段开始，避免盘前或午休
+    写入的数据在下一个交易时段继续使用
+
+    Args:
+        market_type: 市场类型
+        intraday_ttl: 未收盘时的缓存秒数，为0时不缓存
+        now: 参考时间，默认为当前时间
+
+    Returns:
+        float: 缓存秒数，为0时不应缓存
+    """
+    if is_closed_for_day(market_type, now):
+        return seconds_until_day_end(market_type, now)
+    if intraday_ttl <= 0:
+        return 0
+    if is_market_open(market_type, now):
+        return intraday_ttl
+    local = market_now(market_type, now)
+    return min(intraday_ttl, (next_session_start(market_type, local) - local).total_seconds())
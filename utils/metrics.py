@@ -0,0 +1,217 @@
+import bisect
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 耗时直方图的默认分桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# 缓存命中率：缓存名 -> (命中计数器列表, 未命中计数器)
+CACHE_COUNTERS = {
+    "bar": (("bar_cache_hit_total", "bar_cache_shared_hit_total"), "bar_cache_miss_total"),
+    "scan": (("scan_cache_hit_total",), "scan_cache_miss_total"),
+    "ai": (("ai_cache_hit_total",), "ai_cache_miss_total"),
+    "token": (("token_cache_hit_total",), "token_cache_miss_total"),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+# 采集时计算的指标，返回[(标签, 值)]
+GaugeCallback = Callable[[], List[Tuple[Dict[str, Any], float]]]
+
+
+def _format_labels(labels: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    """格式化Prometheus标签，转义反斜杠、引号和换行"""
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(
+        f'{name}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in items
+    ) + "}"
+
+
+def _format_value(value: float) -> str:
+    """整数值不带小数点输出"""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsRegistry:
+    """
+    进程内指标注册表
+    以(指标名, 标签)为键累加计数器、记录仪表值和耗时直方图，线程安全；
+    可导出为Prometheus文本格式
+    """
+
+    def __init__(self):
+        """初始化指标注册表"""
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._gauges: Dict[Tuple[str, LabelKey], float] = {}
+        # (指标名, 标签) -> [各分桶计数..., 总和, 样本数]
+        self._histograms: Dict[Tuple[str, LabelKey], List[float]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._gauge_callbacks: Dict[str, GaugeCallback] = {}
+
+    @staticmethod
+    def _label_key(labels: Dict[str, Any]) -> LabelKey:
+        """把标签字典转换为可哈希的有序元组"""
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        累加计数器
+
+        Args:
+            name: 指标名
+            value: 增量
+            **labels: 标签
+        """
+        key = (name, self._label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def get(self, name: str, **labels) -> float:
+        """获取计数器当前值"""
+        with self._lock:
+            return self._counters.get((name, self._label_key(labels)), 0)
+
+    def add_gauge(self, name: str, delta: float, **labels):
+        """
+        增减仪表值，如进行中的流式响应数
+
+        Args:
+            name: 指标名
+            delta: 变化量
+            **labels: 标签
+        """
+        key = (name, self._label_key(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def register_gauge(self, name: str, callback: GaugeCallback):
+        """
+        注册采集时计算的仪表，如队列长度，平时没有开销
+
+        Args:
+            name: 指标名
+            callback: 返回[(标签, 值)]的函数
+        """
+        with self._lock:
+            self._gauge_callbacks[name] = callback
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels):
+        """
+        记录一次耗时等观测值到直方图
+
+        Args:
+            name: 指标名
+            value: 观测值（秒）
+            buckets: 分桶上界，同名指标以第一次记录时的分桶为准
+            **labels: 标签
+        """
+        key = (name, self._label_key(labels))
+        with self._lock:
+            bounds = self._buckets.setdefault(name, buckets)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0.0] * (len(bounds) + 2)
+            index = bisect.bisect_left(bounds, value)
+            if index < len(bounds):
+                histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        导出所有计数器
+
+        Returns:
+            指标名到[{labels, value}]列表的字典
+        """
+        with self._lock:
+            items = list(self._counters.items())
+        result: Dict[str, List[Dict[str, Any]]] = {}
+        for (name, labels), value in sorted(items):
+            result.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        return result
+
+    def cache_hit_ratios(self) -> Dict[str, Optional[float]]:
+        """
+        按CACHE_COUNTERS汇总各缓存的命中率
+
+        Returns:
+            缓存名到命中率的字典，没有访问时为None
+        """
+        with self._lock:
+            totals: Dict[str, float] = {}
+            for (name, _), value in self._counters.items():
+                totals[name] = totals.get(name, 0) + value
+        ratios = {}
+        for cache, (hit_names, miss_name) in CACHE_COUNTERS.items():
+            hits = sum(totals.get(name, 0) for name in hit_names)
+            lookups = hits + totals.get(miss_name, 0)
+            ratios[cache] = hits / lookups if lookups else None
+        return ratios
+
+    def render_prometheus(self) -> str:
+        """
+        导出为Prometheus文本格式（0.0.4）
+
+        Returns:
+            指标文本
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, list(values)) for key, values in self._histograms.items())
+            buckets = dict(self._buckets)
+            callbacks = sorted(self._gauge_callbacks.items())
+
+        lines: List[str] = []
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.append(f"# TYPE {name} counter")
+                last_name = name
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), value in gauges:
+            if name != last_name:
+                lines.append(f"# TYPE {name} gauge")
+                last_name = name
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for name, callback in callbacks:
+            try:
+                samples = callback()
+            except Exception:
+                # 采集函数出错不影响其他指标
+                continue
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(self._label_key(labels))} {_format_value(value)}")
+
+        lines.append("# TYPE cache_hit_ratio gauge")
+        for cache, ratio in self.cache_hit_ratios().items():
+            if ratio is not None:
+                lines.append(f'cache_hit_ratio{{cache="{cache}"}} {ratio:.4f}')
+
+        for (name, labels), values in histograms:
+            if name != last_name:
+                lines.append(f"# TYPE {name} histogram")
+                last_name = name
+            cumulative = 0.0
+            for bound, count in zip(buckets[name], values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', repr(bound)))} {_format_value(cumulative)}")
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {_format_value(values[-1])}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {values[-2]:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {_format_value(values[-1])}")
+        return "\n".join(lines) + "\n"
+
+
+_metrics = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """获取进程内共享的指标注册表"""
+    return _metrics
@@ -0,0 +1,45 @@
+import time
+from utils.metrics import get_metrics
+
+
+class RequestMetricsMiddleware:
+    """
+    按路由统计请求数和耗时的ASGI中间件
+
+    路由使用匹配到的路径模板（如/api/fund_detail/{symbol}），避免标签数量随参数增长；
+    耗时统计到响应体发送完毕，流式接口包含整个流的时长
+    """
+
+    def __init__(self, app):
+        """
+        初始化中间件
+
+        Args:
+            app: 下一层ASGI应用
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            # 挂载的静态文件等没有路径模板的路由使用路由名称
+            route_name = (getattr(route, "path", "") or getattr(route, "name", None) or "unmatched") if route else "unmatched"
+            metrics = get_metrics()
+            metrics.inc("http_requests_total", method=scope["method"], route=route_name, status=status)
+            metrics.observe("http_request_duration_seconds", time.perf_counter() - started,
+                            method=scope["method"], route=route_name)
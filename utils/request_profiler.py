@@ -0,0 +1,286 @@
+import os
+import re
+import sys
+import time
+import uuid
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Dict, List, Optional
+from utils.logger import get_logger
+from utils.metrics import get_metrics
+from utils.data_dir import get_data_dir
+from utils.event_encoder import encode_event
+
+# 获取日志器
+logger = get_logger()
+
+# 阶段名到组件名的映射，用于剖析结果中的阶段耗时汇总
+STAGE_COMPONENTS = {
+    "fetch": "StockDataProvider",
+    "indicators": "TechnicalIndicator",
+    "scoring": "StockScorer",
+}
+
+# 剖析文件编号只允许十六进制，避免路径穿越
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{12}$")
+
+# 单个栈记录的最大深度
+MAX_STACK_DEPTH = 128
+
+# 当前请求的剖析，未开启剖析的请求为None
+_active_profile: ContextVar[Optional['RequestProfile']] = ContextVar("request_profile", default=None)
+
+
+def is_profiling_enabled() -> bool:
+    """是否允许请求开启剖析（PROFILING_ENABLED）"""
+    return (os.getenv('PROFILING_ENABLED') or '').lower() in ('1', 'true', 'yes')
+
+
+def record_stage(component: str, seconds: float):
+    """
+    把一段耗时计入当前请求的剖析，未开启剖析时只有一次ContextVar读取
+
+    Args:
+        component: 组件名，如StockDataProvider
+        seconds: 耗时（秒）
+    """
+    profile = _active_profile.get()
+    if profile is not None:
+        profile.add_stage(component, seconds)
+
+
+def observe_stage(stage: str, started: float, mode: str):
+    """
+    记录分析阶段耗时到analysis_stage_seconds直方图，并计入当前请求的剖析
+
+    Args:
+        stage: fetch、indicators或scoring
+        started: time.perf_counter()记录的开始时间
+        mode: single、batch或pool
+    """
+    elapsed = time.perf_counter() - started
+    get_metrics().observe("analysis_stage_seconds", elapsed, stage=stage, mode=mode)
+    record_stage(STAGE_COMPONENTS.get(stage, stage), elapsed)
+
+
+def frame_name(code) -> str:
+    """
+    折叠栈中的函数名，格式为"限定名 (文件名)"
+
+    Args:
+        code: 栈帧的代码对象
+
+    Returns:
+        函数名，Python 3.10没有co_qualname时使用co_name
+    """
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})"
+
+
+class SamplingProfiler:
+    """
+    采样剖析器
+    后台线程按固定间隔读取事件循环线程的调用栈，只统计正在执行被剖析请求的样本，
+    结果为火焰图工具（flamegraph.pl、speedscope）可直接读取的折叠栈格式
+    """
+
+    def __init__(self, thread_id: int, root_frame, interval: float):
+        """
+        初始化采样剖析器
+
+        Args:
+            thread_id: 被采样的线程（事件循环线程）
+            root_frame: 被剖析请求的生成器栈帧，调用栈经过该帧的样本属于本请求，折叠栈从该帧开始
+            interval: 采样间隔（秒）
+        """
+        self.thread_id = thread_id
+        self.root_frame = root_frame
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        # 采样时事件循环在执行其他请求或空闲的样本数
+        self.other_samples = 0
+        # 采样线程异常退出的原因
+        self.error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        """开始采样"""
+        self._thread.start()
+
+    def stop(self):
+        """停止采样并等待线程退出"""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        try:
+            self._sample_until_stopped()
+        except Exception as e:
+            # 采样出错时记录原因，避免线程静默退出后剖析结果为空
+            self.error = f"{type(e).__name__}: {e}"
+            logger.error(f"请求剖析采样出错: {self.error}")
+
+    def _sample_until_stopped(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names: List[str] = []
+            matched = False
+            while frame is not None and len(names) < MAX_STACK_DEPTH:
+                names.append(frame_name(frame.f_code))
+                if frame is self.root_frame:
+                    matched = True
+                    break
+                frame = frame.f_back
+            del frame
+            if matched:
+                self.stacks[";".join(reversed(names))] += 1
+            else:
+                self.other_samples += 1
+
+
+class RequestProfile:
+    """单个请求的剖析：采样的调用栈和各组件的耗时"""
+
+    def __init__(self, interval: Optional[float] = None):
+        """
+        初始化请求剖析
+
+        Args:
+            interval: 采样间隔（秒），默认读取PROFILE_SAMPLE_INTERVAL_MS
+        """
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.interval = interval or float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS') or 5) / 1000
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.started = time.perf_counter()
+        self.elapsed: Optional[float] = None
+        self._profiler: Optional[SamplingProfiler] = None
+        self._lock = threading.Lock()
+
+    def activate(self):
+        """在当前上下文中开启阶段耗时记录，之后创建的任务继承该设置"""
+        _active_profile.set(self)
+
+    def add_stage(self, component: str, seconds: float):
+        """累加一个组件的耗时"""
+        with self._lock:
+            stage = self.stages.setdefault(component, {"calls": 0, "seconds": 0.0})
+            stage["calls"] += 1
+            stage["seconds"] += seconds
+
+    def start_sampling(self, root_frame):
+        """
+        开始采样，在事件循环线程中调用
+
+        Args:
+            root_frame: 被剖析的生成器栈帧
+        """
+        self._profiler = SamplingProfiler(threading.get_ident(), root_frame, self.interval)
+        self._profiler.start()
+
+    def stop(self):
+        """停止采样，重复调用时只有第一次生效"""
+        if self.elapsed is None:
+            self.elapsed = time.perf_counter() - self.started
+        if self._profiler is not None:
+            self._profiler.stop()
+
+    def folded(self) -> str:
+        """折叠栈文本，每行为以分号分隔的调用栈和样本数"""
+        stacks = self._profiler.stacks if self._profiler else Counter()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def summary(self, top: int = 10) -> Dict[str, Any]:
+        """
+        剖析摘要
+
+        Args:
+            top: 输出自身耗时最多的函数数量
+
+        Returns:
+            总耗时、各组件耗时、采样数和自身样本最多的函数
+        """
+        stacks = self._profiler.stacks if self._profiler else Counter()
+        samples = sum(stacks.values())
+        leaves: Counter = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "profile_id": self.profile_id,
+            "wall_time": round(self.elapsed if self.elapsed is not None else time.perf_counter() - self.started, 4),
+            "interval_ms": self.interval * 1000,
+            "samples": samples,
+            "other_samples": self._profiler.other_samples if self._profiler else 0,
+            "error": self._profiler.error if self._profiler else None,
+            "stages": {name: {"calls": int(stage["calls"]), "seconds": round(stage["seconds"], 4)}
+                       for name, stage in sorted(self.stages.items(), key=lambda item: -item[1]["seconds"])},
+            "top_functions": [{"function": name, "samples": count, "share": round(count / samples, 4)}
+                              for name, count in leaves.most_common(top)],
+            "folded_url": f"/api/profiles/{self.profile_id}",
+        }
+
+    def save(self):
+        """把折叠栈写入数据目录下的profiles目录，只保留最近的PROFILE_KEEP个文件"""
+        directory = get_profile_dir()
+        with open(os.path.join(directory, f"{self.profile_id}.folded"), "w", encoding="utf-8") as f:
+            f.write(self.folded())
+
+        keep = int(os.getenv('PROFILE_KEEP') or 50)
+        files = sorted((entry for entry in os.scandir(directory) if entry.name.endswith(".folded")),
+                       key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in files[keep:]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def get_profile_dir() -> str:
+    """剖析文件目录"""
+    directory = os.path.join(get_data_dir(), "profiles")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def load_profile(profile_id: str) -> Optional[str]:
+    """
+    读取保存的折叠栈
+
+    Args:
+        profile_id: 剖析编号
+
+    Returns:
+        折叠栈文本，编号无效或文件不存在时返回None
+    """
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    path = os.path.join(get_profile_dir(), f"{profile_id}.folded")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+async def profile_stream(stream: AsyncGenerator[bytes, None], profile: RequestProfile) -> AsyncGenerator[bytes, None]:
+    """
+    在剖析下迭代分析事件流，结束时追加一个剖析摘要事件
+
+    Args:
+        stream: 分析事件流（NDJSON行）
+        profile: 已在请求上下文中激活的剖析
+
+    Returns:
+        异步生成器，生成原事件和最后的{"profile": 摘要}事件
+    """
+    profile.start_sampling(stream.ag_frame)
+    try:
+        async for chunk in stream:
+            yield chunk
+        profile.stop()
+        profile.save()
+        summary = profile.summary()
+        logger.info(f"请求剖析 {profile.profile_id} 完成，耗时 {summary['wall_time']} 秒，采样 {summary['samples']} 次")
+        yield encode_event({"profile": summary})
+    finally:
+        profile.stop()
@@ -0,0 +1,59 @@
+import os
+import socket
+from typing import Any, Dict
+
+
+def is_production() -> bool:
+    """是否以生产模式运行（APP_ENV=production）"""
+    return (os.getenv('APP_ENV') or '').lower() == 'production'
+
+
+def get_web_workers() -> int:
+    """
+    获取Web工作进程数
+
+    生产模式默认为CPU核数且不超过4，可通过WEB_WORKERS修改；开发模式固定为1（启用自动重载）
+
+    Returns:
+        int: 工作进程数
+    """
+    if not is_production():
+        return 1
+    return max(1, int(os.getenv('WEB_WORKERS') or min(4, os.cpu_count() or 1)))
+
+
+def get_worker_id() -> str:
+    """当前工作进程的标识，用于在共享存储中区分租约和任务的持有者"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def get_uvicorn_options() -> Dict[str, Any]:
+    """
+    构建uvicorn启动参数
+
+    生产模式使用多工作进程、关闭自动重载，并调整长连接保持时间和监听队列长度；
+    开发模式保持单进程自动重载
+
+    Returns:
+        uvicorn.run的关键字参数
+    """
+    options: Dict[str, Any] = {
+        "host": os.getenv('WEB_HOST') or "0.0.0.0",
+        "port": int(os.getenv('WEB_PORT') or 8888),
+        # 只信任反向代理传入的客户端地址，直接访问的客户端无法伪造X-Forwarded-For
+        "proxy_headers": True,
+        "forwarded_allow_ips": os.getenv('FORWARDED_ALLOW_IPS') or '127.0.0.1',
+    }
+    if not is_production():
+        options["reload"] = True
+        return options
+
+    options.update(
+        workers=get_web_workers(),
+        reload=False,
+        # 长于反向代理的空闲超时，避免代理复用已被关闭的连接
+        timeout_keep_alive=int(os.getenv('WEB_KEEPALIVE_TIMEOUT') or 75),
+        backlog=int(os.getenv('WEB_BACKLOG') or 2048),
+        timeout_graceful_shutdown=int(os.getenv('WEB_GRACEFUL_TIMEOUT') or 30),
+    )
+    return options
@@ -0,0 +1,147 @@
+import json
+from typing import AsyncIterator, List, Optional
+
+
+class SSEParser:
+    """
+    增量SSE/NDJSON解析器
+    逐块输入文本，跨块保留未完成的行，按事件返回data载荷；
+    每个字符只扫描一次，未完成的行只在收到换行符时拼接一次
+    """
+
+    def __init__(self):
+        """初始化解析器"""
+        # 尚未收到换行符的行片段
+        self._partial: List[str] = []
+        # 当前事件已收到的data行
+        self._data: List[str] = []
+
+    def feed(self, chunk: str) -> List[str]:
+        """
+        输入一段文本
+
+        Args:
+            chunk: 响应文本片段，可在任意位置截断
+
+        Returns:
+            本段文本中完成的事件载荷列表
+        """
+        if not chunk:
+            return []
+        if '\n' not in chunk:
+            self._partial.append(chunk)
+            return []
+
+        if self._partial:
+            self._partial.append(chunk)
+            chunk = ''.join(self._partial)
+            self._partial = []
+
+        lines = chunk.split('\n')
+        tail = lines.pop()
+        if tail:
+            self._partial.append(tail)
+
+        events: List[str] = []
+        data = self._data
+        for line in lines:
+            if line.endswith('\r'):
+                line = line[:-1]
+            # 空行和无需补全判断的data行是热路径，直接内联处理
+            if not line:
+                if data:
+                    events.append(data[0] if len(data) == 1 else '\n'.join(data))
+                    data.clear()
+            elif line.startswith('data: ') and not data:
+                data.append(line[6:])
+            else:
+                self._process_line(line, events)
+        return events
+
+    def close(self) -> List[str]:
+        """
+        结束输入，返回缓冲区中剩余的事件
+
+        Returns:
+            剩余的事件载荷列表
+        """
+        events: List[str] = []
+        if self._partial:
+            line = ''.join(self._partial)
+            self._partial = []
+            self._process_line(line.rstrip('\r'), events)
+        self._dispatch(events)
+        return events
+
+    def _process_line(self, line: str, events: List[str]):
+        """处理一行完整的文本"""
+        if not line:
+            # 空行表示SSE事件结束
+            self._dispatch(events)
+            return
+        if line.startswith('data:'):
+            value = line[6:] if line.startswith('data: ') else line[5:]
+            # 部分接口事件之间不输出空行，上一条载荷已完整时先行分发
+            if self._data and self._is_complete(self._data):
+                self._dispatch(events)
+            self._data.append(value)
+            return
+        if line.startswith(':') or line.startswith(('event:', 'id:', 'retry:')):
+            # 注释和其他SSE字段
+            return
+        # 没有data前缀的行按NDJSON处理，一行一个事件
+        self._dispatch(events)
+        events.append(line.strip())
+
+    def _dispatch(self, events: List[str]):
+        """分发当前累积的data行"""
+        if self._data:
+            events.append('\n'.join(self._data))
+            self._data.clear()
+
+    @staticmethod
+    def _is_complete(data: List[str]) -> bool:
+        """判断已累积的data行是否已构成完整的载荷"""
+        payload = '\n'.join(data)
+        if payload == '[DONE]':
+            return True
+        try:
+            json.loads(payload)
+        except ValueError:
+            return False
+        return True
+
+
+def parse_stream_payload(payload: str) -> Optional[dict]:
+    """
+    解析OpenAI兼容接口的流式载荷
+
+    Args:
+        payload: SSEParser返回的事件载荷
+
+    Returns:
+        解析后的字典，载荷不是JSON对象时返回None
+    """
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def iter_sse_payloads(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    从文本块异步迭代器中逐个产出事件载荷
+
+    Args:
+        chunks: 响应文本块的异步迭代器，如httpx的aiter_text()
+
+    Returns:
+        事件载荷的异步迭代器
+    """
+    parser = SSEParser()
+    async for chunk in chunks:
+        for payload in parser.feed(chunk):
+            yield payload
+    for payload in parser.close():
+        yield payload
@@ -0,0 +1,109 @@
+import re
+from typing import Iterable, List, Optional, Tuple
+
+# 分段标记行，如 ===STOCK 600000===，允许模型额外输出Markdown强调或标题符号
+SECTION_MARKER = "===STOCK {code}==="
+_MARKER_RE = re.compile(r'^[#*>\s]*===\s*STOCK\s+([A-Za-z0-9._-]+)\s*===[*\s]*$')
+_MARKER_HEAD = "===STOCK"
+# 行首未完成的标记最多保留的字符数，超过后按正文输出
+_MAX_PENDING = 64
+
+
+class SectionDemuxer:
+    """
+    批量分析输出的分段解复用器
+    按行首的分段标记把一个流式响应拆分为每只股票的内容片段；
+    标记可以在任意位置被拆分到多个文本块中，正文片段尽量不等待整行到达就输出
+    """
+
+    def __init__(self, codes: Iterable[str]):
+        """
+        初始化解复用器
+
+        Args:
+            codes: 本次批量分析的股票代码
+        """
+        self.codes = set(codes)
+        self.current: Optional[str] = None
+        self.seen: List[str] = []
+        self._pending = ""
+        self._line_start = True
+
+    def feed(self, text: str) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        输入一段响应文本
+
+        Args:
+            text: 流式响应的内容片段
+
+        Returns:
+            (股票代码, 内容)列表；内容为None表示该股票分段开始，
+            股票代码为None的内容不属于任何已知股票（如第一个标记前的开场白）
+        """
+        out: List[Tuple[Optional[str], Optional[str]]] = []
+        buf = self._pending + text
+        self._pending = ""
+        pos = 0
+        while pos < len(buf):
+            if self._line_start:
+                newline = buf.find('\n', pos)
+                line = buf[pos:] if newline < 0 else buf[pos:newline]
+                if newline < 0 and self._may_be_marker(line):
+                    # 可能是被拆开的标记，等待后续文本
+                    self._pending = line
+                    break
+                if newline >= 0:
+                    match = _MARKER_RE.match(line.rstrip('\r'))
+                    if match and match.group(1) in self.codes:
+                        self._switch(match.group(1), out)
+                        pos = newline + 1
+                        continue
+                self._line_start = False
+
+            newline = buf.find('\n', pos)
+            end = len(buf) if newline < 0 else newline + 1
+            self._emit(buf[pos:end], out)
+            self._line_start = newline >= 0
+            pos = end
+        return out
+
+    def close(self) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        结束输入，输出剩余的文本
+
+        Returns:
+            (股票代码, 内容)列表
+        """
+        out: List[Tuple[Optional[str], Optional[str]]] = []
+        if self._pending:
+            match = _MARKER_RE.match(self._pending.rstrip('\r'))
+            if match and match.group(1) in self.codes:
+                self._switch(match.group(1), out)
+            else:
+                self._emit(self._pending, out)
+            self._pending = ""
+        return out
+
+    @staticmethod
+    def _may_be_marker(line: str) -> bool:
+        """行首文本是否可能是尚未完整到达的标记"""
+        if len(line) > _MAX_PENDING:
+            return False
+        stripped = line.lstrip('#*> \t').replace(' ', '')
+        return _MARKER_HEAD.startswith(stripped) or stripped.startswith(_MARKER_HEAD)
+
+    def _switch(self, code: str, out: List[Tuple[Optional[str], Optional[str]]]):
+        """切换到新的股票分段"""
+        self.current = code
+        if code not in self.seen:
+            self.seen.append(code)
+        out.append((code, None))
+
+    def _emit(self, content: str, out: List[Tuple[Optional[str], Optional[str]]]):
+        """输出当前分段的内容，合并连续片段"""
+        if not content:
+            return
+        if out and out[-1][0] == self.current and out[-1][1] is not None:
+            out[-1] = (self.current, out[-1][1] + content)
+        else:
+            out.append((self.current, content))
@@ -0,0 +1,99 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from utils.metrics import get_metrics
+
+
+class TokenCache:
+    """
+    已验证访问令牌的LRU缓存
+    按令牌哈希缓存用户名和过期时间，同一客户端的重复请求无需再次校验签名；
+    令牌过期或在缓存中超过最长时间后重新完整校验
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_age: Optional[float] = None):
+        """
+        初始化令牌缓存
+
+        Args:
+            max_entries: 最大条目数，默认读取TOKEN_CACHE_MAX_ENTRIES
+            max_age: 验证结果的最长缓存秒数，默认读取TOKEN_CACHE_MAX_AGE，为0时不缓存
+        """
+        self.max_entries = max_entries or int(os.getenv('TOKEN_CACHE_MAX_ENTRIES') or 1024)
+        self.max_age = max_age if max_age is not None else float(os.getenv('TOKEN_CACHE_MAX_AGE') or 300)
+        self._entries: 'OrderedDict[str, Tuple[str, float, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        """缓存键使用令牌的哈希，内存中不保留原始令牌"""
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, token: str) -> Optional[str]:
+        """
+        获取已验证令牌的用户名
+
+        Args:
+            token: 访问令牌
+
+        Returns:
+            用户名，未缓存、已过期或超过最长缓存时间时返回None
+        """
+        if self.max_age <= 0:
+            return None
+        key = self._key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry[1] and now - entry[2] < self.max_age:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                subject = entry[0]
+            else:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                subject = None
+        get_metrics().inc("token_cache_hit_total" if subject is not None else "token_cache_miss_total")
+        return subject
+
+    def put(self, token: str, subject: str, expires_at: Optional[float]):
+        """
+        缓存验证通过的令牌
+
+        Args:
+            token: 访问令牌
+            subject: 用户名
+            expires_at: 令牌过期的Unix时间戳，没有过期时间时只受最长缓存时间限制
+        """
+        if self.max_age <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (subject, float(expires_at) if expires_at is not None else float('inf'), time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存条目数和命中统计"""
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+_token_cache = TokenCache()
+
+
+def get_token_cache() -> TokenCache:
+    """获取进程内共享的令牌缓存"""
+    return _token_cache
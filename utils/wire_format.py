@@ -0,0 +1,225 @@
+import json
+from typing import Any, AsyncGenerator, Dict, Iterable, List, Optional, Tuple
+from utils.event_encoder import decode_event, to_builtin
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack为可选依赖
+    msgpack = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # pragma: no cover - pyarrow为可选依赖
+    pa = None
+
+# 响应格式
+FORMAT_JSON = "json"
+FORMAT_MSGPACK = "msgpack"
+FORMAT_ARROW = "arrow"
+
+# 各格式响应的Content-Type
+MEDIA_TYPES = {
+    FORMAT_JSON: "application/json",
+    FORMAT_MSGPACK: "application/x-msgpack",
+    FORMAT_ARROW: "application/vnd.apache.arrow.stream",
+}
+
+# Accept中可识别的媒体类型
+_ACCEPTED = {
+    "application/json": FORMAT_JSON,
+    "application/x-ndjson": FORMAT_JSON,
+    "application/*": FORMAT_JSON,
+    "*/*": FORMAT_JSON,
+    "application/msgpack": FORMAT_MSGPACK,
+    "application/x-msgpack": FORMAT_MSGPACK,
+    "application/vnd.msgpack": FORMAT_MSGPACK,
+    "application/vnd.apache.arrow.stream": FORMAT_ARROW,
+}
+
+# 评分表的列，多个事件按股票代码合并为一行
+SCORE_COLUMNS: List[Tuple[str, str]] = [
+    ("stock_code", "string"),
+    ("status", "string"),
+    ("score", "int64"),
+    ("recommendation", "string"),
+    ("price", "float64"),
+    ("price_change_value", "float64"),
+    ("change_percent", "float64"),
+    ("rsi", "float64"),
+    ("ma_trend", "string"),
+    ("macd_signal", "string"),
+    ("volume_status", "string"),
+    ("bar_date", "string"),
+    ("cached", "bool"),
+    ("ai_score", "int64"),
+    ("ai_recommendation", "string"),
+    ("ai_analysis", "string"),
+    ("error", "string"),
+]
+
+
+class NotAcceptableError(Exception):
+    """请求的响应格式不受支持或服务器未安装对应的库"""
+    pass
+
+
+def is_available(fmt: str) -> bool:
+    """响应格式依赖的库是否已安装"""
+    if fmt == FORMAT_MSGPACK:
+        return msgpack is not None
+    if fmt == FORMAT_ARROW:
+        return pa is not None
+    return True
+
+
+def negotiate(accept: Optional[str], formats: Iterable[str] = (FORMAT_JSON, FORMAT_MSGPACK, FORMAT_ARROW)) -> str:
+    """
+    按Accept请求头选择响应格式
+
+    按q值从高到低选择第一个本接口支持且依赖库已安装的格式，未提供Accept时使用JSON
+
+    Args:
+        accept: Accept请求头
+        formats: 本接口支持的格式
+
+    Returns:
+        响应格式
+
+    Raises:
+        NotAcceptableError: 没有可用的格式
+    """
+    if not accept:
+        return FORMAT_JSON
+
+    candidates = []
+    for index, item in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            candidates.append((-quality, index, media_type.lower()))
+
+    missing = []
+    for _, _, media_type in sorted(candidates):
+        fmt = _ACCEPTED.get(media_type)
+        if fmt is None or fmt not in formats:
+            continue
+        if is_available(fmt):
+            return fmt
+        missing.append(fmt)
+
+    if missing:
+        raise NotAcceptableError(f"服务器未安装{'、'.join(dict.fromkeys(missing))}对应的库，无法返回该格式")
+    supported = [MEDIA_TYPES[fmt] for fmt in formats]
+    raise NotAcceptableError(f"不支持的响应格式: {accept}，可选: {', '.join(supported)}")
+
+
+def pack(obj: Any) -> bytes:
+    """
+    把对象编码为MessagePack，numpy和pandas类型按JSON编码相同的规则转换
+
+    Args:
+        obj: 事件或响应体
+
+    Returns:
+        MessagePack字节
+    """
+    return msgpack.packb(obj, default=to_builtin, use_bin_type=True)
+
+
+async def transcode_stream(lines: AsyncGenerator[bytes, None], fmt: str) -> AsyncGenerator[bytes, None]:
+    """
+    把NDJSON事件流转换为协商的格式
+
+    MessagePack逐个事件输出（客户端可用msgpack.Unpacker流式读取）；
+    Arrow需要完整的评分表，收集全部事件后一次输出
+
+    Args:
+        lines: NDJSON事件流
+        fmt: 响应格式
+
+    Returns:
+        异步生成器，生成响应内容
+    """
+    if fmt == FORMAT_JSON:
+        async for line in lines:
+            yield line
+    elif fmt == FORMAT_MSGPACK:
+        async for line in lines:
+            yield pack(decode_event(line))
+    else:
+        events = [decode_event(line) async for line in lines]
+        summary = next((event for event in reversed(events) if event.get("scan_completed")), None)
+        yield encode_score_table(events, {"summary": summary} if summary else None)
+
+
+def score_rows(events: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    把分析事件按股票代码合并为评分表的行
+
+    同一股票先到达的评分事件填写技术评分和指标，之后的完成事件作为AI评分，
+    AI分析片段拼接为完整分析文本
+
+    Args:
+        events: 事件字典
+
+    Returns:
+        按股票首次出现顺序排列的行
+    """
+    rows: Dict[str, Dict[str, Any]] = {}
+    chunks: Dict[str, List[str]] = {}
+    for event in events:
+        code = event.get("stock_code")
+        if not code:
+            continue
+        row = rows.setdefault(code, {"stock_code": code})
+
+        if "ai_analysis_chunk" in event:
+            chunks.setdefault(code, []).append(event["ai_analysis_chunk"])
+        elif "error" in event:
+            row["error"] = event["error"]
+        elif "score" in event and "score" in row:
+            row["ai_score"] = event["score"]
+            row["ai_recommendation"] = event.get("recommendation")
+            if "analysis" in event:
+                row["ai_analysis"] = event["analysis"]
+        else:
+            for name, _ in SCORE_COLUMNS:
+                if name in event and name != "status":
+                    row[name] = event[name]
+        if "status" in event:
+            row["status"] = event["status"]
+
+    for code, parts in chunks.items():
+        rows[code].setdefault("ai_analysis", "".join(parts))
+    return list(rows.values())
+
+
+def encode_score_table(events: Iterable[Dict[str, Any]], metadata: Optional[Dict[str, Any]] = None) -> bytes:
+    """
+    把分析事件编码为Arrow IPC流格式的评分表
+
+    Args:
+        events: 事件字典
+        metadata: 写入表结构元数据的附加信息（值按JSON编码）
+
+    Returns:
+        Arrow IPC流字节
+    """
+    schema = pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in SCORE_COLUMNS])
+    if metadata:
+        schema = schema.with_metadata({key: json.dumps(value, ensure_ascii=False, default=to_builtin)
+                                       for key, value in metadata.items()})
+    table = pa.Table.from_pylist(score_rows(events), schema=schema)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -4,18 +4,37 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any, Generator
+from typing import List, Optional, Dict, Any, Generator, AsyncGenerator
 from services.stock_analyzer_service import StockAnalyzerService
 from services.us_stock_service_async import USStockServiceAsync
 from services.fund_service_async import FundServiceAsync
+from services.scan_job_manager import ScanJobManager, JobQueueFullError
+from services.watchlist_scheduler import WatchlistScheduler
+from services.indicator_executor import shutdown_process_pool
+from contextlib import asynccontextmanager
 import os
+import uuid
 import httpx
 from utils.logger import get_logger
 from utils.api_utils import APIUtils
+from utils.metrics import get_metrics
+from utils.request_metrics import RequestMetricsMiddleware
+from utils.llm_telemetry import get_llm_telemetry
+from utils.llm_router import get_llm_router
+from utils.token_cache import get_token_cache
+from utils.http_cache import make_etag, not_modified, cacheable_json
+from utils.deadline import Deadline
+from utils.event_encoder import encode_event
+from utils.admission import AdmissionRejectedError, admitted_stream, get_admission_controller
+from utils.request_profiler import RequestProfile, is_profiling_enabled, load_profile, profile_stream
+from utils.wire_format import (FORMAT_ARROW, FORMAT_JSON, FORMAT_MSGPACK, MEDIA_TYPES, NotAcceptableError,
+                               encode_score_table, negotiate, pack, transcode_stream)
+from utils.http_client_pool import get_http_client_pool, close_http_client_pool
+from utils.data_dir import load_or_create_secret
+from utils.server_config import get_uvicorn_options
 from dotenv import load_dotenv
 import uvicorn
-import json
-import secrets
+import asyncio
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 
@@ -24,8 +43,8 @@ load_dotenv()
 # 获取日志器
 logger = get_logger()
 
-# JWT相关配置
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", secrets.token_hex(32))
+# JWT相关配置，未配置密钥时使用数据目录下持久化的随机密钥，所有工作进程和重启后保持一致
+SECRET_KEY = os.getenv("JWT_SECRET_KEY") or load_or_create_secret("jwt_secret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 10080  # Token过期时间一周
 
@@ -35,13 +54,38 @@ print(LOGIN_PASSWORD)
 # 是否需要登录
 REQUIRE_LOGIN = bool(LOGIN_PASSWORD.strip())
 
+# /metrics的访问令牌，为空时不需要认证
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动和关闭后台服务"""
+    # 应用级共享的分析服务，请求的自定义AI配置通过for_request叠加
+    app.state.stock_analyzer = StockAnalyzerService()
+    app.state.scan_job_manager = ScanJobManager(
+        service_factory=lambda api_config: app.state.stock_analyzer.for_request(**api_config)
+    )
+    await app.state.scan_job_manager.start()
+    app.state.watchlist_scheduler = WatchlistScheduler(app.state.stock_analyzer)
+    await app.state.watchlist_scheduler.start()
+    yield
+    await app.state.watchlist_scheduler.stop()
+    await app.state.scan_job_manager.stop()
+    await close_http_client_pool()
+    shutdown_process_pool()
+
 
 app = FastAPI(
     title="Stock Scanner API",
     description="异步股票分析API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# 按路由统计请求数和耗时
+app.add_middleware(RequestMetricsMiddleware)
+
 # 添加CORS中间件
 app.add_middleware(
     CORSMiddleware,
@@ -63,6 +107,17 @@ class AnalyzeRequest(BaseModel):
     api_key: Optional[str] = None
     api_model: Optional[str] = None
     api_timeout: Optional[str] = None
+    # 整个请求的时间预算（秒），用完时未完成的股票标记为超时并以已有结果结束
+    deadline: Optional[float] = Field(None, gt=0)
+
+class ScanJobRequest(BaseModel):
+    stock_codes: List[str]
+    market_type: str = "A"
+    min_score: int = 0
+    api_url: Optional[str] = None
+    api_key: Optional[str] = None
+    api_model: Optional[str] = None
+    api_timeout: Optional[str] = None
 
 class TestAPIRequest(BaseModel):
     api_url: str
@@ -123,15 +178,81 @@ async def verify_token(token: Optional[str] = Depends(optional_oauth2_scheme)):
     if token is None:
         raise credentials_exception
         
+    # 近期验证过的令牌直接使用缓存的用户名，跳过签名校验
+    token_cache = get_token_cache()
+    username = token_cache.get(token)
+    if username is not None:
+        return username
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
+        token_cache.put(token, username, payload.get("exp"))
         return username
     except JWTError:
         raise credentials_exception
 
+async def get_client_id(request: Request, username: str = Depends(verify_token),
+                        token: Optional[str] = Depends(optional_oauth2_scheme)) -> str:
+    """
+    区分客户端的标识，准入控制按其限制并发，后台扫描任务按其隔离
+
+    需要登录时所有用户共用同一用户名，使用每次登录签发的令牌ID（jti）区分；
+    旧令牌没有jti时组合用户名和客户端地址。不需要登录时使用客户端地址，
+    经反向代理转发时由uvicorn按FORWARDED_ALLOW_IPS只信任代理传入的地址
+    """
+    host = request.client.host if request.client else "unknown"
+    if not REQUIRE_LOGIN or token is None:
+        return host
+    # 令牌已由verify_token校验，这里只读取声明
+    jti = jwt.get_unverified_claims(token).get("jti")
+    return f"{username}:{jti}" if jti else f"{username}@{host}"
+
+async def _wait_for_disconnect(request: Request):
+    """等待客户端断开连接（请求体已被读取，后续只会收到断开消息）"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def iterate_until_disconnected(request: Request, stream: AsyncGenerator[bytes, None], route: str) -> AsyncGenerator[bytes, None]:
+    """
+    迭代流式生成器，客户端断开时立即取消生成器中正在进行的工作
+    
+    取消会抛入生成器当前的等待点，使未完成的数据获取任务、上游AI流和信号量随之释放
+    
+    Args:
+        request: 当前请求
+        stream: 产生响应内容的异步生成器
+        route: 用于统计的路由名称
+    """
+    disconnect_task = asyncio.create_task(_wait_for_disconnect(request))
+    next_task = None
+    get_metrics().add_gauge("streams_in_flight", 1, route=route)
+    try:
+        while True:
+            next_task = asyncio.ensure_future(stream.__anext__())
+            done, _ = await asyncio.wait({next_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+            if next_task not in done:
+                break
+            try:
+                chunk = next_task.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        get_metrics().add_gauge("streams_in_flight", -1, route=route)
+        disconnect_task.cancel()
+        if next_task is not None and not next_task.done():
+            # 客户端断开（由本函数或服务器检测到），取消会抛入生成器内部使其结束
+            next_task.cancel()
+            get_metrics().inc("stream_cancelled_total", route=route)
+            logger.info(f"客户端已断开，取消 {route} 的流式处理")
+        else:
+            await stream.aclose()
+
 # 用户登录接口
 @app.post("/api/login")
 async def login(request: LoginRequest):
@@ -147,8 +268,9 @@ async def login(request: LoginRequest):
     
     # 创建访问令牌
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # 所有用户共用同一密码，每次登录签发不同的令牌ID用于区分客户端
     access_token = create_access_token(
-        data={"sub": "user"}, expires_delta=access_token_expires
+        data={"sub": "user", "jti": uuid.uuid4().hex}, expires_delta=access_token_expires
     )
     logger.info("用户登录成功")
     return {"access_token": access_token, "token_type": "bearer"}
@@ -161,7 +283,7 @@ async def check_auth(username: str = Depends(verify_token)):
 
 # 获取系统配置
 @app.get("/api/config")
-async def get_config():
+async def get_config(request: Request):
     """返回系统配置信息"""
     config = {
         'announcement': os.getenv('ANNOUNCEMENT_TEXT') or '',
@@ -169,24 +291,65 @@ async def get_config():
         'default_api_model': os.getenv('API_MODEL', ''),
         'default_api_timeout': os.getenv('API_TIMEOUT', '60')
     }
-    return config
+    etag = make_etag("config", *config.values())
+    return not_modified(request, etag, None, "config", False, "/api/config") or \
+        cacheable_json(config, etag, None, "config", False)
+
+def negotiate_format(request: Request, formats=(FORMAT_JSON, FORMAT_MSGPACK, FORMAT_ARROW)) -> str:
+    """
+    按Accept请求头选择响应格式
+    
+    Args:
+        request: 当前请求
+        formats: 接口支持的格式
+        
+    Returns:
+        响应格式，格式不支持或服务器未安装对应的库时返回406
+    """
+    try:
+        return negotiate(request.headers.get("accept"), formats)
+    except NotAcceptableError as e:
+        raise HTTPException(status_code=406, detail=str(e))
 
 # AI分析股票
 @app.post("/api/analyze")
-async def analyze(request: AnalyzeRequest, username: str = Depends(verify_token)):
+async def analyze(request: AnalyzeRequest, http_request: Request, client: str = Depends(get_client_id)):
+    # 默认NDJSON，Accept为MessagePack时逐个事件输出，为Arrow时分析结束后输出评分表
+    response_format = negotiate_format(http_request)
+    logger.info("开始处理分析请求")
+    stock_codes = request.stock_codes
+    market_type = request.market_type
+    
+    # 后端再次去重，确保安全
+    original_count = len(stock_codes)
+    stock_codes = list(dict.fromkeys(stock_codes))  # 保持原有顺序的去重方法
+    if len(stock_codes) < original_count:
+        logger.info(f"后端去重: 从{original_count}个代码中移除了{original_count - len(stock_codes)}个重复项")
+    
+    # 请求体校验先于剖析和准入控制，无效请求不占用排队名额
+    if not stock_codes:
+        logger.warning("未提供股票代码")
+        raise HTTPException(status_code=400, detail="请输入代码")
+    
+    logger.debug(f"接收到分析请求: stock_codes={stock_codes}, market_type={market_type}")
+    
+    # 请求头X-Profile: 1或查询参数profile=1时在采样剖析下运行本次分析，流末尾追加剖析摘要
+    profile = None
+    if http_request.headers.get("x-profile") == "1" or http_request.query_params.get("profile") == "1":
+        if not is_profiling_enabled():
+            raise HTTPException(status_code=403, detail="未启用请求剖析")
+        profile = RequestProfile()
+    # 准入控制：队列已满时立即返回429，否则在流中排队并推送排队位置
+    admission = get_admission_controller()
+    try:
+        admission.check(client)
+    except AdmissionRejectedError as e:
+        logger.warning(f"拒绝分析请求（{client}）: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    if profile is not None:
+        # 在返回响应前设置，流式迭代和其中创建的任务都会继承
+        profile.activate()
     try:
-        logger.info("开始处理分析请求")
-        stock_codes = request.stock_codes
-        market_type = request.market_type
-        
-        # 后端再次去重，确保安全
-        original_count = len(stock_codes)
-        stock_codes = list(dict.fromkeys(stock_codes))  # 保持原有顺序的去重方法
-        if len(stock_codes) < original_count:
-            logger.info(f"后端去重: 从{original_count}个代码中移除了{original_count - len(stock_codes)}个重复项")
-        
-        logger.debug(f"接收到分析请求: stock_codes={stock_codes}, market_type={market_type}")
-        
         # 获取自定义API配置
         custom_api_url = request.api_url
         custom_api_key = request.api_key
@@ -195,17 +358,16 @@ async def analyze(request: AnalyzeRequest, username: str = Depends(verify_token)
         
         logger.debug(f"自定义API配置: URL={custom_api_url}, 模型={custom_api_model}, API Key={'已提供' if custom_api_key else '未提供'}, Timeout={custom_api_timeout}")
         
-        # 创建新的分析器实例，使用自定义配置
-        custom_analyzer = StockAnalyzerService(
+        # 在共享的分析服务上叠加自定义配置
+        custom_analyzer = app.state.stock_analyzer.for_request(
             custom_api_url=custom_api_url,
             custom_api_key=custom_api_key,
             custom_api_model=custom_api_model,
             custom_api_timeout=custom_api_timeout
         )
         
-        if not stock_codes:
-            logger.warning("未提供股票代码")
-            raise HTTPException(status_code=400, detail="请输入代码")
+        # 时间预算从收到请求开始计算
+        deadline = Deadline(request.deadline)
         
         # 定义流式生成器
         async def generate_stream():
@@ -214,26 +376,22 @@ async def analyze(request: AnalyzeRequest, username: str = Depends(verify_token)
                 stock_code = stock_codes[0].strip()
                 logger.info(f"开始单股流式分析: {stock_code}")
                 
-                stock_code_json = json.dumps(stock_code)
-                init_message = f'{{"stream_type": "single", "stock_code": {stock_code_json}}}\n'
-                yield init_message
+                yield encode_event({"stream_type": "single", "stock_code": stock_code})
                 
                 logger.debug(f"开始处理股票 {stock_code} 的流式响应")
                 chunk_count = 0
                 
                 # 使用异步生成器
-                async for chunk in custom_analyzer.analyze_stock(stock_code, market_type, stream=True):
+                async for chunk in custom_analyzer.analyze_stock(stock_code, market_type, stream=True, deadline=deadline):
                     chunk_count += 1
-                    yield chunk + '\n'
+                    yield chunk
                 
                 logger.info(f"股票 {stock_code} 流式分析完成，共发送 {chunk_count} 个块")
             else:
                 # 批量分析流式处理
                 logger.info(f"开始批量流式分析: {stock_codes}")
                 
-                stock_codes_json = json.dumps(stock_codes)
-                init_message = f'{{"stream_type": "batch", "stock_codes": {stock_codes_json}}}\n'
-                yield init_message
+                yield encode_event({"stream_type": "batch", "stock_codes": stock_codes})
                 
                 logger.debug(f"开始处理批量股票的流式响应")
                 chunk_count = 0
@@ -243,15 +401,27 @@ async def analyze(request: AnalyzeRequest, username: str = Depends(verify_token)
                     [code.strip() for code in stock_codes], 
                     min_score=0, 
                     market_type=market_type,
-                    stream=True
+                    stream=True,
+                    deadline=deadline
                 ):
                     chunk_count += 1
-                    yield chunk + '\n'
+                    yield chunk
                 
                 logger.info(f"批量流式分析完成，共发送 {chunk_count} 个块")
         
         logger.info("成功创建流式响应生成器")
-        return StreamingResponse(generate_stream(), media_type='application/json')
+        return StreamingResponse(
+            iterate_until_disconnected(
+                http_request,
+                transcode_stream(
+                    admitted_stream(admission, client, profile_stream(generate_stream(), profile) if profile else generate_stream(),
+                                    deadline.timeout(admission.max_wait)),
+                    response_format
+                ),
+                "/api/analyze"
+            ),
+            media_type=MEDIA_TYPES[response_format]
+        )
             
     except Exception as e:
         error_msg = f"分析时出错: {str(e)}"
@@ -259,16 +429,156 @@ async def analyze(request: AnalyzeRequest, username: str = Depends(verify_token)
         logger.exception(e)
         raise HTTPException(status_code=500, detail=error_msg)
 
+# 提交后台扫描任务
+@app.post("/api/scan_jobs")
+async def submit_scan_job(request: ScanJobRequest, client: str = Depends(get_client_id)):
+    """提交后台批量扫描任务，返回任务ID"""
+    stock_codes = [code.strip() for code in dict.fromkeys(request.stock_codes) if code.strip()]
+    if not stock_codes:
+        raise HTTPException(status_code=400, detail="请输入代码")
+    
+    api_config = {
+        'custom_api_url': request.api_url,
+        'custom_api_key': request.api_key,
+        'custom_api_model': request.api_model,
+        'custom_api_timeout': request.api_timeout
+    }
+    try:
+        job = await app.state.scan_job_manager.submit(
+            stock_codes,
+            market_type=request.market_type,
+            min_score=request.min_score,
+            api_config=api_config,
+            owner=client
+        )
+    except JobQueueFullError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=429, detail=str(e))
+    return job
+
+# 获取后台扫描任务状态
+@app.get("/api/scan_jobs/{job_id}")
+async def get_scan_job(job_id: str, client: str = Depends(get_client_id)):
+    """获取后台扫描任务状态和进度"""
+    job = await app.state.scan_job_manager.get_job(job_id, owner=client)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+# 获取后台扫描任务结果
+@app.get("/api/scan_jobs/{job_id}/results")
+async def get_scan_job_results(job_id: str, http_request: Request, after: int = 0, limit: int = 1000,
+                               client: str = Depends(get_client_id)):
+    """
+    获取任务已产生的事件（部分或最终结果），通过after参数增量拉取
+    
+    Accept为MessagePack时返回相同结构的MessagePack；为Arrow时返回after之后全部事件合并成的评分表，
+    任务信息写入表结构元数据的job字段
+    """
+    response_format = negotiate_format(http_request)
+    job = await app.state.scan_job_manager.get_job(job_id, owner=client)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    if response_format == FORMAT_ARROW:
+        events = []
+        while True:
+            page = await app.state.scan_job_manager.get_events(job_id, after, 5000)
+            if not page:
+                break
+            events.extend(item['event'] for item in page)
+            after = page[-1]['seq']
+        return Response(content=encode_score_table(events, {"job": job, "next_after": after}),
+                        media_type=MEDIA_TYPES[FORMAT_ARROW])
+    
+    events = await app.state.scan_job_manager.get_events(job_id, after, min(max(limit, 1), 5000))
+    result = {
+        "job": job,
+        "events": events,
+        "next_after": events[-1]['seq'] if events else after
+    }
+    if response_format == FORMAT_MSGPACK:
+        return Response(content=pack(result), media_type=MEDIA_TYPES[FORMAT_MSGPACK])
+    return result
+
+# 订阅后台扫描任务事件
+@app.get("/api/scan_jobs/{job_id}/stream")
+async def stream_scan_job(job_id: str, http_request: Request, after: int = 0, client: str = Depends(get_client_id)):
+    """以NDJSON流（Accept为MessagePack时为连续的MessagePack对象）的形式回放并持续推送任务事件，直到任务结束"""
+    response_format = negotiate_format(http_request, (FORMAT_JSON, FORMAT_MSGPACK))
+    if await app.state.scan_job_manager.get_job(job_id, owner=client) is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    encode = pack if response_format == FORMAT_MSGPACK else encode_event
+    
+    async def generate_stream():
+        async for event in app.state.scan_job_manager.subscribe(job_id, after):
+            yield encode(event)
+        yield encode({"job": await app.state.scan_job_manager.get_job(job_id)})
+    
+    return StreamingResponse(
+        iterate_until_disconnected(http_request, generate_stream(), "/api/scan_jobs/stream"),
+        media_type=MEDIA_TYPES[response_format]
+    )
+
+# 取消后台扫描任务
+@app.delete("/api/scan_jobs/{job_id}")
+async def cancel_scan_job(job_id: str, client: str = Depends(get_client_id)):
+    """取消排队中或执行中的任务"""
+    job = await app.state.scan_job_manager.cancel(job_id, owner=client)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+# 获取自选股预计算状态
+@app.get("/api/watchlists")
+async def get_watchlists(username: str = Depends(verify_token)):
+    """获取自选股预计算列表的调度状态"""
+    return {"watchlists": app.state.watchlist_scheduler.status()}
+
+# 获取运行指标
+@app.get("/api/metrics")
+async def get_runtime_metrics(username: str = Depends(verify_token)):
+    """获取进程内计数器、各AI接口的延迟和吞吐统计、端点健康状态、令牌缓存命中情况和分析请求排队情况"""
+    return {"counters": get_metrics().snapshot(), "llm": get_llm_telemetry().snapshot(),
+            "endpoints": get_llm_router().status(), "token_cache": get_token_cache().stats(),
+            "admission": get_admission_controller().stats()}
+
+# Prometheus指标
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """以Prometheus文本格式导出本进程的请求、阶段耗时、缓存命中率和队列指标"""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="无效的指标访问令牌", headers={"WWW-Authenticate": "Bearer"})
+    return Response(content=get_metrics().render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# 获取请求剖析的折叠栈
+@app.get("/api/profiles/{profile_id}")
+async def get_profile(profile_id: str, username: str = Depends(verify_token)):
+    """返回剖析请求保存的折叠栈，可直接用flamegraph.pl或speedscope生成火焰图"""
+    folded = load_profile(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="剖析不存在")
+    return Response(content=folded, media_type="text/plain; charset=utf-8")
+
 # 搜索美股代码
 @app.get("/api/search_us_stocks")
-async def search_us_stocks(keyword: str = "", username: str = Depends(verify_token)):
+async def search_us_stocks(request: Request, keyword: str = "", username: str = Depends(verify_token)):
     try:
         if not keyword:
             raise HTTPException(status_code=400, detail="请输入搜索关键词")
         
+        # 结果只随美股列表快照变化，快照未更新时直接返回304
+        snapshot = await us_stock_service.snapshot_time()
+        cached = not_modified(request, make_etag("search_us", snapshot, keyword), snapshot, "search",
+                              REQUIRE_LOGIN, "/api/search_us_stocks")
+        if cached is not None:
+            return cached
+        
         # 直接使用异步服务的异步方法
         results = await us_stock_service.search_us_stocks(keyword)
-        return {"results": results}
+        snapshot = await us_stock_service.snapshot_time()
+        return cacheable_json({"results": results}, make_etag("search_us", snapshot, keyword), snapshot, "search",
+                              REQUIRE_LOGIN)
         
     except Exception as e:
         logger.error(f"搜索美股代码时出错: {str(e)}")
@@ -276,14 +586,23 @@ async def search_us_stocks(keyword: str = "", username: str = Depends(verify_tok
 
 # 搜索基金代码
 @app.get("/api/search_funds")
-async def search_funds(keyword: str = "", market_type: str = "", username: str = Depends(verify_token)):
+async def search_funds(request: Request, keyword: str = "", market_type: str = "", username: str = Depends(verify_token)):
     try:
         if not keyword:
             raise HTTPException(status_code=400, detail="请输入搜索关键词")
         
+        # 结果只随基金列表快照变化，快照未更新时直接返回304
+        snapshot = await fund_service.snapshot_time(market_type)
+        cached = not_modified(request, make_etag("search_funds", snapshot, market_type, keyword), snapshot, "search",
+                              REQUIRE_LOGIN, "/api/search_funds")
+        if cached is not None:
+            return cached
+        
         # 直接使用异步服务的异步方法
         results = await fund_service.search_funds(keyword, market_type)
-        return {"results": results}
+        snapshot = await fund_service.snapshot_time(market_type)
+        return cacheable_json({"results": results}, make_etag("search_funds", snapshot, market_type, keyword), snapshot,
+                              "search", REQUIRE_LOGIN)
         
     except Exception as e:
         logger.error(f"搜索基金代码时出错: {str(e)}")
@@ -291,14 +610,21 @@ async def search_funds(keyword: str = "", market_type: str = "", username: str =
 
 # 获取美股详情
 @app.get("/api/us_stock_detail/{symbol}")
-async def get_us_stock_detail(symbol: str, username: str = Depends(verify_token)):
+async def get_us_stock_detail(symbol: str, request: Request, username: str = Depends(verify_token)):
     try:
         if not symbol:
             raise HTTPException(status_code=400, detail="请提供股票代码")
         
+        snapshot = await us_stock_service.snapshot_time()
+        cached = not_modified(request, make_etag("us_detail", snapshot, symbol), snapshot, "detail",
+                              REQUIRE_LOGIN, "/api/us_stock_detail")
+        if cached is not None:
+            return cached
+        
         # 使用异步服务获取详情
         detail = await us_stock_service.get_us_stock_detail(symbol)
-        return detail
+        snapshot = await us_stock_service.snapshot_time()
+        return cacheable_json(detail, make_etag("us_detail", snapshot, symbol), snapshot, "detail", REQUIRE_LOGIN)
         
     except Exception as e:
         logger.error(f"获取美股详情时出错: {str(e)}")
@@ -306,14 +632,22 @@ async def get_us_stock_detail(symbol: str, username: str = Depends(verify_token)
 
 # 获取基金详情
 @app.get("/api/fund_detail/{symbol}")
-async def get_fund_detail(symbol: str, market_type: str = "ETF", username: str = Depends(verify_token)):
+async def get_fund_detail(symbol: str, request: Request, market_type: str = "ETF", username: str = Depends(verify_token)):
     try:
         if not symbol:
             raise HTTPException(status_code=400, detail="请提供基金代码")
         
+        snapshot = await fund_service.snapshot_time(market_type)
+        cached = not_modified(request, make_etag("fund_detail", snapshot, market_type, symbol), snapshot, "detail",
+                              REQUIRE_LOGIN, "/api/fund_detail")
+        if cached is not None:
+            return cached
+        
         # 使用异步服务获取详情
         detail = await fund_service.get_fund_detail(symbol, market_type)
-        return detail
+        snapshot = await fund_service.snapshot_time(market_type)
+        return cacheable_json(detail, make_etag("fund_detail", snapshot, market_type, symbol), snapshot, "detail",
+                              REQUIRE_LOGIN)
         
     except Exception as e:
         logger.error(f"获取基金详情时出错: {str(e)}")
@@ -344,22 +678,23 @@ async def test_api_connection(request: TestAPIRequest, username: str = Depends(v
         test_url = APIUtils.format_api_url(api_url)
         logger.debug(f"完整API测试URL: {test_url}")
         
-        # 使用异步HTTP客户端发送测试请求
-        async with httpx.AsyncClient(timeout=float(api_timeout)) as client:
-            response = await client.post(
-                test_url,
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": api_model or "",
-                    "messages": [
-                        {"role": "user", "content": "Hello, this is a test message. Please respond with 'API connection successful'."}
-                    ],
-                    "max_tokens": 20
-                }
-            )
+        # 使用共享的HTTP客户端发送测试请求，测试建立的连接可被后续分析复用
+        client = get_http_client_pool().get_client(test_url)
+        response = await client.post(
+            test_url,
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "model": api_model or "",
+                "messages": [
+                    {"role": "user", "content": "Hello, this is a test message. Please respond with 'API connection successful'."}
+                ],
+                "max_tokens": 20
+            },
+            timeout=float(api_timeout)
+        )
         
         # 检查响应
         if response.status_code == 200:
@@ -405,4 +740,5 @@ else:
 
 
 if __name__ == '__main__':
-    uvicorn.run("web_server:app", host="0.0.0.0", port=8888, reload=True)
\ No newline at end of file
+    # APP_ENV=production时以多工作进程运行，否则为单进程自动重载的开发模式
+    uvicorn.run("web_server:app", **get_uvicorn_options())
\ No newline at end of file